@@ -0,0 +1,405 @@
+"""Times the commands that depend on other sites, against a stand-in server instead of the real sites
+
+Every pattern here runs a command (or background check) from the Links, Osu, Overwatch, Twitch, Picarto, Deviantart
+and Strawpoll cogs, through the same code the bot runs; discord itself is left out, and so is making the banner
+images, which only time PIL. Their requests go to benchmarks/mock_upstream.py (see http_base_url), which answers with
+the saved responses in benchmarks/fixtures/upstream.json, and can be made slow or unreliable like a real site
+Anything the commands look up in the database is ran against an in-memory database (see cogs/utils/memorydb.py)
+
+Each pattern is ran with more and more of it running at the same time, starting from a fresh response cache,
+rate limiter and circuit breaker each time. For each this prints how many commands a second finished,
+the p50/p99/max time each took, how many requests actually reached the site for each command, and how many failed
+Save the results with --output to compare them between commits
+
+Run this from the root folder of the bot, it needs the same config.yml the bot does:
+    python benchmarks/api_cogs.py
+    python benchmarks/api_cogs.py --concurrency 1 10 100 --latency 0.1 --error-rate 0.05 --throttle-rate 0.05
+    python benchmarks/api_cogs.py --patterns wiki osu_user --distinct 1 --no-cache --output results.json"""
+
+import argparse
+import asyncio
+import collections
+import contextlib
+import io
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import rethinkdb as r  # noqa: E402
+
+from benchmarks.mock_upstream import MockUpstream, load_fixtures  # noqa: E402
+from cogs import da, links, osu, overwatch, picarto, strawpoll, twitch  # noqa: E402
+from cogs.utils import config, images, utilities, web  # noqa: E402
+from cogs.utils.checks import db_check  # noqa: E402
+from cogs.utils.database import ConnectionPool  # noqa: E402
+from cogs.utils.httpcache import ResponseCache  # noqa: E402
+from cogs.utils.memorydb import MemoryDatabase  # noqa: E402
+from cogs.utils.ratelimit import RateLimiter  # noqa: E402
+from cogs.utils.requeststats import RequestStats  # noqa: E402
+from cogs.utils.retry import CircuitBreaker  # noqa: E402
+
+loop = asyncio.get_event_loop()
+
+# Only the attributes the commands actually look at
+Server = collections.namedtuple('Server', ['id', 'members'])
+Channel = collections.namedtuple('Channel', ['id', 'is_private'])
+Message = collections.namedtuple('Message', ['server', 'channel', 'author', 'content'])
+Context = collections.namedtuple('Context', ['message', 'prefix', 'command'])
+Command = collections.namedtuple('Command', ['qualified_name'])
+
+
+class Member(collections.namedtuple('Member', ['id', 'name', 'display_name', 'avatar_url'])):
+    @property
+    def mention(self):
+        return '<@{}>'.format(self.id)
+
+
+class Bot:
+    """Stands in for the bot, anything that would be sent to discord is just counted"""
+
+    def __init__(self, members):
+        self.loop = loop
+        self.is_closed = False
+        self.members = members
+        self.messages = 0
+
+    async def say(self, *args, **kwargs):
+        self.messages += 1
+
+    send_message = say
+    upload = say
+
+    def get_all_members(self):
+        return self.members
+
+    def get_server(self, server_id):
+        return None
+
+    def get_channel(self, channel_id):
+        return None
+
+
+async def no_banner(*args, **kwargs):
+    # The cogs send the stats as text instead when a banner can't be made
+    raise FileNotFoundError
+
+
+def member_id(i):
+    return str(100000000000000000 + i)
+
+
+server_id = str(200000000000000000)
+members = [Member(member_id(i), 'User{}'.format(i), 'User{}'.format(i), '') for i in range(100)]
+bot = Bot(members)
+server = Server(server_id, members)
+
+# The format for this is {name: setup}, setup saves anything needed and returns the operation to time
+# The operation is given a number, which is used to pick the query out of --distinct different ones
+patterns = collections.OrderedDict()
+
+
+def pattern(func):
+    patterns[func.__name__] = func
+    return func
+
+
+def context(i):
+    message = Message(server, Channel('1', False), members[i % len(members)], '')
+    return Context(message, '!', Command(''))
+
+
+async def seed(table, rows):
+    rows = list(rows)
+    if table in config.table_keys:
+        for row in rows:
+            row['id'] = config.primary_key(table, row)
+    await config.pool.run(r.table(table).insert(rows, conflict='replace'))
+
+
+@pattern
+async def wiki(distinct):
+    cog = links.Links(bot)
+
+    async def op(i):
+        await links.Links.wiki.callback(cog, context(i), query='Test {}'.format(i % distinct))
+
+    return op
+
+
+@pattern
+async def urban(distinct):
+    cog = links.Links(bot)
+
+    async def op(i):
+        await links.Links.urban.callback(cog, context(i), msg='phrase {}'.format(i % distinct))
+
+    return op
+
+
+@pattern
+async def youtube(distinct):
+    cog = links.Links(bot)
+
+    async def op(i):
+        await links.Links.youtube.callback(cog, context(i), query='video {}'.format(i % distinct))
+
+    return op
+
+
+@pattern
+async def derpi(distinct):
+    # Two requests, one for the first page and one for a random page
+    cog = links.Links(bot)
+
+    async def op(i):
+        await links.Links.derpi.callback(cog, context(i), 'rainbow', 'dash{}'.format(i % distinct))
+
+    return op
+
+
+@pattern
+async def e621(distinct):
+    cog = links.Links(bot)
+
+    async def op(i):
+        await links.Links.e621.callback(cog, context(i), tags='canine{}'.format(i % distinct))
+
+    return op
+
+
+@pattern
+async def osu_user(distinct):
+    cog = osu.Osu(bot)
+
+    async def op(i):
+        await osu.Osu.osu_user_info.callback(cog, context(i), user='someone{}'.format(i % distinct))
+
+    return op
+
+
+@pattern
+async def ow_stats(distinct):
+    cog = overwatch.Overwatch(bot)
+    await seed('overwatch', ({'member_id': member.id, 'battletag': 'User-{}'.format(i % distinct)}
+                             for i, member in enumerate(members)))
+
+    async def op(i):
+        await overwatch.Overwatch.ow_stats.callback(cog, context(i), members[i % len(members)])
+
+    return op
+
+
+async def seed_streams(table, url):
+    await seed(table, ({'member_id': member.id, '{}_url'.format(table): url.format(i), 'servers': [server_id],
+                        'live': 0, 'notifications_on': 1} for i, member in enumerate(members)))
+
+
+@pattern
+async def twitch_info(distinct):
+    cog = twitch.Twitch(bot)
+    await seed_streams('twitch', 'https://www.twitch.tv/user{}')
+
+    async def op(i):
+        await twitch.Twitch.twitch.callback(cog, context(i), member=members[i % distinct % len(members)])
+
+    return op
+
+
+@pattern
+async def twitch_online(distinct):
+    # What the background check does for every channel
+    cog = twitch.Twitch(bot)
+
+    async def op(i):
+        await cog.channel_online('user{}'.format(i % distinct))
+
+    return op
+
+
+@pattern
+async def picarto_info(distinct):
+    cog = picarto.Picarto(bot)
+    await seed_streams('picarto', 'https://www.picarto.tv/user{}')
+
+    async def op(i):
+        await picarto.Picarto.picarto.callback(cog, context(i), members[i % distinct % len(members)])
+
+    return op
+
+
+@pattern
+async def picarto_online(distinct):
+    # The one request the background check makes
+    async def op(i):
+        await picarto.online_users()
+
+    return op
+
+
+@pattern
+async def deviantart_posts(distinct):
+    # One pass of the background check, skipping __init__ so that it's tasks aren't started
+    cog = da.Deviantart.__new__(da.Deviantart)
+    cog.bot = bot
+    cog.base_url = "https://www.deviantart.com/api/v1/oauth2/gallery/all"
+    cog.params = {'access_token': 'token'}
+    await seed('deviantart', ({'member_id': member.id, 'subbed': ['artist{}'.format(i % distinct)],
+                               'last_updated': {}} for i, member in enumerate(members[:10])))
+
+    async def op(i):
+        await cog.check_posts()
+
+    return op
+
+
+@pattern
+async def strawpoll_show(distinct):
+    cog = strawpoll.Strawpoll(bot)
+    polls = [{'poll_id': str(1000 + i), 'author': members[0].id, 'date': '2017-03-01T12:00:00+00:00',
+              'title': 'A poll'} for i in range(distinct)]
+    await seed('strawpolls', [{'server_id': server_id, 'polls': polls}])
+
+    async def op(i):
+        await strawpoll.Strawpoll.strawpolls.callback(cog, context(i), str(1000 + i % distinct))
+
+    return op
+
+
+@pattern
+async def strawpoll_create(distinct):
+    cog = strawpoll.Strawpoll(bot)
+
+    async def op(i):
+        await strawpoll.Strawpoll.create_strawpoll.callback(cog, context(i), 'A poll', options='`Yes` `No`')
+
+    return op
+
+
+def percentile(times, percent):
+    return times[max(int(math.ceil(len(times) * percent / 100)) - 1, 0)]
+
+
+def reset_http(args):
+    """Starts off with nothing left over from the last run"""
+    utilities.response_cache = ResponseCache({} if args.no_cache else config.http_cache_ttl or {},
+                                             stale=config.http_cache_stale, max_size=config.http_cache_size)
+    utilities.single_flight = web.SingleFlight()
+    utilities.rate_limiter = RateLimiter({} if args.no_rate_limit else config.http_rate_limits or {},
+                                         reserve=config.http_rate_reserve)
+    utilities.circuit_breaker = CircuitBreaker(threshold=config.http_circuit_threshold,
+                                               reset_timeout=config.http_circuit_reset)
+    utilities.request_stats = web.request_stats = RequestStats(slow_threshold=0)
+
+
+async def run(name, concurrency, upstream, args):
+    """Runs the pattern called name this many at a time, returns the results as a dictionary"""
+    database = MemoryDatabase()
+    config.pool = ConnectionPool(database.connect, min_size=1, max_size=config.db_pool_max, timeout=config.db_timeout)
+    config.query_cache = config.QueryCache(config.query_cache_ttl or {}, max_size=config.query_cache_size)
+    reset_http(args)
+    upstream.reset()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            await db_check()
+        op = await patterns[name](args.distinct)
+
+        times = []
+        errors = collections.Counter()
+        counter = iter(range(args.max_ops))
+        start = time.perf_counter()
+
+        async def worker():
+            for i in counter:
+                if times and time.perf_counter() - start > args.duration:
+                    return
+                op_start = time.perf_counter()
+                try:
+                    await op(i)
+                except Exception as e:
+                    errors[type(e).__name__] += 1
+                times.append(time.perf_counter() - op_start)
+
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+    finally:
+        await config.pool.close()
+
+    times.sort()
+    upstream_requests = sum(upstream.requests.values())
+    return {'pattern': name, 'concurrency': concurrency, 'ops': len(times), 'ops_per_sec': len(times) / elapsed,
+            'p50_ms': percentile(times, 50) * 1000, 'p99_ms': percentile(times, 99) * 1000,
+            'max_ms': times[-1] * 1000, 'upstream_per_op': upstream_requests / len(times),
+            'upstream_statuses': {str(k): v for k, v in upstream.statuses.items()},
+            'errors': sum(errors.values()), 'error_types': dict(errors),
+            'deduplicated': utilities.single_flight.deduplicated}
+
+
+def commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16, 64])
+    parser.add_argument('--patterns', nargs='+', choices=list(patterns), default=list(patterns))
+    parser.add_argument('--distinct', type=int, default=10, help="How many different queries each pattern uses")
+    parser.add_argument('--latency', type=float, default=0.05, help="Seconds the stand-in site waits to answer")
+    parser.add_argument('--jitter', type=float, default=0.02, help="Up to this many seconds more are waited")
+    parser.add_argument('--error-rate', type=float, default=0, help="The share of requests answered with a 500")
+    parser.add_argument('--throttle-rate', type=float, default=0, help="The share of requests answered with a 429")
+    parser.add_argument('--no-cache', action='store_true', help="Don't use the response cache")
+    parser.add_argument('--no-rate-limit', action='store_true', help="Don't limit how fast requests are sent")
+    parser.add_argument('--duration', type=float, default=3, help="Seconds to spend timing each pattern and level")
+    parser.add_argument('--max-ops', type=int, default=5000, help="The most operations to time for each")
+    parser.add_argument('--seed', type=int, default=0, help="Seed for the random failures and choices")
+    parser.add_argument('--output', help="A file to save the results to as JSON, or - to print just the JSON")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    images.create_banner = no_banner
+    upstream = MockUpstream(load_fixtures(), latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                            throttle_rate=args.throttle_rate)
+    web.http_session.base_url = loop.run_until_complete(upstream.start())
+
+    show = args.output != '-'
+    results = []
+    if show:
+        print("{:<18} {:>6} {:>7} {:>10} {:>10} {:>10} {:>10} {:>12} {:>7}".format(
+            "pattern", "conc", "ops", "ops/sec", "p50 (ms)", "p99 (ms)", "max (ms)", "upstream/op", "errors"))
+    try:
+        for name in args.patterns:
+            for concurrency in args.concurrency:
+                result = loop.run_until_complete(run(name, concurrency, upstream, args))
+                results.append(result)
+                if show:
+                    print("{pattern:<18} {concurrency:>6} {ops:>7} {ops_per_sec:>10.1f} {p50_ms:>10.2f} "
+                          "{p99_ms:>10.2f} {max_ms:>10.2f} {upstream_per_op:>12.3f} {errors:>7}".format(**result),
+                          flush=True)
+    finally:
+        loop.run_until_complete(web.http_session.close())
+        loop.run_until_complete(upstream.stop())
+
+    output = {'commit': commit(), 'python': platform.python_version(), 'latency': args.latency,
+              'jitter': args.jitter, 'error_rate': args.error_rate, 'throttle_rate': args.throttle_rate,
+              'distinct': args.distinct, 'cache': not args.no_cache, 'rate_limit': not args.no_rate_limit,
+              'duration': args.duration, 'seed': args.seed, 'results': results}
+    if args.output == '-':
+        print(json.dumps(output, indent=2))
+    elif args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
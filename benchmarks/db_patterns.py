@@ -0,0 +1,338 @@
+"""Times the ways the bot uses the database, against tables of different sizes
+
+Every pattern here does the same reads and writes a command or task in the bot does, using the same helpers
+(discord itself is left out, just the database side of things is ran). Each one is ran against a fresh
+in-memory database (see cogs/utils/memorydb.py) that has been filled to the size being tested, with a delay
+added to every query to act like a database over the network; so this doesn't need RethinkDB to be running
+
+For each pattern and size this prints how many operations a second could be done, the p50/p99/max time each
+took, and how many queries (round trips) each needed; every batch of rows read from a cursor counts as one
+Save the results with --output to compare them between commits
+
+Run this from the root folder of the bot, it needs the same config.yml the bot does:
+    python benchmarks/db_patterns.py
+    python benchmarks/db_patterns.py --sizes 1000 1000000 --latency 0.001 --output results.json
+    python benchmarks/db_patterns.py --patterns boop leaderboard"""
+
+import argparse
+import asyncio
+import collections
+import contextlib
+import io
+import itertools
+import json
+import math
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pendulum  # noqa: E402
+import rethinkdb as r  # noqa: E402
+
+from cogs.utils import config  # noqa: E402
+from cogs.utils.checks import custom_perms, db_check  # noqa: E402
+from cogs.utils.database import ConnectionPool  # noqa: E402
+from cogs.utils.memorydb import MemoryDatabase  # noqa: E402
+from cogs.utils.ranking import Rankings  # noqa: E402
+from cogs.utils.usage import UsageBuffer  # noqa: E402
+
+loop = asyncio.get_event_loop()
+
+# Only the attributes the patterns actually look at
+Server = collections.namedtuple('Server', ['id'])
+Channel = collections.namedtuple('Channel', ['id', 'is_private'])
+Command = collections.namedtuple('Command', ['qualified_name'])
+Message = collections.namedtuple('Message', ['server', 'channel', 'author', 'content'])
+Context = collections.namedtuple('Context', ['message', 'command'])
+Permissions = collections.namedtuple('Permissions', ['value'])
+
+
+class Member(collections.namedtuple('Member', ['id', 'value'])):
+    def permissions_in(self, channel):
+        return Permissions(self.value)
+
+
+commands = ['help', 'boop', 'tag', 'stats', 'leaderboard', 'battle', 'hug', 'roll', 'urban', 'weather']
+
+# The format for this is {name: setup}, setup fills the tables for a size and returns the operation to time
+patterns = collections.OrderedDict()
+
+
+def pattern(func):
+    patterns[func.__name__] = func
+    return func
+
+
+def member_id(i):
+    return str(100000000000000000 + i)
+
+
+def server_id(i):
+    return str(200000000000000000 + i)
+
+
+async def seed(table, rows, batch_size=10000):
+    """Inserts rows (which can be a generator) into table, in batches so that it's not one massive query"""
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            break
+        if table in config.table_keys:
+            for row in batch:
+                row['id'] = config.primary_key(table, row)
+        await config.pool.run(r.table(table).insert(batch, conflict='replace'))
+
+
+@pattern
+async def usage_writes(size):
+    # bot.py's on_command adds to the usage buffer, which writes everything that's pending in one go
+    servers = max(size // 100, 1)
+    await seed('command_member_usage', ({'command': commands[i % len(commands)], 'member_id': member_id(i),
+                                         'usage': 1} for i in range(size)))
+    await seed('command_server_usage', ({'command': commands[i % len(commands)], 'server_id': server_id(i),
+                                         'usage': 1} for i in range(size)))
+    await seed('command_usage', ({'command': command, 'total_usage': size} for command in commands))
+    # The flushing is done here instead of on a timer, so the time it takes is part of the operation that caused it
+    usage = UsageBuffer(max_pending=float('inf'))
+    batch = config.usage_max_pending
+
+    async def op():
+        usage.add(random.choice(commands), server_id(random.randrange(servers)), member_id(random.randrange(size)))
+        if len(usage.pending) >= batch:
+            await usage.flush()
+
+    return op
+
+
+@pattern
+async def command_prefix(size):
+    # Ran for every message the bot sees, this is answered from the prefix cache
+    await seed('prefixes', ({'server_id': server_id(i), 'prefix': ['?', '??', 'bot '] if i % 10 == 0 else '?'}
+                            for i in range(size)))
+    rows = {}
+    async for row in config.iter_content('prefixes'):
+        rows[row['id']] = row
+    config.cache['prefixes'].load(rows)
+
+    async def op():
+        message = Message(Server(server_id(random.randrange(size))), None, None,
+                          random.choice(['??help', '?help', 'bot help', 'hi']))
+        config.command_prefix(None, message)
+
+    return op
+
+
+@pattern
+async def custom_perms_check(size):
+    # The check on every command using custom_perms, answered from the custom permissions cache
+    await seed('custom_permissions', ({'server_id': server_id(i), 'boop': 0, 'tag': 8 if i % 2 else 0}
+                                      for i in range(size)))
+    rows = {}
+    async for row in config.iter_content('custom_permissions'):
+        rows[row['id']] = row
+    config.cache['custom_permissions'].load(rows)
+
+    @custom_perms(send_messages=True)
+    async def command():
+        pass
+
+    check = command.__commands_checks__[0]
+    channel = Channel('1', False)
+
+    async def op():
+        member = Member(member_id(0), random.choice([0, 2048, 2056]))
+        message = Message(Server(server_id(random.randrange(size))), channel, member, '!tag')
+        check(Context(message, Command(random.choice(['boop', 'tag', 'help']))))
+
+    return op
+
+
+@pattern
+async def boop(size):
+    # Interaction.boop, adding one to the amount of times the booper has booped someone
+    await seed('boops', ({'member_id': member_id(i), 'boops': {member_id(i + j): j for j in range(1, 6)}}
+                         for i in range(size)))
+
+    async def op():
+        booper = member_id(random.randrange(size))
+        boopee = member_id(random.randrange(size))
+        await config.increment_map_key('boops', {'member_id': booper}, 'boops', boopee)
+
+    return op
+
+
+async def seed_battle_records(size):
+    await seed('battle_records', ({'member_id': member_id(i), 'rating': random.randint(800, 1600), 'wins': 0,
+                                   'losses': 0} for i in range(size)))
+    return Rankings('battle_records')
+
+
+@pattern
+async def leaderboard(size):
+    # Stats.leaderboard for a server of 1000 members, not all of which have battled
+    rankings = await seed_battle_records(size)
+
+    async def op():
+        members = [member_id(random.randrange(size * 2)) for _ in range(1000)]
+        battles = await rankings.server_ratings(members)
+        ["{} (Rating: {})".format(x['member_id'], x['rating']) for x in battles]
+
+    return op
+
+
+@pattern
+async def leaderboard_global(size):
+    # Stats.leaderboard global, which is the top 100 of everyone
+    rankings = await seed_battle_records(size)
+
+    async def op():
+        battles = await rankings.top(100)
+        ["{} (Rating: {})".format(x['member_id'], x['rating']) for x in battles]
+
+    return op
+
+
+async def seed_streams(table, size, url):
+    await seed(table, ({'member_id': member_id(i), '{}_url'.format(table): url.format(i), 'servers': [server_id(i)],
+                        'live': 0, 'notifications_on': i % 2} for i in range(size)))
+
+
+@pattern
+async def twitch_poll(size):
+    # One pass of Twitch.check_channels, without asking Twitch whether anyone is live
+    await seed_streams('twitch', size, 'https://www.twitch.tv/user{}')
+    online_users = set()
+
+    async def op():
+        twitch = config.iter_content('twitch', {'notifications_on': 1}, pluck=['member_id', 'twitch_url', 'servers',
+                                                                               'live'])
+        async for result in twitch:
+            online = re.search("(?<=twitch.tv/)(.*)", result['twitch_url']).group(1) in online_users
+            if online == bool(result['live']):
+                continue
+
+    return op
+
+
+@pattern
+async def picarto_poll(size):
+    # One pass of Picarto.check_channels, without asking Picarto who is online
+    await seed_streams('picarto', size, 'https://picarto.tv/user{}')
+    online_users = set()
+
+    async def op():
+        picarto = config.iter_content('picarto', {'notifications_on': 1}, pluck=['member_id', 'picarto_url', 'servers',
+                                                                                 'live'])
+        async for result in picarto:
+            online = re.search("(?<=picarto.tv/)(.*)", result['picarto_url']).group(1).lower() in online_users
+            if online == bool(result['live']):
+                continue
+
+    return op
+
+
+@pattern
+async def check_raffles(size):
+    # One pass of Raffle.check_raffles, where none of the raffles have ended yet
+    expires = str(pendulum.utcnow().add(days=1))
+    await seed('raffles', ({'id': str(i), 'server_id': server_id(i), 'expires': expires, 'title': 'Raffle',
+                            'entrants': [member_id(i)]} for i in range(size)))
+    now = pendulum.utcnow()
+
+    async def op():
+        raffles = config.iter_content('raffles', pluck=['id', 'server_id', 'expires', 'title', 'entrants'])
+        async for raffle in raffles:
+            if pendulum.parse(raffle['expires']) > now:
+                continue
+
+    return op
+
+
+def percentile(times, percent):
+    return times[max(int(math.ceil(len(times) * percent / 100)) - 1, 0)]
+
+
+async def run(name, size, args):
+    """Runs the pattern called name against a new database filled to size, returns the results as a dictionary"""
+    database = MemoryDatabase()
+    config.pool = ConnectionPool(database.connect, min_size=1, max_size=config.db_pool_max, timeout=config.db_timeout)
+    # Start off with an empty query cache as well, so nothing is left over from the last database
+    config.query_cache = config.QueryCache(config.query_cache_ttl or {}, max_size=config.query_cache_size)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            await db_check()
+        op = await patterns[name](size)
+        # One untimed run first, so things that are only loaded once aren't counted
+        await op()
+
+        database.latency = args.latency
+        queries = database.queries
+        times = []
+        start = time.perf_counter()
+        while len(times) < args.max_ops and (not times or time.perf_counter() - start < args.duration):
+            op_start = time.perf_counter()
+            await op()
+            times.append(time.perf_counter() - op_start)
+        elapsed = time.perf_counter() - start
+        queries = database.queries - queries
+    finally:
+        await config.pool.close()
+
+    times.sort()
+    return {'pattern': name, 'size': size, 'ops': len(times), 'ops_per_sec': len(times) / elapsed,
+            'p50_ms': percentile(times, 50) * 1000, 'p99_ms': percentile(times, 99) * 1000, 'max_ms': times[-1] * 1000,
+            'round_trips_per_op': queries / len(times)}
+
+
+def commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    # 1000000 works as well, but filling each table to that takes a few minutes
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--patterns', nargs='+', choices=list(patterns), default=list(patterns))
+    parser.add_argument('--latency', type=float, default=0.0005, help="Seconds added to every query")
+    parser.add_argument('--duration', type=float, default=2, help="Seconds to spend timing each pattern and size")
+    parser.add_argument('--max-ops', type=int, default=10000, help="The most operations to time for each")
+    parser.add_argument('--seed', type=int, default=0, help="Seed for the random rows and lookups")
+    parser.add_argument('--output', help="A file to save the results to as JSON, or - to print just the JSON")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    show = args.output != '-'
+    results = []
+    if show:
+        print("{:<20} {:>8} {:>8} {:>12} {:>10} {:>10} {:>10} {:>12}".format(
+            "pattern", "size", "ops", "ops/sec", "p50 (ms)", "p99 (ms)", "max (ms)", "round trips"))
+    for name in args.patterns:
+        for size in args.sizes:
+            result = loop.run_until_complete(run(name, size, args))
+            results.append(result)
+            if show:
+                print("{pattern:<20} {size:>8} {ops:>8} {ops_per_sec:>12.1f} {p50_ms:>10.3f} {p99_ms:>10.3f} "
+                      "{max_ms:>10.3f} {round_trips_per_op:>12.3f}".format(**result), flush=True)
+
+    output = {'commit': commit(), 'python': platform.python_version(), 'latency': args.latency,
+              'duration': args.duration, 'seed': args.seed, 'results': results}
+    if args.output == '-':
+        print(json.dumps(output, indent=2))
+    elif args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
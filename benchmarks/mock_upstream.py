@@ -0,0 +1,175 @@
+"""A stand-in for the sites the API cogs talk to, that answers with the responses saved in fixtures/upstream.json
+
+Requests are expected in the form /{host}/{path}, which is what the bot sends when http_base_url is set to this
+server (https://api.twitch.tv/kraken/streams/name becomes http://localhost:8900/api.twitch.tv/kraken/streams/name)
+Each fixture is matched on the method, host and path (a regex), and can have it's own status and headers
+If a fixture has an ETag and the request sends the same one back in If-None-Match, a 304 is returned instead
+
+To act like a real site this can wait before answering, fail a share of requests with a 500,
+and throttle a share with a 429 (with a Retry-After header)
+
+Run this from the root folder of the bot:
+    python benchmarks/mock_upstream.py
+    python benchmarks/mock_upstream.py --port 8900 --latency 0.05 --jitter 0.02 --error-rate 0.01 --throttle-rate 0.05
+
+It can also be started from another script (like benchmarks/api_cogs.py), see MockUpstream"""
+
+import argparse
+import asyncio
+import collections
+import json
+import os
+import random
+import re
+
+from aiohttp import web
+
+loop = asyncio.get_event_loop()
+
+fixtures_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'upstream.json')
+
+
+class Fixture:
+    """One saved response, and what requests it's used for"""
+
+    def __init__(self, host, path, *, method='GET', status=200, headers=None, json=None, text=None,
+                 content_type=None):
+        self.method = method
+        self.host = host
+        self.path = re.compile(path)
+        self.status = status
+        self.headers = headers or {}
+        if json is not None:
+            self.body = _dumps(json)
+            self.content_type = content_type or 'application/json'
+        else:
+            self.body = (text or '').encode()
+            self.content_type = content_type or 'text/plain'
+
+    def matches(self, method, host, path):
+        return self.method == method and self.host == host and self.path.fullmatch(path) is not None
+
+
+def _dumps(value):
+    return json.dumps(value).encode()
+
+
+def load_fixtures(path=fixtures_path):
+    with open(path) as f:
+        return [Fixture(**entry) for entry in json.load(f)]
+
+
+class MockUpstream:
+    """The server itself
+
+    Paramaters:
+        fixtures -> The list of Fixtures to answer with, the first one that matches a request is used
+        latency -> How long (in seconds) to wait before answering each request
+        jitter -> Up to this much (in seconds) more is randomly added to the wait
+        error_rate -> The share (from 0 to 1) of requests that are answered with a 500
+        throttle_rate -> The share (from 0 to 1) of requests that are answered with a 429
+        retry_after -> The Retry-After (in seconds) sent with a 429"""
+
+    def __init__(self, fixtures, *, latency=0, jitter=0, error_rate=0, throttle_rate=0, retry_after=1):
+        self.fixtures = fixtures
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.app = web.Application()
+        self.app.router.add_route('*', '/{host}/{path:.*}', self.handle)
+        self._handler = None
+        self._server = None
+
+        # The format for this is {(method, host, path): count}
+        self.requests = collections.Counter()
+        self.statuses = collections.Counter()
+
+    async def handle(self, request):
+        host = request.match_info['host']
+        path = '/' + request.match_info['path']
+        self.requests[(request.method, host, path)] += 1
+
+        wait = self.latency + random.uniform(0, self.jitter)
+        if wait:
+            await asyncio.sleep(wait)
+
+        roll = random.random()
+        if roll < self.throttle_rate:
+            return self._respond(web.Response(status=429, headers={'Retry-After': str(self.retry_after)}))
+        if roll < self.throttle_rate + self.error_rate:
+            return self._respond(web.Response(status=500))
+
+        for fixture in self.fixtures:
+            if fixture.matches(request.method, host, path):
+                break
+        else:
+            return self._respond(web.Response(status=404))
+
+        headers = dict(fixture.headers)
+        # Redirects within the site need to stay under it's host, or they'd be sent to a host that doesn't exist here
+        location = headers.get('Location')
+        if location is not None and location.startswith('/'):
+            headers['Location'] = '/{}{}'.format(host, location)
+        etag = headers.get('ETag')
+        if etag is not None and request.headers.get('If-None-Match') == etag:
+            return self._respond(web.Response(status=304, headers=headers))
+        return self._respond(web.Response(status=fixture.status, headers=headers, body=fixture.body,
+                                          content_type=fixture.content_type))
+
+    def _respond(self, response):
+        self.statuses[response.status] += 1
+        return response
+
+    async def start(self, host='127.0.0.1', port=0):
+        """Starts the server, and returns the base URL for it; if port is 0 an open port is picked"""
+        self._handler = self.app.make_handler()
+        self._server = await loop.create_server(self._handler, host, port)
+        port = self._server.sockets[0].getsockname()[1]
+        return 'http://{}:{}'.format(host, port)
+
+    async def stop(self):
+        if self._server is None:
+            return
+        self._server.close()
+        await self._server.wait_closed()
+        await self.app.shutdown()
+        # This is finish_connections in aiohttp 1.0 (what discord.py needs), and shutdown after that
+        shutdown = getattr(self._handler, 'shutdown', None) or self._handler.finish_connections
+        await shutdown(1)
+        await self.app.cleanup()
+        self._server = None
+
+    def reset(self):
+        self.requests.clear()
+        self.statuses.clear()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--fixtures', default=fixtures_path, help="The JSON file of responses to answer with")
+    parser.add_argument('--latency', type=float, default=0, help="Seconds to wait before answering each request")
+    parser.add_argument('--jitter', type=float, default=0, help="Up to this many seconds more is randomly waited")
+    parser.add_argument('--error-rate', type=float, default=0, help="The share of requests answered with a 500")
+    parser.add_argument('--throttle-rate', type=float, default=0, help="The share of requests answered with a 429")
+    parser.add_argument('--retry-after', type=int, default=1, help="The Retry-After sent with a 429")
+    args = parser.parse_args()
+
+    server = MockUpstream(load_fixtures(args.fixtures), latency=args.latency, jitter=args.jitter,
+                          error_rate=args.error_rate, throttle_rate=args.throttle_rate, retry_after=args.retry_after)
+    url = loop.run_until_complete(server.start(args.host, args.port))
+    print("Serving {} fixtures at {}, set http_base_url to this to send the bot's requests here".format(
+        len(server.fixtures), url))
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.run_until_complete(server.stop())
+
+
+if __name__ == '__main__':
+    main()
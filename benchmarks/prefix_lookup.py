@@ -0,0 +1,74 @@
+"""Times config.command_prefix, which is ran for every message the bot sees
+
+This fills the prefix cache with a fake table of the given sizes, then times looking up the prefix of a message
+against it; the old way of finding a prefix (scanning every row) is timed alongside it for comparison
+
+Run this from the root folder of the bot, it needs the same config.yml the bot does:
+    python benchmarks/prefix_lookup.py
+    python benchmarks/prefix_lookup.py --sizes 10000 100000 --number 100000"""
+
+import argparse
+import collections
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cogs.utils import config  # noqa: E402
+
+# Only the attributes command_prefix actually looks at
+Server = collections.namedtuple('Server', ['id'])
+Message = collections.namedtuple('Message', ['server', 'content'])
+
+
+def make_rows(amount):
+    rows = {}
+    for i in range(amount):
+        server_id = str(100000000000000000 + i)
+        # Give some servers more than one prefix, so that the matching is actually tested as well
+        prefix = ['?', '??', 'bot '] if i % 10 == 0 else '?'
+        rows[server_id] = {'id': server_id, 'server_id': server_id, 'prefix': prefix}
+    return rows
+
+
+def scan_prefix(rows, message):
+    # This is how command_prefix used to find a prefix, left here to compare against
+    try:
+        prefix = [data['prefix'] for data in rows.values() if message.server.id == data['server_id']][0]
+    except IndexError:
+        prefix = None
+    return prefix or config.default_prefix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--number', type=int, default=100000, help="How many lookups to time for each size")
+    parser.add_argument('--scan-number', type=int, default=20, help="How many lookups to time using a scan")
+    args = parser.parse_args()
+
+    cache = config.cache['prefixes']
+    print("{:>10} {:>16} {:>16}".format("servers", "lookup (us)", "scan (us)"))
+    for size in args.sizes:
+        rows = make_rows(size)
+        cache.load(rows)
+        messages = [Message(Server(random.choice(list(rows))), random.choice(['??help', '?help', 'bot help', 'hi']))
+                    for _ in range(1000)]
+
+        def lookup():
+            for message in messages:
+                config.command_prefix(None, message)
+
+        def scan():
+            scan_prefix(rows, messages[0])
+
+        lookup_time = timeit.timeit(lookup, number=max(args.number // len(messages), 1))
+        lookup_time /= max(args.number // len(messages), 1) * len(messages)
+        scan_time = timeit.timeit(scan, number=args.scan_number) / args.scan_number
+        print("{:>10} {:>16.3f} {:>16.3f}".format(size, lookup_time * 1e6, scan_time * 1e6))
+
+
+if __name__ == '__main__':
+    main()
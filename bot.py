@@ -19,7 +19,17 @@ opts = {'command_prefix': utils.command_prefix,
         'shard_id': utils.shard_id,
         'command_not_found': ''}
 
-bot = commands.Bot(**opts)
+
+class Bonfire(commands.Bot):
+    async def close(self):
+        # Make sure anything we're holding onto in memory is saved before we go
+        await utils.usage_buffer.flush()
+        await super().close()
+        await utils.pool.close()
+        await utils.http_session.close()
+
+
+bot = Bonfire(**opts)
 logging.basicConfig(level=logging.WARNING, filename='bonfire.log')
 
 
@@ -30,7 +40,15 @@ async def on_ready():
 
     if not hasattr(bot, 'uptime'):
         bot.uptime = pendulum.utcnow()
-    await utils.db_check()
+    utils.usage_buffer.start()
+
+
+@bot.check
+def tag_queries(ctx):
+    # Anything this command looks up in the database is recorded as coming from it
+    utils.query_stats.tag(ctx.command.cog_name, ctx.command.qualified_name)
+    return True
+
 
 @bot.event
 async def on_message(message):
@@ -41,41 +59,9 @@ async def on_message(message):
 
 @bot.event
 async def on_command_completion(command, ctx):
-    # There's no reason to continue waiting for this to complete, so lets immediately launch this in a new future
-    bot.loop.create_task(process_command(ctx))
-
-
-async def process_command(ctx):
-    author = ctx.message.author
-    server = ctx.message.server
-    command = ctx.command
-
-    r_filter = {'command': command.qualified_name}
-    command_usage = await utils.get_content('command_usage', r_filter)
-    if command_usage is None:
-        command_usage = {'command': command.qualified_name}
-    else:
-        command_usage = command_usage[0]
-    # Add one to the total usage for this command, basing it off 0 to start with (obviously)
-    total_usage = command_usage.get('total_usage', 0) + 1
-    command_usage['total_usage'] = total_usage
-
-    # Add one to the author's usage for this command
-    total_member_usage = command_usage.get('member_usage', {})
-    member_usage = total_member_usage.get(author.id, 0) + 1
-    total_member_usage[author.id] = member_usage
-    command_usage['member_usage'] = total_member_usage
-
-    # Add one to the server's usage for this command
-    if ctx.message.server is not None:
-        total_server_usage = command_usage.get('server_usage', {})
-        server_usage = total_server_usage.get(server.id, 0) + 1
-        total_server_usage[server.id] = server_usage
-        command_usage['server_usage'] = total_server_usage
-
-    # Save all the changes
-    if not await utils.update_content('command_usage', command_usage, r_filter):
-        await utils.add_content('command_usage', command_usage, r_filter)
+    # This only adds to the usage held in memory, it's saved to the database in batches
+    server_id = ctx.message.server.id if ctx.message.server is not None else None
+    utils.usage_buffer.add(command.qualified_name, server_id, ctx.message.author.id)
 
 
 @bot.event
@@ -128,4 +114,6 @@ if __name__ == '__main__':
 
     for e in utils.extensions:
         bot.load_extension(e)
+    # Get the database and caches ready first, so that no commands are ran until we have everything they need
+    bot.loop.run_until_complete(utils.db_startup())
     bot.run(utils.bot_token)
@@ -1,4 +1,3 @@
-import aiohttp
 import asyncio
 import discord
 import traceback
@@ -16,7 +15,6 @@ class Deviantart:
         self.base_url = "https://www.deviantart.com/api/v1/oauth2/gallery/all"
         self.bot = bot
         self.headers = {"User-Agent": utils.user_agent}
-        self.session = aiohttp.ClientSession()
         self.token = None
         self.params = None
         bot.loop.create_task(self.token_task())
@@ -52,11 +50,14 @@ class Deviantart:
         return data.get('expires_in', 65) - 5
 
     async def check_posts(self):
-        content = await utils.get_content('deviantart')
         # People might sub to the same person, so lets cache every person and their last update
         cache = {}
+        # The format for this is {member_id: {da_name: deviationid}}, these are all saved at once at the end
+        last_updated = {}
 
         try:
+            # Read everyone first, so that a connection isn't held while we wait on deviantart and discord
+            content = await utils.read_content('deviantart', pluck=['member_id', 'subbed', 'last_updated'])
             for entry in content:
                 user = discord.utils.get(self.bot.get_all_members(), id=entry['member_id'])
 
@@ -76,7 +77,7 @@ class Deviantart:
                     result = cache.get(da_name, None)
                     if result is None:
                         params['username'] = da_name
-                        data = await utils.request(self.base_url, payload=params)
+                        data = await utils.request(self.base_url, payload=params, priority=utils.BACKGROUND)
                         if data is None:
                             continue
                         elif not data['results']:
@@ -100,13 +101,17 @@ class Deviantart:
                             await self.bot.send_message(user, fmt)
                         # Now we can update the user's last updated for this DA
                         # We want to do this whether or not our last if statement was met
-                        r_filter = {'member_id': user.id}
-                        update = {'last_updated': {da_name: result['deviationid']}}
-                        await utils.update_content('deviantart', update, r_filter)
+                        last_updated.setdefault(user.id, {})[da_name] = result['deviationid']
         except Exception as e:
             tb = traceback.format_exc()
             fmt = "{1}\n{0.__class__.__name__}: {0}".format(tb, e)
             log.error(fmt)
+        finally:
+            # Save what we've notified people about even if something went wrong, so they aren't notified twice
+            saved = await utils.bulk_update('deviantart', [({'member_id': member_id}, {'last_updated': updated})
+                                                           for member_id, updated in last_updated.items()])
+            if not saved:
+                log.warning("Couldn't save the last updated deviations for everyone, they may be notified again")
 
     @commands.group()
     @utils.custom_perms(send_messages=True)
@@ -124,20 +129,15 @@ class Deviantart:
         EXAMPLE: !da sub MyFavoriteArtistEva<3
         RESULT: Notifications of amazing pics c:"""
         r_filter = {'member_id': ctx.message.author.id}
-        content = await utils.get_content('deviantart', r_filter)
         # TODO: Ensure the user provided is a real user
+        result = await utils.set_add('deviantart', 'subbed', username, r_filter)
 
-        if content is None:
+        if result is None:
+            # They haven't subscribed to anyone before
             entry = {'member_id': ctx.message.author.id, 'subbed': [username], 'last_updated': {}}
-            await utils.add_content('deviantart', entry, r_filter)
+            await utils.upsert_content('deviantart', r_filter, entry)
             await self.bot.say("You have just subscribed to {}!".format(username))
-        elif content[0]['subbed'] is None or username not in content[0]['subbed']:
-            if content[0]['subbed'] is None:
-                sub_list = [username]
-            else:
-                content[0]['subbed'].append(username)
-                sub_list = content[0]['subbed']
-            await utils.update_content('deviantart', {'subbed': sub_list}, r_filter)
+        elif result == 'updated':
             await self.bot.say("You have just subscribed to {}!".format(username))
         else:
             await self.bot.say("You are already subscribed to that user!")
@@ -150,13 +150,11 @@ class Deviantart:
         EXAMPLE: !da unsub TheArtistWhoBetrayedMe
         RESULT: No more pics from that terrible person!"""
         r_filter = {'member_id': ctx.message.author.id}
-        content = await utils.get_content('deviantart', r_filter)
+        result = await utils.set_remove('deviantart', 'subbed', username, r_filter)
 
-        if content is None or content[0]['subbed'] is None:
+        if result is None:
             await self.bot.say("You are not subscribed to anyone at the moment!")
-        elif username in content[0]['subbed']:
-            content[0]['subbed'].remove(username)
-            await utils.update_content('deviantart', {'subbed': content[0]['subbed']}, r_filter)
+        elif result == 'updated':
             await self.bot.say("You have just unsubscribed from {}!".format(username))
         else:
             await self.bot.say("You are not subscribed to that user!")
@@ -1,5 +1,5 @@
 from .utils import config
-import aiohttp
+from .utils import web
 import logging
 import json
 
@@ -14,10 +14,6 @@ class StatsUpdate:
 
     def __init__(self, bot):
         self.bot = bot
-        self.session = aiohttp.ClientSession()
-
-    def __unload(self):
-        self.bot.loop.create_task(self.session.close())
 
     async def update(self):
         server_count = 0
@@ -31,7 +27,7 @@ class StatsUpdate:
             'servercount': server_count
         }
 
-        async with self.session.post(carbonitex_url, data=carbon_payload) as resp:
+        async with web.http_session.post(carbonitex_url, data=carbon_payload) as resp:
             log.info('Carbonitex statistics returned {} for {}'.format(resp.status, carbon_payload))
 
         payload = json.dumps({
@@ -44,7 +40,7 @@ class StatsUpdate:
         }
 
         url = '{}/bots/{}/stats'.format(discord_bots_url, self.bot.user.id)
-        async with self.session.post(url, data=payload, headers=headers) as resp:
+        async with web.http_session.post(url, data=payload, headers=headers) as resp:
             log.info('bots.discord.pw statistics returned {} for {}'.format(resp.status, payload))
 
     async def on_server_join(self, server):
@@ -52,9 +48,8 @@ class StatsUpdate:
         server_count = len(self.bot.servers)
         member_count = len(set(self.bot.get_all_members()))
         entry = {'server_count': server_count, 'member_count': member_count, "shard_id": config.shard_id}
-        # Check if this was successful, if it wasn't, that means a new shard was added and we need to add that entry
-        if not await config.update_content('bot_data', entry, r_filter):
-            await config.add_content('bot_data', entry, r_filter)
+        # If this is a new shard, this will add the entry for it
+        await config.upsert_content('bot_data', r_filter, entry)
         self.bot.loop.create_task(self.update())
 
     async def on_server_leave(self, server):
@@ -62,9 +57,8 @@ class StatsUpdate:
         server_count = len(self.bot.servers)
         member_count = len(set(self.bot.get_all_members()))
         entry = {'server_count': server_count, 'member_count': member_count, "shard_id": config.shard_id}
-        # Check if this was successful, if it wasn't, that means a new shard was added and we need to add that entry
-        if not await config.update_content('bot_data', entry, r_filter):
-            await config.add_content('bot_data', entry, r_filter)
+        # If this is a new shard, this will add the entry for it
+        await config.upsert_content('bot_data', r_filter, entry)
         self.bot.loop.create_task(self.update())
 
     async def on_ready(self):
@@ -72,9 +66,8 @@ class StatsUpdate:
         server_count = len(self.bot.servers)
         member_count = len(set(self.bot.get_all_members()))
         entry = {'server_count': server_count, 'member_count': member_count, "shard_id": config.shard_id}
-        # Check if this was successful, if it wasn't, that means a new shard was added and we need to add that entry
-        if not await config.update_content('bot_data', entry, r_filter):
-            await config.add_content('bot_data', entry, r_filter)
+        # If this is a new shard, this will add the entry for it
+        await config.upsert_content('bot_data', r_filter, entry)
         self.bot.loop.create_task(self.update())
 
     async def on_member_join(self, member):
@@ -258,21 +258,11 @@ class Interaction:
             await self.bot.say("Why the heck are you booping me? Get away from me >:c")
             return
 
-        r_filter = {'member_id': booper.id}
-        boops = await utils.get_content('boops', r_filter)
-        if boops is not None:
-            boops = boops[0]['boops']
-            # If the booper has never booped the member provided, assure it's 0
-            amount = boops.get(boopee.id, 0) + 1
-            boops[boopee.id] = amount
-
-            await utils.update_content('boops', {'boops': boops}, r_filter)
-        else:
-            entry = {'member_id': booper.id,
-                     'boops': {boopee.id: 1}}
-
-            await utils.add_content('boops', entry, r_filter)
-            amount = 1
+        # This adds one to the amount of times they've booped this member, starting from 0 if they never have
+        amount = await utils.increment_map_key('boops', {'member_id': booper.id}, 'boops', boopee.id)
+        if amount is None:
+            await self.bot.say("I couldn't keep track of that boop, try again later!")
+            return
 
         fmt = "{0.mention} has just booped {1.mention}{3}! That's {2} times now!"
         await self.bot.say(fmt.format(booper, boopee, amount, message))
@@ -130,8 +130,7 @@ class Mod:
         r_filter = {'server_id': ctx.message.server.id}
         entry = {'server_id': ctx.message.server.id,
                  'channel_id': channel.id}
-        if not await utils.add_content('server_alerts', entry, r_filter):
-            await utils.update_content('server_alerts', entry, r_filter)
+        await utils.upsert_content('server_alerts', r_filter, entry)
         await self.bot.say("I have just changed this server's 'notifications' channel"
                            "\nAll notifications will now go to `{}`".format(channel))
 
@@ -151,8 +150,7 @@ class Mod:
         r_filter = {'server_id': ctx.message.server.id}
         entry = {'server_id': ctx.message.server.id,
                  'channel_id': on_off}
-        if not await utils.add_content('user_notifications', entry, r_filter):
-            await utils.update_content('user_notifications', entry, r_filter)
+        await utils.upsert_content('user_notifications', r_filter, entry)
         fmt = "notify" if on_off else "not notify"
         await self.bot.say("This server will now {} if someone has joined or left".format(fmt))
 
@@ -171,7 +169,7 @@ class Mod:
         EXAMPLE: !nsfw add
         RESULT: ;)"""
         r_filter = {'channel_id': ctx.message.channel.id}
-        if await utils.add_content('nsfw_channels', r_filter, r_filter):
+        if await utils.upsert_content('nsfw_channels', r_filter, r_filter) == 'inserted':
             await self.bot.say("This channel has just been registered as 'nsfw'! Have fun you naughties ;)")
         else:
             await self.bot.say("This channel is already registered as 'nsfw'!")
@@ -313,15 +311,8 @@ class Mod:
         entry = {'server_id': ctx.message.server.id,
                  cmd.qualified_name: perm_value}
 
-        # In all other cases, I've used add_content before update_content
-        # In this case, I'm going the other way around, to make the least queries
-        # As custom permissions are probably going to be ran multiple times per server
-        # Whereas in most other cases, the command is probably going to be ran once/few times per server
-        if not await utils.update_content('custom_permissions', entry, r_filter):
-            await utils.add_content('custom_permissions', entry, r_filter)
-
-        # Same case as prefixes, for now, trigger a manual update
-        self.bot.loop.create_task(utils.cache['custom_permissions'].update())
+        # This will add the server's entry if it doesn't have one yet, otherwise it'll just add this command to it
+        await utils.upsert_content('custom_permissions', r_filter, entry)
         await self.bot.say("I have just added your custom permissions; "
                            "you now need to have `{}` permissions to use the command `{}`".format(permissions, command))
 
@@ -344,31 +335,33 @@ class Mod:
         await utils.replace_content('custom_permissions', r.row.without(cmd.qualified_name), r_filter)
         await self.bot.say("I have just removed the custom permissions for {}!".format(cmd))
 
-        # Same case as prefixes, for now, trigger a manual update
-        self.bot.loop.create_task(utils.cache['custom_permissions'].update())
-
     @commands.command(pass_context=True, no_pm=True)
     @utils.custom_perms(manage_server=True)
-    async def prefix(self, ctx, *, prefix: str):
+    async def prefix(self, ctx, *prefixes: str):
         """This command can be used to set a custom prefix per server
+        More than one prefix can be given, any of them can then be used to call commands
 
         EXAMPLE: !prefix new_prefix
         RESULT: You probably screwing it up and not realizing you now need to do new_prefixprefix"""
         r_filter = {'server_id': ctx.message.server.id}
-        if prefix.lower().strip() == "none":
-            prefix = None
+        prefixes = [prefix.strip() for prefix in prefixes if prefix.strip()]
+        if not prefixes:
+            await self.bot.say("You need to provide the prefix you want to use! Use `none` to clear your prefix")
+            return
+        if len(prefixes) == 1 and prefixes[0].lower() == "none":
+            prefixes = None
 
         entry = {'server_id': ctx.message.server.id,
-                 'prefix': prefix}
+                 'prefix': prefixes}
 
-        if not await utils.add_content('prefixes', entry, r_filter):
-            await utils.update_content('prefixes', entry, r_filter)
+        await utils.upsert_content('prefixes', r_filter, entry)
 
-        if prefix is None:
+        if prefixes is None:
             fmt = "I have just cleared your custom prefix, the default prefix will have to be used now"
         else:
-            fmt = "I have just updated the prefix for this server; you now need to call commands with `{0}`. " \
-                  "For example, you can call this command again with {0}prefix".format(prefix)
+            fmt = "I have just updated the prefix for this server; you now need to call commands with {0}. " \
+                  "For example, you can call this command again with {1}prefix".format(
+                      ", ".join("`{}`".format(prefix) for prefix in prefixes), prefixes[0])
         await self.bot.say(fmt)
 
     @commands.command(pass_context=True, no_pm=True)
@@ -494,9 +487,8 @@ class Mod:
         r_filter = {'server_id': ctx.message.server.id}
         entry = {'server_id': ctx.message.server.id,
                  'rules': [rule]}
-        update = {'rules': r.row['rules'].append(rule)}
-        if not await utils.update_content('rules', update, r_filter):
-            await utils.add_content('rules', entry, r_filter)
+        update = lambda row: {'rules': row['rules'].append(rule)}
+        await utils.upsert_content('rules', r_filter, entry, update)
 
         await self.bot.say("I have just saved your new rule, use the rules command to view this server's current rules")
 
@@ -509,8 +501,7 @@ class Mod:
         EXAMPLE: !rules delete 5
         RESULT: Freedom from opression!"""
         r_filter = {'server_id': ctx.message.server.id}
-        update = {'rules': r.row['rules'].delete_at(rule - 1)}
-        if not await utils.update_content('rules', update, r_filter):
+        if await utils.delete_at('rules', 'rules', rule - 1, r_filter) is None:
             await self.bot.say("That is not a valid rule number, try running the command again.")
         else:
             await self.bot.say("I have just removed that rule from your list of rules!")
@@ -1,12 +1,11 @@
 from .utils import config
 from .utils import checks
 from .utils import images
+from .utils import utilities
 
 from discord.ext import commands
 import discord
 
-import aiohttp
-
 base_url = "https://api.owapi.net/api/v3/u/"
 # This is a list of the possible things that we may want to retrieve from the stats
 # The API returns something if it exists, and leaves it out of the data returned entirely if it does not
@@ -15,7 +14,6 @@ base_url = "https://api.owapi.net/api/v3/u/"
 check_g_stats = ["eliminations", "deaths", 'kpd', 'wins', 'losses', 'time_played',
                  'cards', 'damage_done', 'healing_done', 'multikills']
 check_o_stats = ['wins']
-MAX_RETRIES = 5
 
 
 class Overwatch:
@@ -24,7 +22,6 @@ class Overwatch:
     def __init__(self, bot):
         self.bot = bot
         self.headers = {"User-Agent": config.user_agent}
-        self.session = aiohttp.ClientSession()
 
     async def _request(self, payload, endpoint):
         """Handles requesting to the API"""
@@ -32,20 +29,8 @@ class Overwatch:
         # Format the URL we'll need based on the base_url, and the endpoint we want to hit
         url = "{}{}".format(base_url, endpoint)
 
-        # Attempt to connect up to our max retries
-        for x in range(MAX_RETRIES):
-            try:
-                async with aiohttp.ClientSession(headers=self.headers) as session:
-                    async with session.get(url, params=payload) as r:
-                        # If we failed to connect, attempt again
-                        if r.status != 200:
-                            continue
-
-                        data = await r.json()
-                        return data
-            # If any error happened when making the request, attempt again
-            except:
-                continue
+        # This handles retrying if the request fails
+        return await utilities.request(url, headers=dict(self.headers), payload=payload)
 
     @commands.group(no_pm=True)
     async def ow(self):
@@ -135,10 +120,7 @@ class Overwatch:
 
         # Now just save the battletag
         entry = {'member_id': ctx.message.author.id, 'battletag': bt}
-        update = {'battletag': bt}
-        # Try adding this first, if that fails, update the saved entry
-        if not await config.add_content('overwatch', entry, r_filter):
-            await config.update_content('overwatch', update, r_filter)
+        await config.upsert_content('overwatch', r_filter, entry)
         await self.bot.say("I have just saved your battletag {}".format(ctx.message.author.mention))
 
     @ow.command(pass_context=True, name="delete", aliases=['remove'])
@@ -24,10 +24,9 @@ class Owner:
         date = pendulum.utcnow().to_date_string()
         r_filter = {'date': date}
         entry = {'motd': message, 'date': date}
-        # Try to add this, if there's an entry for that date, lets update it to make sure only one motd is sent a day
+        # If there's an entry for that date, this will update it to make sure only one motd is sent a day
         # I should be managing this myself, more than one should not be sent in a day
-        if await utils.add_content('motd', entry, r_filter):
-            await utils.update_content('motd', entry, r_filter)
+        await utils.upsert_content('motd', r_filter, entry)
         await self.bot.say("New motd update for {}!".format(date))
 
     @commands.command(pass_context=True)
@@ -136,6 +135,133 @@ class Owner:
             fmt = 'An error occurred while processing this request: ```py\n{}: {}\n```'
             await self.bot.say(fmt.format(type(error).__name__, error))
 
+    @commands.command()
+    @commands.check(utils.is_owner)
+    async def cachestats(self):
+        """Shows how well the query cache is doing"""
+        stats = utils.query_cache.stats()
+        fmt = "\n".join([
+            "Tables cached: {}".format(", ".join(sorted(utils.query_cache.ttls)) or "None"),
+            "Size: {size}/{max_size}".format(**stats),
+            "Hits: {hits}".format(**stats),
+            "Misses: {misses}".format(**stats),
+            "Hit rate: {:.1%}".format(stats['hit_rate']),
+            "Evictions: {evictions}".format(**stats),
+            "Invalidations: {invalidations}".format(**stats)])
+        await self.bot.say("```\n{}```".format(fmt))
+
+    @commands.command()
+    @commands.check(utils.is_owner)
+    async def httpstats(self):
+        """Shows how the connections used for requests to other sites are holding up"""
+        stats = utils.http_session.stats()
+        cache = utils.response_cache.stats()
+        shared = utils.single_flight.stats()
+        fmt = "\n".join([
+            "Requests running: {in_use}/{limit} ({limit_per_host} connections per host)".format(**stats),
+            "Waiting for a free slot: {waiting}".format(**stats),
+            "Requests: {requests}".format(**stats),
+            "Sessions created: {sessions_created}".format(**stats),
+            "Failing sites: {}".format(", ".join(utils.circuit_breaker.open_hosts()) or "None"),
+            "Requests skipped to failing sites: {}".format(utils.circuit_breaker.rejected),
+            "Cached responses: {entries} ({size}/{max_size} bytes)".format(**cache),
+            "Cache hits: {hits} ({stale_hits} stale), misses: {misses}, hit rate: {hit_rate:.1%}".format(**cache),
+            "Revalidated: {revalidated}, evictions: {evictions}".format(**cache),
+            "Requests sent: {calls}, shared with a request already running: {deduplicated}".format(**shared)])
+        await self.bot.say("```\n{}```".format(fmt))
+
+    @commands.command()
+    @commands.check(utils.is_owner)
+    async def ratelimits(self):
+        """Shows how long requests have had to wait on each site's rate limit"""
+        stats = utils.rate_limiter.stats()
+        if not stats:
+            await self.bot.say("No requests have been made to a rate limited site yet!")
+            return
+        lines = []
+        for host, x in sorted(stats.items()):
+            waits = ", ".join("{} {:.2f}s".format("interactive" if priority == utils.INTERACTIVE else "background",
+                                                    wait) for priority, wait in sorted(x['by_priority'].items()))
+            lines.append("{}: {} requests, {} queued now (most {}), {:.1f}/{} tokens, {} waited (avg {:.2f}s, "
+                         "max {:.2f}s), average wait by priority: {}".format(host, x['requests'], x['queued'],
+                                                                             x['max_queued'], x['tokens'], x['burst'],
+                                                                             x['waited'], x['average_wait'],
+                                                                             x['max_wait'], waits))
+        await self.bot.say("```\n{}```".format("\n".join(lines)[:1900]))
+
+    @commands.command()
+    @commands.check(utils.is_owner)
+    async def querystats(self, option="top"):
+        """Shows the tables and operations that have taken the most time
+        Provide slow to see the most recent slow queries instead, or reset to start counting again"""
+        stats = utils.query_stats
+        option = option.lower()
+        if option == "reset":
+            stats.reset()
+            await self.bot.say("Query stats have been reset!")
+            return
+
+        if option == "slow":
+            if not stats.slow:
+                await self.bot.say("There haven't been any queries slower than {}ms!".format(stats.slow_threshold))
+                return
+            lines = ["{} {}.{} ({:.0f}ms) from {}.{}: {}".format(x['time'].to_time_string(), x['table'], x['op'],
+                                                               x['ms'], x['cog'], x['command'], x['details'])
+                     for x in reversed(stats.slow)]
+        else:
+            top = stats.top(10)
+            if not top:
+                await self.bot.say("No queries have been made since {}!".format(stats.started.to_datetime_string()))
+                return
+            lines = ["Since {}".format(stats.started.to_datetime_string())]
+            for (table, op), x in top:
+                (cog, command), _ = x.callers.most_common(1)[0]
+                p99 = utils.querystats.format_percentile(x.percentile(99))
+                lines.append("{}.{}: {} calls, {:.1f}s total, avg {:.1f}ms, p99 {}, {} rows, {} errors, "
+                             "mostly from {}.{}".format(table, op, x.count, x.total, x.average, p99, x.rows,
+                                                        x.errors, cog, command))
+
+        await self.bot.say(utils.stats_message(lines))
+
+    @commands.command()
+    @commands.check(utils.is_owner)
+    async def apistats(self, option="top"):
+        """Shows the sites and endpoints that requests have spent the most time on
+        Provide slow to see the most recent slow requests instead, or reset to start counting again"""
+        stats = utils.request_stats
+        option = option.lower()
+        if option == "reset":
+            stats.reset()
+            await self.bot.say("Request stats have been reset!")
+            return
+
+        if option == "slow":
+            if not stats.slow:
+                await self.bot.say("There haven't been any requests slower than {}ms!".format(stats.slow_threshold))
+                return
+            lines = ["{} {}{} ({:.0f}ms) returned {} after {} retries, from {}.{}".format(
+                x['time'].to_time_string(), x['host'], x['endpoint'], x['ms'], x['status'], x['retries'], x['cog'],
+                x['command']) for x in reversed(stats.slow)]
+        else:
+            top = stats.top(10)
+            if not top:
+                await self.bot.say("No requests have been made since {}!".format(stats.started.to_datetime_string()))
+                return
+            lines = ["Since {}".format(stats.started.to_datetime_string())]
+            for (host, endpoint), x in top:
+                (cog, command), _ = x.callers.most_common(1)[0]
+                p50, p99 = [utils.querystats.format_percentile(x.percentile(p)) for p in (50, 99)]
+                statuses = ", ".join("{}: {}".format(status or "failed", count)
+                                     for status, count in x.statuses.most_common(3))
+                cache = ", ".join("{} {}".format(count, kind) for kind, count in sorted(x.cache.items()))
+                lines.append("{}{}: {} calls, avg {:.0f}ms, p50 {}, p99 {}, {} bytes, {} retries, {} errors "
+                             "({}){}, mostly from {}.{}".format(host, endpoint, x.count, x.average, p50, p99, x.bytes,
+                                                                x.retries, x.errors, statuses,
+                                                                ", cache: {}".format(cache) if cache else "", cog,
+                                                                command))
+
+        await self.bot.say(utils.stats_message(lines))
+
 
 def setup(bot):
     bot.add_cog(Owner(bot))
@@ -1,4 +1,3 @@
-import aiohttp
 import asyncio
 import discord
 import re
@@ -23,12 +22,11 @@ async def online_users():
         # It is more efficent on their end to make a query for all online users, and base checks off that
         # In place of requesting for /channel and checking if that is online currently, for each channel
         # This method is in place to just return all online_users
+        # None is returned if we couldn't find out who's online, which isn't the same as no one being online
         url = '{}/online/all?key={}'.format(base_url, key)
-        with aiohttp.ClientSession(headers={"User-Agent": utils.user_agent}) as s:
-            async with s.get(url) as response:
-                return await response.json()
+        return await utils.request(url, priority=utils.BACKGROUND)
     except:
-        return {}
+        return None
 
 
 def check_online(online_channels, channel):
@@ -44,68 +42,60 @@ class Picarto:
     def __init__(self, bot):
         self.bot = bot
         self.headers = {"User-Agent": utils.user_agent}
-        self.session = aiohttp.ClientSession()
 
     async def check_channels(self):
         await self.bot.wait_until_ready()
         # This is a loop that runs every 30 seconds, checking if anyone has gone online
         try:
             while not self.bot.is_closed:
-                r_filter = {'notifications_on': 1}
-                picarto = await utils.get_content('picarto', r_filter)
                 # Get all online users before looping, so that only one request is needed
                 online_users_list = await online_users()
-                old_online_users = {data['member_id']: data for data in picarto if data['live']}
-                old_offline_users = {data['member_id']: data for data in picarto if not data['live']}
+                # If we couldn't get who's online (like if picarto is throttling us), leave everyone as they were
+                # Otherwise everyone that's live would be announced as going offline
+                if online_users_list is None:
+                    await asyncio.sleep(30)
+                    continue
+                r_filter = {'notifications_on': 1}
+                # Read everyone first, so that a connection isn't held while we're sending messages
+                picarto = await utils.read_content('picarto', r_filter,
+                                                   pluck=['member_id', 'picarto_url', 'servers', 'live'])
+                changes = []
 
-                for m_id, result in old_offline_users.items():
+                for result in picarto:
+                    m_id = result['member_id']
                     # Get their url and their user based on that url
                     url = result['picarto_url']
                     user = re.search("(?<=picarto.tv/)(.*)", url).group(1)
-                    # Check if they are online right now
-                    if check_online(online_users_list, user):
-                        for server_id in result['servers']:
-                            # Get the channel to send the message to, based on the saved alert's channel
-                            server = self.bot.get_server(server_id)
-                            if server is None:
-                                continue
-                            server_alerts = await utils.get_content('server_alerts', {'server_id': server_id})
-                            try:
-                                channel_id = server_alerts[0]['channel_id']
-                            except (IndexError, TypeError):
-                                channel_id = server_id
-                            channel = self.bot.get_channel(channel_id)
-                            # Get the member that has just gone live
-                            member = discord.utils.get(server.members, id=m_id)
-                            if member is None:
-                                continue
-
+                    # Check if they are online right now, and if that's changed since last time
+                    online = check_online(online_users_list, user)
+                    if online == bool(result['live']):
+                        continue
+                    for server_id in result['servers']:
+                        # Get the channel to send the message to, based on the saved alert's channel
+                        server = self.bot.get_server(server_id)
+                        if server is None:
+                            continue
+                        server_alerts = await utils.get_content('server_alerts', {'server_id': server_id})
+                        try:
+                            channel_id = server_alerts[0]['channel_id']
+                        except (IndexError, TypeError, KeyError):
+                            channel_id = server_id
+                        channel = self.bot.get_channel(channel_id)
+                        # Get the member that has just gone live/offline
+                        member = discord.utils.get(server.members, id=m_id)
+                        if member is None:
+                            continue
+
+                        if online:
                             fmt = "{} has just gone live! View their stream at {}".format(member.display_name, url)
-                            await self.bot.send_message(channel, fmt)
-                        await utils.update_content('picarto', {'live': 1}, {'member_id': m_id})
-                for m_id, result in old_online_users.items():
-                    # Get their url and their user based on that url
-                    url = result['picarto_url']
-                    user = re.search("(?<=picarto.tv/)(.*)", url).group(1)
-                    # Check if they are online right now
-                    if not check_online(online_users_list, user):
-                        for server_id in result['servers']:
-                            # Get the channel to send the message to, based on the saved alert's channel
-                            server = self.bot.get_server(server_id)
-                            if server is None:
-                                continue
-                            server_alerts = await utils.get_content('server_alerts', {'server_id': server_id})
-                            try:
-                                channel_id = server_alerts[0]['channel_id']
-                            except (IndexError, TypeError):
-                                channel_id = server_id
-                            channel = self.bot.get_channel(channel_id)
-                            # Get the member that has just gone live
-                            member = discord.utils.get(server.members, id=m_id)
+                        else:
                             fmt = "{} has just gone offline! Catch them next time they stream at {}".format(
                                 member.display_name, url)
-                            await self.bot.send_message(channel, fmt)
-                        await utils.update_content('picarto', {'live': 0}, {'member_id': m_id})
+                        await self.bot.send_message(channel, fmt)
+                    changes.append(({'member_id': m_id}, {'live': int(online)}))
+                # Everyone whose status changed is saved at once, instead of one query per person
+                if not await utils.bulk_update('picarto', changes):
+                    log.warning("Couldn't save who has gone live/offline, they may be announced again")
                 await asyncio.sleep(30)
         except Exception as e:
             tb = traceback.format_exc()
@@ -131,8 +121,10 @@ class Picarto:
         # Use regex to get the actual username so that we can make a request to the API
         stream = re.search("(?<=picarto.tv/)(.*)", member_url).group(1)
         url = '{}/channel/{}?key={}'.format(base_url, stream, key)
-        async with self.session.get(url, headers=self.headers) as response:
-            data = await response.json()
+        data = await utils.request(url, endpoint='/channel/{channel}')
+        if data is None:
+            await self.bot.say("I couldn't connect to Picarto right now, please try again later")
+            return
 
         # Not everyone has all these settings, so use this as a way to print information if it does, otherwise ignore it
         things_to_print = ['channel', 'commissions_enabled', 'is_nsfw', 'program', 'tablet', 'followers',
@@ -175,7 +167,7 @@ class Picarto:
         api_url = '{}/channel/{}?key={}'.format(base_url, re.search("https://www.picarto.tv/(.*)", url).group(1), key)
 
         # Check if we can find a user with the provided information, if we can't just return
-        async with self.session.get(api_url, headers=self.headers) as response:
+        async with utils.http_session.get(api_url, headers=self.headers) as response:
             if not response.status == 200:
                 await self.bot.say("That Picarto user does not exist! "
                                    "What would be the point of adding a nonexistant Picarto user? Silly")
@@ -187,12 +179,11 @@ class Picarto:
                  'notifications_on': 1,
                  'live': 0,
                  'member_id': ctx.message.author.id}
-        if await utils.add_content('picarto', entry, r_filter):
+        if await utils.upsert_content('picarto', r_filter, entry, {'picarto_url': url}) == 'inserted':
             await self.bot.say(
                 "I have just saved your Picarto URL {}, this server will now be notified when you go live".format(
                     ctx.message.author.mention))
         else:
-            await utils.update_content('picarto', {'picarto_url': url}, r_filter)
             await self.bot.say("I have just updated your Picarto URL")
 
     @picarto.command(name='remove', aliases=['delete'], pass_context=True, no_pm=True)
@@ -27,10 +27,9 @@ class Raffle:
     async def check_raffles(self):
         # This is used to periodically check the current raffles, and see if they have ended yet
         # If the raffle has ended, we'll pick a winner from the entrants
-        raffles = await config.get_content('raffles')
-
-        if raffles is None:
-            return
+        # Only the fields needed are read, and they're all read first so that a connection isn't held
+        # while we're sending messages
+        raffles = await config.read_content('raffles', pluck=['id', 'server_id', 'expires', 'title', 'entrants'])
 
         for raffle in raffles:
             server = self.bot.get_server(raffle['server_id'])
@@ -122,38 +121,26 @@ class Raffle:
 
         # There is only one raffle, so use the first's info
         if raffle_count == 1:
-            entrants = raffles[0]['entrants']
-            # Lets make sure that the user hasn't already entered the raffle
-            if author.id in entrants:
-                await self.bot.say("You have already entered this raffle!")
-                return
-            entrants.append(author.id)
-
-            # Since we have no good thing to filter things off of, lets use the internal rethinkdb id
-            r_filter = {'id': raffles[0]['id']}
-            update = {'entrants': entrants}
-            await config.update_content('raffles', update, r_filter)
-            await self.bot.say("{} you have just entered the raffle!".format(author.mention))
+            raffle = raffles[0]
         # Otherwise, make sure the author gave a valid raffle_id
         elif raffle_id in range(raffle_count - 1):
-            entrants = raffles[raffle_id]['entrants']
-
-            # Lets make sure that the user hasn't already entered the raffle
-            if author.id in entrants:
-                await self.bot.say("You have already entered this raffle!")
-                return
-            entrants.append(author.id)
-
-            # Since we have no good thing to filter things off of, lets use the internal rethinkdb id
-            r_filter = {'id': raffles[raffle_id]['id']}
-            update = {'entrants': entrants}
-            await config.update_content('raffles', update, r_filter)
-            await self.bot.say("{} you have just entered the raffle!".format(author.mention))
+            raffle = raffles[raffle_id]
         else:
             fmt = "Please provide a valid raffle ID, as there are more than one setup on the server! " \
                   "There are currently `{}` raffles running, use {}raffles to view the current running raffles".format(
                       raffle_count, ctx.prefix)
             await self.bot.say(fmt)
+            return
+
+        # Since we have no good thing to filter things off of, lets use the internal rethinkdb id
+        # The author is only added if they haven't already entered, so entering twice at once can't happen
+        result = await config.set_add('raffles', 'entrants', author.id, {'id': raffle['id']})
+        if result == 'unchanged':
+            await self.bot.say("You have already entered this raffle!")
+        elif result is None:
+            await self.bot.say("That raffle has already ended!")
+        else:
+            await self.bot.say("{} you have just entered the raffle!".format(author.mention))
 
     @raffle.command(pass_context=True, no_pm=True, name='create', aliases=['start', 'begin', 'add'])
     @checks.custom_perms(kick_members=True)
@@ -79,18 +79,18 @@ class Stats:
             await self.bot.say("`{}` is not a valid command".format(command))
             return
 
-        r_filter = {'command': cmd.qualified_name}
-        command_stats = await utils.get_content('command_usage', r_filter)
-        try:
-            command_stats = command_stats[0]
-        except TypeError:
+        total_usage, server_usage, member_usage = await utils.get_command_usage(
+            cmd.qualified_name, ctx.message.server.id, ctx.message.author.id)
+        # Usage is saved in batches, so include whatever has been used since the last save
+        pending_total, pending_server, pending_member = utils.usage_buffer.pending_usage(
+            cmd.qualified_name, ctx.message.server.id, ctx.message.author.id)
+        total_usage += pending_total
+        server_usage += pending_server
+        member_usage += pending_member
+        if total_usage == 0:
             await self.bot.say("That command has never been used! You know I worked hard on that! :c")
             return
 
-        total_usage = command_stats['total_usage']
-        member_usage = command_stats['member_usage'].get(ctx.message.author.id, 0)
-        server_usage = command_stats['server_usage'].get(ctx.message.server.id, 0)
-
         try:
             data = [("Command Name", cmd.qualified_name),
                     ("Total Usage", total_usage),
@@ -117,14 +117,8 @@ class Stats:
         RESULT: The realization of how little of a life you have"""
         if re.search('(author|me)', option):
             author = ctx.message.author
-            # First lets get all the command usage
-            command_stats = await utils.get_content('command_usage')
-            # Now use a dictionary comprehension to get just the command name, and usage
-            # Based on the author's usage of the command
-            stats = {data['command']: data['member_usage'].get(author.id) for data in command_stats
-                     if data['member_usage'].get(author.id, 0) > 0}
-            # Now sort it by the amount of times used
-            sorted_stats = sorted(stats.items(), key=lambda x: x[1], reverse=True)
+            # Get the author's most used commands, these are already sorted by the amount of times used
+            sorted_stats = await utils.get_top_commands(member_id=author.id, limit=5)
 
             # Create a string, each command on it's own line, based on the top 5 used commands
             # I'm letting it use the length of the sorted_stats[:5]
@@ -140,10 +134,7 @@ class Stats:
         elif re.search('server', option):
             # This is exactly the same as above, except server usage instead of member usage
             server = ctx.message.server
-            command_stats = await utils.get_content('command_usage')
-            stats = {data['command']: data['server_usage'].get(server.id) for data in command_stats
-                     if data['server_usage'].get(server.id, 0) > 0}
-            sorted_stats = sorted(stats.items(), key=lambda x: x[1], reverse=True)
+            sorted_stats = await utils.get_top_commands(server_id=server.id, limit=5)
 
             top_5 = "\n".join("{}: {}".format(data[0], data[1]) for data in sorted_stats[:5])
             await self.bot.say(
@@ -218,25 +209,28 @@ class Stats:
 
     @commands.command(pass_context=True, no_pm=True)
     @utils.custom_perms(send_messages=True)
-    async def leaderboard(self, ctx):
+    async def leaderboard(self, ctx, option="server"):
         """Prints a leaderboard of everyone in the server's battling record
+        Provide 'global' to print the leaderboard of everyone I know of instead
 
         EXAMPLE: !leaderboard
         RESULT: A leaderboard of this server's battle records"""
-        # Create a list of the ID's of all members in this server, for comparison to the records saved
-        server_member_ids = [member.id for member in ctx.message.server.members]
-        battles = await utils.get_content('battle_records')
-        battles = [battle for battle in battles if battle['member_id'] in server_member_ids]
-
-        # Sort the members based on their rating
-        sorted_members = sorted(battles, key=lambda k: k['rating'], reverse=True)
+        if option.lower() == "global":
+            battles = await utils.battle_rankings.top(100)
+            # Only look through all the members once, for just the members that made it on the leaderboard
+            top_ids = set(x['member_id'] for x in battles)
+            members = {m.id: m for m in self.bot.get_all_members() if m.id in top_ids}
+        else:
+            # Only the members in this server that have battled are looked up, in order of their rating
+            battles = await utils.battle_rankings.server_ratings(m.id for m in ctx.message.server.members)
+            members = {m.id: m for m in ctx.message.server.members}
 
         output = []
-        for x in sorted_members:
-            member_id = x['member_id']
-            rating = x['rating']
-            member = ctx.message.server.get_member(member_id)
-            output.append("{} (Rating: {})".format(member.display_name, rating))
+        for x in battles:
+            member = members.get(x['member_id'])
+            if member is None:
+                continue
+            output.append("{} (Rating: {})".format(member.display_name, x['rating']))
 
         try:
             pages = utils.Pages(self.bot, message=ctx.message, entries=output)
@@ -253,40 +247,31 @@ class Stats:
         RESULT: How good they are at winning a completely luck based game"""
         member = member or ctx.message.author
 
-        # For this one, we don't want to pass a filter, as we do need all battle records
-        # We need this because we want to make a comparison for overall rank
-        all_members = await utils.get_content('battle_records')
-
-        # Make a list comprehension to just check if the user has battled
-        if len([entry for entry in all_members if entry['member_id'] == member.id]) == 0:
+        entry = await utils.battle_rankings.get(member.id)
+        if entry is None:
             await self.bot.say("That user has not battled yet!")
             return
 
-        # Same concept as the leaderboard
-        server_member_ids = [member.id for member in ctx.message.server.members]
-        server_members = [stats for stats in all_members if stats['member_id'] in server_member_ids]
-        sorted_server_members = sorted(server_members, key=lambda x: x['rating'], reverse=True)
-        sorted_all_members = sorted(all_members, key=lambda x: x['rating'], reverse=True)
-
-        # Enumurate the list so that we can go through, find the user's place in the list
-        # and get just that for the rank
-        server_rank = [i for i, x in enumerate(sorted_server_members) if x['member_id'] == member.id][0] + 1
-        total_rank = [i for i, x in enumerate(sorted_all_members) if x['member_id'] == member.id][0] + 1
+        # The overall rank is just how many people have a higher rating, which the database can count for us
+        # The server rank only needs the ratings of the members in this server that have battled
+        rating = entry['rating']
+        total_rank = await utils.battle_rankings.rank(rating)
+        total_members = await utils.battle_rankings.total()
+        server_rank, server_members = await utils.battle_rankings.server_rank(
+            rating, (m.id for m in ctx.message.server.members))
         # The rest of this is straight forward, just formatting
 
-        entry = [m for m in server_members if m['member_id'] == member.id][0]
-        rating = entry['rating']
         record = "{}-{}".format(entry['wins'], entry['losses'])
         try:
             title = 'Stats for {}'.format(member.display_name)
-            fmt = [('Record', record), ('Server Rank', '{}/{}'.format(server_rank, len(server_members))),
-                   ('Overall Rank', '{}/{}'.format(total_rank, len(all_members))), ('Rating', rating)]
+            fmt = [('Record', record), ('Server Rank', '{}/{}'.format(server_rank, server_members)),
+                   ('Overall Rank', '{}/{}'.format(total_rank, total_members)), ('Rating', rating)]
             banner = await utils.create_banner(member, title, fmt)
             await self.bot.upload(banner)
         except (FileNotFoundError, discord.Forbidden):
             fmt = 'Stats for {}:\n\tRecord: {}\n\tServer Rank: {}/{}\n\tOverall Rank: {}/{}\n\tRating: {}'
-            fmt = fmt.format(member.display_name, record, server_rank, len(server_members), total_rank,
-                             len(all_members), rating)
+            fmt = fmt.format(member.display_name, record, server_rank, server_members, total_rank,
+                             total_members, rating)
             await self.bot.say('```\n{}```'.format(fmt))
 
 
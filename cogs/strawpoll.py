@@ -3,12 +3,11 @@ import discord
 
 from .utils import config
 from .utils import checks
+from .utils import web
 
-import aiohttp
 import re
 import json
 import pendulum
-import rethinkdb as r
 
 
 def setup(bot):
@@ -29,7 +28,6 @@ class Strawpoll:
         # Strawpoll requires the content-type, so just add that to the default headers
         self.headers = {'User-Agent': 'Bonfire/1.0.0',
                         'Content-Type': 'application/json'}
-        self.session = aiohttp.ClientSession()
 
     @commands.group(aliases=['strawpoll', 'poll', 'polls'], pass_context=True, invoke_without_command=True, no_pm=True)
     @checks.custom_perms(send_messages=True)
@@ -62,8 +60,8 @@ class Strawpoll:
                 await self.bot.say("That poll does not exist on this server!")
                 return
 
-            async with self.session.get("{}/{}".format(self.url, poll_id),
-                                        headers={'User-Agent': 'Bonfire/1.0.0'}) as response:
+            async with web.http_session.get("{}/{}".format(self.url, poll_id),
+                                            headers={'User-Agent': 'Bonfire/1.0.0'}) as response:
                 data = await response.json()
 
             # The response for votes and options is provided as two separate lists
@@ -112,7 +110,7 @@ class Strawpoll:
         payload = {'title': title,
                    'options': options}
         try:
-            async with self.session.post(self.url, data=json.dumps(payload), headers=self.headers) as response:
+            async with web.http_session.post(self.url, data=json.dumps(payload), headers=self.headers) as response:
                 data = await response.json()
         except json.JSONDecodeError:
             await self.bot.say("Sorry, I couldn't connect to strawpoll at the moment. Please try again later")
@@ -129,9 +127,8 @@ class Strawpoll:
 
         entry = {'server_id': ctx.message.server.id,
                  'polls': [sub_entry]}
-        update = {'polls': r.row['polls'].append(sub_entry)}
-        if not await config.update_content('strawpolls', update, r_filter):
-            await config.add_content('strawpolls', entry, {'poll_id': poll_id})
+        update = lambda row: {'polls': row['polls'].append(sub_entry)}
+        await config.upsert_content('strawpolls', r_filter, entry, update)
         await self.bot.say("Link for your new strawpoll: https://strawpoll.me/{}".format(poll_id))
 
     @strawpolls.command(name='delete', aliases=['remove', 'stop'], pass_context=True, no_pm=True)
@@ -142,18 +139,11 @@ class Strawpoll:
         EXAMPLE: !strawpoll remove 5
         RESULT: No more strawpoll 5~"""
         r_filter = {'server_id': ctx.message.server.id}
-        content = await config.get_content('strawpolls', r_filter)
-        try:
-            content = content[0]['polls']
-        except TypeError:
+        # Try to remove the poll based on the ID, if it doesn't exist, nothing will have changed
+        result = await config.set_remove('strawpolls', 'polls', lambda poll: poll['poll_id'].eq(poll_id), r_filter)
+        if result is None:
             await self.bot.say("There are no strawpolls setup on this server!")
-            return
-
-        polls = [poll for poll in content if poll['poll_id'] != poll_id]
-
-        update = {'polls': polls}
-        # Try to remove the poll based on the ID, if it doesn't exist, this will return false
-        if await config.update_content('strawpolls', update, r_filter):
-            await self.bot.say("I have just removed the poll with the ID {}".format(poll_id))
-        else:
+        elif result == 'unchanged':
             await self.bot.say("There is no poll setup with that ID!")
+        else:
+            await self.bot.say("I have just removed the poll with the ID {}".format(poll_id))
@@ -33,7 +33,7 @@ class Tags:
 
          EXAMPLE: !tag butts
          RESULT: Whatever you setup for the butts tag!!"""
-        r_filter = lambda row: (row['server_id'] == ctx.message.server.id) & (row['tag'] == tag)
+        r_filter = {'server_id': ctx.message.server.id, 'tag': tag}
         tags = await config.get_content('tags', r_filter)
         if tags is None:
             await self.bot.say('That tag does not exist!')
@@ -70,13 +70,12 @@ class Tags:
             await self.bot.say("You cannot create a tag that mentions everyone!")
             return
         entry = {'server_id': ctx.message.server.id, 'tag': tag, 'result': tag_result}
-        r_filter = lambda row: (row['server_id'] == ctx.message.server.id) & (row['tag'] == tag)
-        # Try to create new entry first, if that fails (it already exists) then we update it
-        if await config.add_content('tags', entry, r_filter):
+        r_filter = {'server_id': ctx.message.server.id, 'tag': tag}
+        # This will create a new entry, or update it if it already exists
+        if await config.upsert_content('tags', r_filter, entry) == 'inserted':
             await self.bot.say(
                 "I have just added the tag `{0}`! You can call this tag by entering !tag {0}".format(tag))
         else:
-            await config.update_content('tags', entry, r_filter)
             await self.bot.say(
                 "I have just updated the tag `{0}`! You can call this tag by entering !tag {0}".format(tag))
 
@@ -88,7 +87,7 @@ class Tags:
 
         EXAMPLE: !tag delete stupid_tag
         RESULT: Deletes that stupid tag"""
-        r_filter = lambda row: (row['server_id'] == ctx.message.server.id) & (row['tag'] == tag)
+        r_filter = {'server_id': ctx.message.server.id, 'tag': tag}
         if await config.remove_content('tags', r_filter):
             await self.bot.say('I have just removed the tag `{}`'.format(tag))
         else:
@@ -2,7 +2,6 @@ from discord.ext import commands
 
 from . import utils
 
-import aiohttp
 import asyncio
 import discord
 import json
@@ -13,6 +12,9 @@ import logging
 
 log = logging.getLogger()
 
+# The most channels that are checked at the same time by the background check
+check_concurrency = 10
+
 
 class Twitch:
     """Class for some twitch integration
@@ -30,80 +32,93 @@ class Twitch:
         # Check a specific channel's data, and get the response in text format
         url = "https://api.twitch.tv/kraken/streams/{}".format(channel)
 
-        response = await utils.request(url, payload=self.params)
+        # This is only used by the background check, so let any commands using twitch go first
+        response = await utils.request(url, payload=self.params, priority=utils.BACKGROUND,
+                                       endpoint='/kraken/streams/{channel}')
 
         # For some reason Twitch's API call is not reliable, sometimes it returns stream as None
         # That is what we're checking specifically, sometimes it doesn't exist in the returned JSON at all
-        # Sometimes it returns something that cannot be decoded with JSON (which means we'll get None back)
-        # In either error case, just assume they're offline, the next check will most likely work
+        # Sometimes the request fails, or returns something that cannot be decoded with JSON (we'll get None back)
+        # In either error case we don't know if they're online, so return None; the next check will most likely work
         try:
             return response['stream'] is not None
         except (KeyError, TypeError):
-            return False
+            return None
+
+    async def _limited_check(self, limit, channel):
+        # Waits for one of the spots in limit before checking the channel
+        async with limit:
+            return await self.channel_online(channel)
 
     async def check_channels(self):
         await self.bot.wait_until_ready()
         # Loop through as long as the bot is connected
         try:
             while not self.bot.is_closed:
-                twitch = await utils.get_content('twitch', {'notifications_on': 1})
                 # Online/offline is based on whether they are set to such, in the utils file
                 # This means they were detected as online/offline before and we check for a change
-                online_users = {data['member_id']: data for data in twitch if data['live']}
-                offline_users = {data['member_id']: data for data in twitch if not data['live']}
-                for m_id, result in offline_users.items():
-                    # Get their url and their user based on that url
-                    url = result['twitch_url']
-                    user = re.search("(?<=twitch.tv/)(.*)", url).group(1)
-                    # Check if they are online right now
-                    if await self.channel_online(user):
-                        for server_id in result['servers']:
-                            # Get the channel to send the message to, based on the saved alert's channel
-                            server = self.bot.get_server(server_id)
-                            if server is None:
-                                continue
-                            server_alerts = await utils.get_content('server_alerts', {'server_id': server_id})
-                            try:
-                                channel_id = server_alerts[0]['channel_id']
-                            except (IndexError, TypeError):
-                                channel_id = server_id
-                            channel = self.bot.get_channel(channel_id)
-                            # Get the member that has just gone live
-                            member = discord.utils.get(server.members, id=m_id)
-                            if member is None:
-                                continue
-
-                            fmt = "{} has just gone live! View their stream at {}".format(member.display_name, url)
-                            await self.bot.send_message(channel, fmt)
-                        await utils.update_content('twitch', {'live': 1}, {'member_id': m_id})
-                for m_id, result in online_users.items():
-                    # Get their url and their user based on that url
-                    url = result['twitch_url']
-                    user = re.search("(?<=twitch.tv/)(.*)", url).group(1)
-                    # Check if they are online right now
-                    if not await self.channel_online(user):
-                        for server_id in result['servers']:
-                            # Get the channel to send the message to, based on the saved alert's channel
-                            server = self.bot.get_server(server_id)
-                            if server is None:
-                                continue
-                            server_alerts = await utils.get_content('server_alerts', {'server_id': server_id})
-                            channel_id = server_id
-                            if server_alerts is not None and len(server_alerts) > 0:
-                                channel_id = server_alerts[0].get('channel_id')
-                            channel = self.bot.get_channel(channel_id)
-                            # Get the member that has just gone live
-                            member = discord.utils.get(server.members, id=m_id)
-                            fmt = "{} has just gone offline! Catch them next time they stream at {}".format(
-                                member.display_name, url)
-                            await self.bot.send_message(channel, fmt)
-                        await utils.update_content('twitch', {'live': 0}, {'member_id': m_id})
+                # Everyone is read first, so that a connection isn't held while we wait on twitch and discord
+                twitch = await utils.read_content('twitch', {'notifications_on': 1},
+                                                  pluck=['member_id', 'twitch_url', 'servers', 'live'])
+                changes = []
+                # Start checking everyone, only check_concurrency are checked at once
+                # and the rate limiter decides how fast these are actually sent
+                limit = asyncio.Semaphore(check_concurrency)
+                checks = []
+                try:
+                    for result in twitch:
+                        # Get their url and their user based on that url
+                        user = re.search("(?<=twitch.tv/)(.*)", result['twitch_url']).group(1)
+                        checks.append((result, self.bot.loop.create_task(self._limited_check(limit, user))))
+                    await self._notify(checks, changes)
+                finally:
+                    # If something went wrong, don't leave the rest of the checks running
+                    for _, check in checks:
+                        check.cancel()
+                # Everyone whose status changed is saved at once, instead of one query per person
+                if not await utils.bulk_update('twitch', changes):
+                    log.warning("Couldn't save who has gone live/offline, they may be announced again")
                 await asyncio.sleep(30)
         except Exception as e:
             tb = traceback.format_exc()
             fmt = "{1}\n{0.__class__.__name__}: {0}".format(tb, e)
             log.error(fmt)
 
+    async def _notify(self, checks, changes):
+        # Goes through the checks as they finish, announcing everyone that has gone live/offline
+        # and adding them to changes, so that their new status can be saved
+        for result, check in checks:
+            m_id = result['member_id']
+            url = result['twitch_url']
+            # Check if they are online right now, and if that's changed since last time
+            # If we couldn't tell, leave them as they were until the next check
+            online = await check
+            if online is None or online == bool(result['live']):
+                continue
+            for server_id in result['servers']:
+                # Get the channel to send the message to, based on the saved alert's channel
+                server = self.bot.get_server(server_id)
+                if server is None:
+                    continue
+                server_alerts = await utils.get_content('server_alerts', {'server_id': server_id})
+                try:
+                    channel_id = server_alerts[0]['channel_id']
+                except (IndexError, TypeError, KeyError):
+                    channel_id = server_id
+                channel = self.bot.get_channel(channel_id)
+                # Get the member that has just gone live/offline
+                member = discord.utils.get(server.members, id=m_id)
+                if member is None:
+                    continue
+
+                if online:
+                    fmt = "{} has just gone live! View their stream at {}".format(member.display_name, url)
+                else:
+                    fmt = "{} has just gone offline! Catch them next time they stream at {}".format(
+                        member.display_name, url)
+                await self.bot.send_message(channel, fmt)
+            changes.append(({'member_id': m_id}, {'live': int(online)}))
+
     @commands.group(no_pm=True, invoke_without_command=True, pass_context=True)
     @utils.custom_perms(send_messages=True)
     async def twitch(self, ctx, *, member: discord.Member = None):
@@ -123,9 +138,8 @@ class Twitch:
         url = result['twitch_url']
         user = re.search("(?<=twitch.tv/)(.*)", url).group(1)
         twitch_url = "https://api.twitch.tv/kraken/channels/{}?client_id={}".format(user, self.key)
-        with aiohttp.ClientSession() as s:
-            async with s.get(twitch_url) as response:
-                data = await response.json()
+        async with utils.http_session.get(twitch_url) as response:
+            data = await response.json()
 
         fmt = "Username: {}".format(data['display_name'])
         fmt += "\nStatus: {}".format(data['status'])
@@ -156,12 +170,11 @@ class Twitch:
             url = "https://www.{}".format(url)
 
         # Try to find the channel provided, we'll get a 404 response if it does not exist
-        with aiohttp.ClientSession() as s:
-            async with s.get(url) as response:
-                if not response.status == 200:
-                    await self.bot.say("That twitch user does not exist! "
-                                       "What would be the point of adding a nonexistant twitch user? Silly")
-                    return
+        async with utils.http_session.get(url) as response:
+            if not response.status == 200:
+                await self.bot.say("That twitch user does not exist! "
+                                   "What would be the point of adding a nonexistant twitch user? Silly")
+                return
 
         r_filter = {'member_id': ctx.message.author.id}
         entry = {'twitch_url': url,
@@ -174,8 +187,7 @@ class Twitch:
         # Check to see if this user has already saved a twitch URL
         # If they have, update the URL, otherwise create a new entry
         # Assuming they're not live, and notifications should be on
-        if not await utils.add_content('twitch', entry, r_filter):
-            await utils.update_content('twitch', update, r_filter)
+        await utils.upsert_content('twitch', r_filter, entry, update)
         await self.bot.say("I have just saved your twitch url {}".format(ctx.message.author.mention))
 
     @twitch.command(name='remove', aliases=['delete'], pass_context=True, no_pm=True)
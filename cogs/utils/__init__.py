@@ -1,6 +1,12 @@
 from .cards import Deck
-from .checks import is_owner, custom_perms, is_pm, db_check
+from .checks import is_owner, custom_perms, is_pm, db_check, db_startup
 from .config import *
 from .utilities import *
 from .images import create_banner
 from .paginator import Pages, CannotPaginate
+from .usage import usage_buffer, get_command_usage, get_top_commands
+from .ranking import battle_rankings
+from .web import http_session, single_flight
+from .httpcache import response_cache
+from .ratelimit import rate_limiter, INTERACTIVE, BACKGROUND
+from .requeststats import request_stats
@@ -1,4 +1,7 @@
 import asyncio
+import collections
+import hashlib
+import json
 import rethinkdb as r
 
 from discord.ext import commands
@@ -8,51 +11,171 @@ from . import config
 loop = asyncio.get_event_loop()
 
 # The list of tables needed for the database
-table_list = ['battle_records', 'battling', 'boops', 'bot_data', 'command_usage', 'custom_permissions',
-              'deviantart', 'motd', 'nsfw_channels', 'overwatch', 'picarto', 'prefixes', 'raffles',
-              'rules', 'server_alerts', 'strawpolls', 'tags', 'tictactoe', 'twitch', 'user_notifications']
+table_list = ['battle_records', 'battling', 'boops', 'bot_data', 'command_member_usage', 'command_server_usage',
+              'command_usage', 'custom_permissions', 'deviantart', 'motd', 'nsfw_channels', 'overwatch', 'picarto',
+              'prefixes', 'raffles', 'rules', 'schema', 'server_alerts', 'strawpolls', 'tags', 'tictactoe',
+              'twitch', 'user_notifications']
 
 
-async def db_check():
-    """Used to check if the required database/tables are setup"""
-    db_opts = config.db_opts
+class _Timer:
+    # Keeps track of how long each step of starting up took
+    def __init__(self):
+        self.timings = collections.OrderedDict()
+        self._last = loop.time()
 
-    r.set_loop_type('asyncio')
-    # First try to connect, and see if the correct information was provided
+    def step(self, name):
+        now = loop.time()
+        self.timings[name] = now - self._last
+        self._last = now
+
+
+def schema_version():
+    """A hash of every table, index and key we expect to be setup; if any of those change, so does this"""
+    schema = {'tables': table_list, 'indexes': config.table_indexes, 'keys': config.table_keys}
+    return hashlib.sha1(json.dumps(schema, sort_keys=True).encode()).hexdigest()
+
+
+async def db_connect():
+    """Opens the pool's connections, quitting if the database can't be reached"""
     try:
-        conn = await r.connect(**db_opts)
-    except r.errors.ReqlDriverError:
-        print("Cannot connect to the RethinkDB instance with the following information: {}".format(db_opts))
+        await config.pool.start()
+    except (r.errors.ReqlDriverError, asyncio.TimeoutError):
+        print("Cannot connect to the RethinkDB instance with the following information: {}".format(config.db_opts))
 
         print("The RethinkDB instance you have setup may be down, otherwise please ensure you setup a"\
         " RethinkDB instance, and you have provided the correct database information in config.yml")
         quit()
 
+
+async def db_check(*, timer=None):
+    """Used to check if the required database/tables are setup
+    Each table is checked at the same time, rather than waiting for one to be done before starting the next
+    Returns how long each step took, in the format {step: seconds}"""
+    db_opts = config.db_opts
+    pool = config.pool
+    if timer is None:
+        timer = _Timer()
+
+    # First try to connect, and see if the correct information was provided
+    await db_connect()
+
     # Get the current databases and check if the one we need is there
-    dbs = await r.db_list().run(conn)
+    dbs = await pool.run(r.db_list())
     if db_opts['db'] not in dbs:
         # If not, we want to create it
         print('Couldn\'t find database {}...creating now'.format(db_opts['db']))
-        await r.db_create(db_opts['db']).run(conn)
-        # Then add all the tables
-        for table in table_list:
-            print("Creating table {}...".format(table))
-            await r.table_create(table).run(conn)
-        print("Done!")
+        await pool.run(r.db_create(db_opts['db']))
+    timer.step('database')
+
+    # Make sure all the required tables are there
+    tables = await pool.run(r.table_list())
+    await asyncio.gather(*[_create_table(table) for table in table_list if table not in tables])
+    print("Done checking tables!")
+    timer.step('tables')
+
+    # Now make sure every index we use to look things up is setup as well
+    await asyncio.gather(*[_check_indexes(table, indexes) for table, indexes in config.table_indexes.items()])
+    print("Done checking indexes!")
+    timer.step('indexes')
+
+    # Rows need to have an ID built from their key fields for upsert_content, any that don't are moved to one that does
+    await asyncio.gather(*[_check_keys(table, fields) for table, fields in config.table_keys.items()])
+    timer.step('keys')
+
+    # Everything is setup now, so remember that for next time we start
+    await pool.run(r.table('schema').insert({'id': 'version', 'version': schema_version()}, conflict='replace'))
+    return timer.timings
+
+
+async def db_startup(*, fast_boot=None):
+    """Gets the database ready before the bot starts handling commands, then loads every cache
+    With fast_boot (db_fast_boot in config.yml by default) the tables and indexes are only checked
+    if the schema version saved in the database doesn't match the one we expect
+    Prints, and returns, how long each step took in the format {step: seconds}"""
+    if fast_boot is None:
+        fast_boot = config.db_fast_boot
+    timer = _Timer()
+
+    await db_connect()
+    timer.step('connect')
+
+    if fast_boot and await _schema_current():
+        print("The database is up to date, skipping checking the tables")
+        timer.step('schema')
     else:
-        # Otherwise, if the database is setup, make sure all the required tables are there
-        tables = await r.table_list().run(conn)
-        for table in table_list:
-            if table not in tables:
-                print("Creating table {}...".format(table))
-                await r.table_create(table).run(conn)
-        print("Done checking tables!")
+        await db_check(timer=timer)
+
+    try:
+        await config.warm_caches(config.db_timeout)
+    except asyncio.TimeoutError:
+        # They'll keep trying in the background, we just don't want to hold everything up on them
+        print("The caches took too long to load, starting without them")
+    timer.step('caches')
+
+    print("Database ready in {:.2f}s ({})".format(sum(timer.timings.values()), ", ".join(
+        "{} {:.2f}s".format(step, seconds) for step, seconds in timer.timings.items())))
+    return timer.timings
+
+
+async def _schema_current():
+    try:
+        saved = await config.pool.run(r.table('schema').get('version'))
+    except r.ReqlOpFailedError:
+        # The table isn't even setup, so this is either a new database or one setup before we saved this
+        return False
+    return saved is not None and saved.get('version') == schema_version()
+
+
+async def _create_table(table):
+    print("Creating table {}...".format(table))
+    await config.pool.run(r.table_create(table))
+
+
+async def _check_indexes(table, indexes):
+    pool = config.pool
+    current_indexes = await pool.run(r.table(table).index_list())
+    for index in indexes:
+        if isinstance(index, str):
+            name, fields = index, [index]
+        else:
+            name, fields = index
+        if name in current_indexes:
+            continue
+        print("Creating index {} on {}...".format(name, table))
+        if len(fields) == 1:
+            await pool.run(r.table(table).index_create(name, r.row[fields[0]]))
+        else:
+            await pool.run(r.table(table).index_create(name, [r.row[field] for field in fields]))
+    # Indexes are built in the background, so wait for them to be ready before we start using them
+    await pool.run(r.table(table).index_wait())
+
+
+async def _check_keys(table, fields):
+    def key(row):
+        key_expr = row[fields[0]].coerce_to('string')
+        for field in fields[1:]:
+            key_expr = key_expr.add(':', row[field].coerce_to('string'))
+        return key_expr
+
+    mismatched = r.table(table).filter(lambda row: row['id'].ne(key(row)), default=False)
+    result = await config.pool.run(mismatched.for_each(
+        lambda row: [r.table(table).insert(row.merge({'id': key(row)}), conflict='update'),
+                     r.table(table).get(row['id']).delete()]))
+    if result.get('deleted', 0) > 0:
+        print("Moved {} rows in {} to their new keys".format(result['deleted'], table))
+
 
 def is_owner(ctx):
     return ctx.message.author.id in config.owner_ids
 
 
 def custom_perms(**perms):
+    # The default permissions never change, so work these out once here instead of every time the command is used
+    default_perms = discord.Permissions.none()
+    for perm, setting in perms.items():
+        setattr(default_perms, perm, setting)
+    default_value = default_perms.value
+
     def predicate(ctx):
         # Return true if this is a private channel, we'll handle that in the registering of the command
         if ctx.message.channel.is_private:
@@ -60,23 +183,14 @@ def custom_perms(**perms):
 
         # Get the member permissions so that we can compare
         member_perms = ctx.message.author.permissions_in(ctx.message.channel)
-        # Next, set the default permissions if one is not used, based on what was passed
-        # This will be overriden later, if we have custom permissions
-        required_perm = discord.Permissions.none()
-        for perm, setting in perms.items():
-            setattr(required_perm, perm, setting)
-
-        perm_values = config.cache.get('custom_permissions').values
-
-        # Loop through and find this server's entry for custom permissions
-        # Find the command we're using, if it exists, then overwrite
-        # The required permissions, based on the value saved
-        for x in perm_values:
-            if x['server_id'] == ctx.message.server.id and x.get(ctx.command.qualified_name):
-                required_perm = discord.Permissions(x[ctx.command.qualified_name])
-
-        # Now just check if the person running the command has these permissions
-        return member_perms >= required_perm
+        # Use this server's custom permissions for the command if they have some setup, otherwise use the default
+        required_value = config.cache['custom_permissions'].get_perms(ctx.message.server.id,
+                                                                      ctx.command.qualified_name)
+        if required_value is None:
+            required_value = default_value
+
+        # Now just check if the person running the command has every one of these permissions
+        return member_perms.value & required_value == required_value
 
     predicate.perms = perms
     return commands.check(predicate)
@@ -1,8 +1,15 @@
 import ruamel.yaml as yaml
 import asyncio
+import collections
+import copy
+import functools
+import time
 import rethinkdb as r
 import pendulum
 
+from .database import ConnectionPool
+from .querystats import QueryStats
+
 loop = asyncio.get_event_loop()
 global_config = {}
 
@@ -29,19 +36,252 @@ except KeyError:
     quit()
 
 
-# This is a simple class for the cache concept, all it holds is it's own key and the values
-# With a method that gets content based on it's key
+# This is a simple class for the cache concept, it holds it's own key (the table) and every row in that table
+# The table is only loaded once, after that we follow the table's changefeed to keep the values up to date
 class Cache:
     def __init__(self, key):
         self.key = key
+        # The format for this is {id: row}
         self.values = {}
         self.refreshed = pendulum.utcnow()
-        loop.create_task(self.update())
+        # This is set once the whole table has been loaded for the first time
+        self.ready = asyncio.Event()
+        self._task = None
+
+    def start(self):
+        """Starts loading and following the table, this is safe to call more than once"""
+        if self._task is None:
+            self._task = loop.create_task(self.watch())
+
+    def load(self, values):
+        """Replaces everything we hold with the values given, this is done once the table has been fully read"""
+        self.values = values
+        self.refreshed = pendulum.utcnow()
 
-    async def update(self):
-        self.values = await get_content(self.key)
+    def apply(self, old_val, new_val):
+        """Applies one change from the changefeed to the values we hold"""
+        if old_val is not None:
+            self.values.pop(old_val['id'], None)
+        if new_val is not None:
+            self.values[new_val['id']] = new_val
         self.refreshed = pendulum.utcnow()
 
+    async def watch(self):
+        """Loads the table, then keeps following it's changefeed
+        If the feed drops, we wait a bit (longer each time it keeps failing) and then subscribe again"""
+        backoff = 1
+        while True:
+            conn = None
+            try:
+                # A changefeed holds onto it's connection forever, so don't take one from the pool for it
+                conn = await pool.connect()
+                # Including the initial values means we get the entire table, then every change after, in one query
+                # That way there's no gap between loading the table and following it where a change could be missed
+                feed = await r.table(self.key).changes(include_initial=True, include_states=True).run(conn)
+                # Until the table has been read in full, hold onto the values we had, so that reads never come up empty
+                values = {}
+                ready = False
+                while True:
+                    change = await feed.next()
+                    state = change.get('state')
+                    if state == 'ready':
+                        self.load(values)
+                        self.ready.set()
+                        ready = True
+                        backoff = 1
+                    elif state is not None:
+                        continue
+                    elif ready:
+                        self.apply(change.get('old_val'), change.get('new_val'))
+                    else:
+                        # Changes can still come in while the table is being read, so these need to be handled too
+                        old_val, new_val = change.get('old_val'), change.get('new_val')
+                        if old_val is not None:
+                            values.pop(old_val['id'], None)
+                        if new_val is not None:
+                            values[new_val['id']] = new_val
+            except (r.ReqlError, OSError, asyncio.TimeoutError):
+                pass
+            finally:
+                if conn is not None:
+                    loop.create_task(pool.close_connection(conn))
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 60)
+
+
+class PrefixCache(Cache):
+    """The cache for prefixes, this also holds every server's prefixes by the server's ID
+    That way finding a server's prefix doesn't depend on how many servers have one setup"""
+
+    def __init__(self, key):
+        # The format for this is {server_id: [prefix, ...]}, with the longest prefixes first
+        self.by_server = {}
+        super().__init__(key)
+
+    def load(self, values):
+        super().load(values)
+        by_server = {}
+        for row in values.values():
+            prefixes = _sort_prefixes(row.get('prefix'))
+            if prefixes:
+                by_server[row['server_id']] = prefixes
+        self.by_server = by_server
+
+    def apply(self, old_val, new_val):
+        super().apply(old_val, new_val)
+        if old_val is not None:
+            self.by_server.pop(old_val['server_id'], None)
+        if new_val is not None:
+            prefixes = _sort_prefixes(new_val.get('prefix'))
+            if prefixes:
+                self.by_server[new_val['server_id']] = prefixes
+
+
+class PermissionCache(Cache):
+    """The cache for custom permissions, this also holds every server's custom permissions by the server's ID
+    The permissions are saved as the value of the permissions object, so they can be compared directly"""
+
+    def __init__(self, key):
+        # The format for this is {server_id: {command_name: permissions_value}}
+        self.by_server = {}
+        super().__init__(key)
+
+    def load(self, values):
+        super().load(values)
+        self.by_server = {row['server_id']: _command_perms(row) for row in values.values()}
+
+    def apply(self, old_val, new_val):
+        super().apply(old_val, new_val)
+        if old_val is not None:
+            self.by_server.pop(old_val['server_id'], None)
+        if new_val is not None:
+            self.by_server[new_val['server_id']] = _command_perms(new_val)
+
+    def get_perms(self, server_id, command):
+        """Returns the custom permissions value setup for this command, or None if there isn't one"""
+        try:
+            return self.by_server[server_id][command] or None
+        except KeyError:
+            return None
+
+
+def _command_perms(row):
+    # Every key in the row other than these is a command's name
+    return {key: value for key, value in row.items() if key not in ('id', 'server_id')}
+
+
+def _sort_prefixes(prefix):
+    # Prefixes used to only be saved as a single string, so handle that as well as a list
+    if not prefix:
+        return None
+    if isinstance(prefix, str):
+        return [prefix]
+    # Sort the longest first, so that if one prefix starts with another (like ! and !!) the longer one is matched
+    return sorted(set(prefix), key=len, reverse=True)
+
+
+class QueryCache:
+    """Holds the results of get_content for a short time, so that hot lookups don't need a query every time
+    Only tables given a TTL are cached, and only filters that are plain dictionaries (not lambdas or ReQL)
+    Results that found nothing are cached as well, anything that writes to a table clears that table's entries
+
+    Paramaters:
+        ttls -> A dictionary of {table: seconds}, for how long a result from that table can be used
+        max_size -> The most results held at once, the least recently used are dropped past this"""
+
+    def __init__(self, ttls, *, max_size=1000):
+        self.ttls = ttls
+        self.max_size = max_size
+        # The format for this is {(table, filter): (expires, result)}, with the most recently used last
+        self._entries = collections.OrderedDict()
+        # The keys for each table, so that a table can be cleared without looking at every entry
+        self._tables = collections.defaultdict(set)
+        # This goes up every time a table is written to, so we know not to save a result that was read before then
+        self._generations = collections.Counter()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def key(self, table, r_filter):
+        """Returns the key for this lookup, or None if it can't be cached"""
+        if table not in self.ttls or not isinstance(r_filter, dict):
+            return None
+        try:
+            return table, _freeze(r_filter)
+        except TypeError:
+            return None
+
+    def generation(self, table):
+        return self._generations[table]
+
+    def get(self, key):
+        """Returns (True, result) if we have a result for this key that hasn't expired, otherwise (False, None)"""
+        try:
+            expires, result = self._entries[key]
+        except KeyError:
+            self.misses += 1
+            return False, None
+        if expires < loop.time():
+            self._remove(key)
+            self.misses += 1
+            return False, None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return True, copy.deepcopy(result)
+
+    def set(self, key, result, generation):
+        """Saves the result for this key, as long as the table hasn't been written to since generation"""
+        table = key[0]
+        if self._generations[table] != generation:
+            return
+        self._entries[key] = (loop.time() + self.ttls[table], copy.deepcopy(result))
+        self._entries.move_to_end(key)
+        self._tables[table].add(key)
+        while len(self._entries) > self.max_size:
+            old_key = next(iter(self._entries))
+            self._remove(old_key)
+            self.evictions += 1
+
+    def invalidate(self, table):
+        """Clears every result saved for this table"""
+        self._generations[table] += 1
+        keys = self._tables.pop(table, None)
+        if not keys:
+            return
+        for key in keys:
+            self._entries.pop(key, None)
+        self.invalidations += len(keys)
+
+    def stats(self):
+        """Returns a dictionary of how the cache is holding up"""
+        lookups = self.hits + self.misses
+        return {'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations}
+
+    def _remove(self, key):
+        self._entries.pop(key, None)
+        keys = self._tables.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+
+
+def _freeze(value):
+    # Turns a filter into something hashable, so that the same filter always gives the same key
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    raise TypeError("{} cannot be used as part of a cache key".format(type(value).__name__))
+
 
 # Default bot's description
 bot_description = global_config.get("description")
@@ -69,6 +309,52 @@ dev_server = global_config.get("dev_server", "")
 user_agent = global_config.get('user_agent', "")
 # The extensions to load
 extensions = global_config.get('extensions', [])
+# The interval (in seconds) we save command usage on, and how many different counters we hold before saving early
+usage_interval = global_config.get('usage_interval', 30)
+usage_max_pending = global_config.get('usage_max_pending', 1000)
+# How long (in seconds) results from each table can be reused, tables not included here are never cached
+query_cache_ttl = global_config.get('query_cache_ttl', {})
+# The most results that will be held at once
+query_cache_size = global_config.get('query_cache_size', 1000)
+
+# The limits on connections kept open for outbound HTTP requests, over every host and to each host
+http_limit = global_config.get('http_limit', 100)
+http_limit_per_host = global_config.get('http_limit_per_host', 10)
+# How long (in seconds) DNS lookups are reused, idle connections are kept open, and a request can take
+http_dns_ttl = global_config.get('http_dns_ttl', 300)
+http_keepalive = global_config.get('http_keepalive', 30)
+http_timeout = global_config.get('http_timeout', 30)
+# How many times a failed request is tried, how long (in seconds) to wait before the first retry
+# The most to ever wait between two tries, and how long to keep trying for in total
+http_retry_attempts = global_config.get('http_retry_attempts', 3)
+http_retry_backoff = global_config.get('http_retry_backoff', 0.5)
+http_retry_max_backoff = global_config.get('http_retry_max_backoff', 10)
+http_retry_deadline = global_config.get('http_retry_deadline', 20)
+# How many failures in a row stop requests to a site, and how long (in seconds) until we try that site again
+http_circuit_threshold = global_config.get('http_circuit_threshold', 5)
+http_circuit_reset = global_config.get('http_circuit_reset', 30)
+# How long (in seconds) responses from other sites can be reused, in the format {endpoint: seconds}
+# An endpoint is the site and the start of the path, like en.wikipedia.org/w/api.php
+http_cache_ttl = global_config.get('http_cache_ttl', {})
+# How long (in seconds) past that an old response can be used while it's requested again in the background
+http_cache_stale = global_config.get('http_cache_stale', 60)
+# The most (in bytes) held in memory, and the folder responses are saved to (nothing is saved if this isn't set)
+http_cache_size = global_config.get('http_cache_size', 16 * 1024 * 1024)
+http_cache_path = global_config.get('http_cache_path', '')
+# The most requests sent to each site, in the format {host: [requests, seconds]}, sites not included aren't limited
+http_rate_limits = global_config.get('http_rate_limits', {})
+# The share (from 0 to 1) of each site's limit that's kept for commands, background loops can only use the rest
+http_rate_reserve = global_config.get('http_rate_reserve', 0.2)
+# The biggest (in bytes) an image or file downloaded from a link can be
+# And how much of a download is held in memory, before the rest is written to a temporary file
+download_max_size = global_config.get('download_max_size', 8 * 1024 * 1024)
+download_spool_size = global_config.get('download_spool_size', 1024 * 1024)
+# Requests to other sites that take longer than this (in milliseconds) are logged, 0 to not log any
+# And how many of them are kept to be looked at
+http_slow_request_ms = global_config.get('http_slow_request_ms', 2000)
+http_slow_request_log_size = global_config.get('http_slow_request_log_size', 100)
+# Send every request to other sites here instead, this is only meant for testing against benchmarks/mock_upstream.py
+http_base_url = global_config.get('http_base_url', '')
 
 # The variables needed for sharding
 shard_count = global_config.get('shard_count', 1)
@@ -94,11 +380,90 @@ db_pass = global_config.get('db_pass', '')
 # db_opts = {'host': db_host, 'db': db_name, 'port': db_port, 'ssl':
 # {'ca_certs': db_cert}, 'user': db_user, 'password': db_pass}
 db_opts = {'host': db_host, 'db': db_name, 'port': db_port, 'user': db_user, 'password': db_pass}
+# The smallest and largest amount of connections kept open to the database
+db_pool_min = global_config.get('db_pool_min', 2)
+db_pool_max = global_config.get('db_pool_max', 10)
+# How long (in seconds) a query can take, or we can wait for a connection, before giving up
+db_timeout = global_config.get('db_timeout', 10)
+
+# Where the data is actually saved; rethinkdb, or memory to run without a database server (mainly for testing)
+db_backend = global_config.get('db_backend', 'rethinkdb')
+# For the memory backend, the SQLite file to save to (nothing is saved if this isn't set)
+# And how long (in seconds) to wait on every query, to act like the database is over the network
+db_memory_path = global_config.get('db_memory_path', '')
+db_memory_latency = global_config.get('db_memory_latency', 0)
+# Queries that take longer than this (in milliseconds) are logged, 0 to not log any, and how many of them are kept to be looked at
+db_slow_query_ms = global_config.get('db_slow_query_ms', 250)
+db_slow_query_log_size = global_config.get('db_slow_query_log_size', 100)
+# Skip checking every table and index is setup when starting, if the database says it's already up to date
+db_fast_boot = global_config.get('db_fast_boot', False)
+
+# Every query goes through this pool, so that we aren't opening a new connection for every single query
+r.set_loop_type("asyncio")
+if db_backend == 'memory':
+    from .memorydb import MemoryDatabase
+
+    memory_db = MemoryDatabase(path=db_memory_path or None, latency=db_memory_latency)
+    db_connect = memory_db.connect
+else:
+    db_connect = lambda: r.connect(**db_opts)
+pool = ConnectionPool(db_connect, min_size=db_pool_min, max_size=db_pool_max, timeout=db_timeout)
 
 possible_keys = ['prefixes', 'battle_records', 'boops', 'server_alerts', 'user_notifications', 'nsfw_channels',
                  'custom_permissions', 'rules', 'overwatch', 'picarto', 'twitch', 'strawpolls', 'tags',
                  'tictactoe', 'bot_data', 'command_manage']
 
+# The secondary indexes that are setup on each table, so that lookups don't have to scan the entire table
+# A string is an index on the field with that name, a tuple is a compound index in the format (name, [fields])
+table_indexes = {
+    'battle_records': ['member_id', 'rating'],
+    'boops': ['member_id'],
+    'bot_data': ['shard_id'],
+    'command_member_usage': ['member_id', ('member_usage', ['member_id', 'usage'])],
+    'command_server_usage': ['server_id', ('server_usage', ['server_id', 'usage'])],
+    'command_usage': ['command'],
+    'custom_permissions': ['server_id'],
+    'deviantart': ['member_id'],
+    'motd': ['date'],
+    'nsfw_channels': ['channel_id'],
+    'overwatch': ['member_id'],
+    'picarto': ['member_id', 'notifications_on'],
+    'prefixes': ['server_id'],
+    'raffles': ['server_id'],
+    'rules': ['server_id'],
+    'server_alerts': ['server_id'],
+    'strawpolls': ['server_id'],
+    'tags': ['server_id', ('server_tag', ['server_id', 'tag'])],
+    'tictactoe': ['member_id'],
+    'twitch': ['member_id', 'notifications_on'],
+    'user_notifications': ['server_id']
+}
+
+# The fields that uniquely identify a row in each table, these are used to build the row's primary key
+# That way we always know a row's ID ahead of time, and can insert or update it in one query
+table_keys = {
+    'battle_records': ['member_id'],
+    'boops': ['member_id'],
+    'bot_data': ['shard_id'],
+    'command_member_usage': ['command', 'member_id'],
+    'command_server_usage': ['command', 'server_id'],
+    'command_usage': ['command'],
+    'custom_permissions': ['server_id'],
+    'deviantart': ['member_id'],
+    'motd': ['date'],
+    'nsfw_channels': ['channel_id'],
+    'overwatch': ['member_id'],
+    'picarto': ['member_id'],
+    'prefixes': ['server_id'],
+    'rules': ['server_id'],
+    'server_alerts': ['server_id'],
+    'strawpolls': ['server_id'],
+    'tags': ['server_id', 'tag'],
+    'tictactoe': ['member_id'],
+    'twitch': ['member_id'],
+    'user_notifications': ['server_id']
+}
+
 # This will be a dictionary that holds the cache object, based on the key that is saved
 cache = {}
 
@@ -109,12 +474,20 @@ cache = {}
     ca che[k] = Cache(k)"""
 
 # We still need 'cache' for prefixes and custom permissions however, so for now, just include that
-cache['prefixes'] = Cache('prefixes')
-cache['custom_permissions'] = Cache('custom_permissions')
+cache['prefixes'] = PrefixCache('prefixes')
+cache['custom_permissions'] = PermissionCache('custom_permissions')
+
+# The cache for get_content, it's opt-in per table through query_cache_ttl
+query_cache = QueryCache(query_cache_ttl or {}, max_size=query_cache_size)
+# Every helper below records how long it took here, for each table
+query_stats = QueryStats(slow_threshold=db_slow_query_ms, slow_log_size=db_slow_query_log_size)
 
-async def update_cache():
-    for value in cache.values():
-        await value.update()
+
+async def warm_caches(timeout=None):
+    """Starts every cache, and waits until they have all loaded their table"""
+    for c in cache.values():
+        c.start()
+    await asyncio.wait_for(asyncio.gather(*[c.ready.wait() for c in cache.values()]), timeout)
 
 
 def command_prefix(bot, message):
@@ -122,122 +495,481 @@ def command_prefix(bot, message):
     # So assume it's in cache, or it doesn't exist
     # If the prefix does exist in the database and isn't in our cache; too bad, something has messed up
     # But it is not worth a query for every single message the bot detects, to fix
+    if message.server is None:
+        return default_prefix
+    prefixes = cache['prefixes'].by_server.get(message.server.id)
+    if not prefixes:
+        return default_prefix
+    # These are already sorted longest first, so the first one that matches is the one that was used
+    for prefix in prefixes:
+        if message.content.startswith(prefix):
+            return prefix
+    return prefixes
+
+
+def _find_index(table, r_filter):
+    """Returns the name of the best index to use for the filter given, the value(s) to look up on that index
+    and the part of the filter that the index doesn't cover. The name is None if no index can be used"""
+    if not isinstance(r_filter, dict) or len(r_filter) == 0:
+        return None, None, r_filter
+
+    # The primary key is always indexed, and it can only ever match one row
+    if 'id' in r_filter:
+        return 'id', r_filter['id'], {k: v for k, v in r_filter.items() if k != 'id'}
+
+    best = None
+    for index in table_indexes.get(table, []):
+        if isinstance(index, str):
+            name, fields = index, [index]
+        else:
+            name, fields = index
+        # Prefer the index that covers the most of the filter
+        if all(field in r_filter for field in fields) and (best is None or len(fields) > len(best[1])):
+            best = (name, fields)
+
+    if best is None:
+        return None, None, r_filter
+
+    name, fields = best
+    if len(fields) == 1:
+        value = r_filter[fields[0]]
+    else:
+        value = [r_filter[field] for field in fields]
+    remaining = {k: v for k, v in r_filter.items() if k not in fields}
+    return name, value, remaining
+
+
+def _select(table, r_filter, use_index=True):
+    """Creates the selection of rows matching the filter, using an index for the lookup if one exists"""
+    name, value, remaining = _find_index(table, r_filter) if use_index else (None, None, r_filter)
+    if name is None:
+        return r.table(table).filter(r_filter)
+
+    selection = r.table(table).get_all(value, index=name)
+    if remaining:
+        selection = selection.filter(remaining)
+    return selection
+
+
+async def _run_selection(table, r_filter, action=None):
+    """Runs the query created by passing the selection for this filter to action
+    If the index needed isn't setup yet, this falls back to filtering the whole table"""
+    if action is None:
+        action = lambda selection: selection
     try:
-        values = cache['prefixes'].values
+        return await pool.run(action(_select(table, r_filter)))
+    except r.ReqlOpFailedError:
+        if _find_index(table, r_filter)[0] is None:
+            raise
+        return await pool.run(action(_select(table, r_filter, use_index=False)))
+
+
+def _writes(func):
+    # Anything cached for a table can't be trusted after it's written to, so clear it once the write is done
+    # This is done even if the write failed, since we can't know if it made it to the database or not
+    @functools.wraps(func)
+    async def wrapper(table, *args, **kwargs):
         try:
-            prefix = [data['prefix'] for data in values if message.server.id == data['server_id']][0]
-        except IndexError:
-            prefix = None
-        except AttributeError:
-            prefix = None
-        return prefix or default_prefix
-    except KeyError:
-        return default_prefix
+            return await func(table, *args, **kwargs)
+        finally:
+            query_cache.invalidate(table)
 
+    return wrapper
 
+
+def primary_key(table, key):
+    """Builds the primary key for the row identified by key, a dictionary of the fields that identify that row"""
+    fields = table_keys.get(table) or sorted(key)
+    return ':'.join(str(key[field]) for field in fields)
+
+
+@query_stats.instrument
+@_writes
+async def upsert_content(table, key, content, update=None):
+    """Saves content as the row identified by key, updating the row instead if it already exists
+    This is done in one query, so there's no chance of someone else adding the same row in between
+    Provide update (a dictionary, or a function that takes the current row) to change what happens to an existing row
+    Otherwise content is merged into the existing row
+
+    Returns 'inserted', 'updated' or 'unchanged' based on what happened, or None if nothing could be saved"""
+    entry = dict(content)
+    entry.update(key)
+    entry['id'] = primary_key(table, key)
+
+    if update is None:
+        conflict = 'update'
+    elif callable(update):
+        conflict = lambda _id, old, new: old.merge(update(old))
+    else:
+        conflict = lambda _id, old, new: old.merge(update)
+
+    try:
+        result = await pool.run(r.table(table).insert(entry, conflict=conflict))
+    except r.ReqlOpFailedError:
+        return None
+
+    if result.get('inserted', 0) > 0:
+        return 'inserted'
+    elif result.get('replaced', 0) > 0:
+        return 'updated'
+    elif result.get('unchanged', 0) > 0:
+        return 'unchanged'
+    return None
+
+
+@query_stats.instrument
+@_writes
+async def increment_content(table, rows, field, *, return_unsaved=False):
+    """Adds to field on each of the rows given, any row that doesn't exist yet is created
+    rows is a list of (key, amount), key being a dictionary of the fields that identify the row (like upsert_content)
+    All of the rows are saved in one query, returns True if every row was saved
+
+    Increments can't be safely sent again, so if return_unsaved is True the list of keys that definitely weren't
+    saved is returned instead (empty if every row was). If the query itself times out or the connection drops,
+    the error is raised as normal, since there's no way to tell what was saved"""
+    entries = []
+    for key, amount in rows:
+        entry = dict(key)
+        entry[field] = amount
+        entry['id'] = primary_key(table, key)
+        entries.append(entry)
+    if not entries:
+        return [] if return_unsaved else True
+
+    # The amount is added on the database's side, so two increments at the same time can't overwrite each other
+    conflict = lambda _id, old, new: old.merge({field: old[field].default(0).add(new[field])})
+    try:
+        result = await pool.run(r.table(table).insert(entries, conflict=conflict, return_changes=return_unsaved))
+    except r.ReqlOpFailedError:
+        # The write was refused outright (like the table not existing), so nothing was saved
+        return [key for key, _ in rows] if return_unsaved else False
+    if not return_unsaved:
+        return result.get('errors', 0) == 0
+
+    # Every row that was written is in the changes, anything else (an error, or nothing to add) wasn't
+    saved = set(change['new_val']['id'] for change in result.get('changes', [])
+                if change.get('new_val') is not None and 'error' not in change)
+    return [key for (key, _), entry in zip(rows, entries) if entry['id'] not in saved]
+
+
+def _row_id(table, key):
+    # Rows can be identified by their ID directly, or by the fields that make up their ID
+    return key['id'] if 'id' in key else primary_key(table, key)
+
+
+@query_stats.instrument
+@_writes
+async def bulk_insert(table, rows, *, conflict='error', batch_size=500):
+    """Inserts every row given, sending batch_size rows per query
+    Rows without an ID are given one from their key fields, if this table has them (see table_keys)
+    conflict is what to do with a row that already exists, the same as RethinkDB's insert
+    Returns True if every row was saved"""
+    entries = []
+    for row in rows:
+        entry = dict(row)
+        if 'id' not in entry and table in table_keys:
+            entry['id'] = primary_key(table, entry)
+        entries.append(entry)
+    return await _batched(entries, batch_size, lambda batch: r.table(table).insert(batch, conflict=conflict))
+
+
+@query_stats.instrument
+@_writes
+async def bulk_update(table, updates, *, batch_size=500):
+    """Applies each update given, sending batch_size updates per query
+    updates is a list of (key, patch); key is a dictionary of the fields that identify the row (like upsert_content)
+    or just the row's ID, and patch is merged into that row. Rows that don't exist are skipped
+    Returns True if every update was saved, a row that didn't exist counts as not being saved"""
+    entries = [{'id': _row_id(table, key), 'patch': patch} for key, patch in updates]
+    return await _batched(entries, batch_size, lambda batch: r.expr(batch).for_each(
+        lambda entry: r.table(table).get(entry['id']).update(entry['patch'])))
+
+
+@query_stats.instrument
+@_writes
+async def bulk_delete(table, keys, *, batch_size=500):
+    """Deletes every row identified by the keys given (like bulk_update), sending batch_size keys per query
+    Returns True if every delete went through"""
+    ids = [_row_id(table, key) for key in keys]
+    return await _batched(ids, batch_size, lambda batch: r.table(table).get_all(*batch).delete())
+
+
+async def _batched(items, batch_size, query):
+    # Runs the query made for each batch of the items, one after another
+    success = True
+    for i in range(0, len(items), batch_size):
+        try:
+            result = await pool.run(query(items[i:i + batch_size]))
+        except r.ReqlOpFailedError:
+            success = False
+            continue
+        # Skipped means the row to update/delete wasn't there, which means the key given was wrong
+        if result.get('errors', 0) > 0 or result.get('skipped', 0) > 0:
+            success = False
+    return success
+
+
+@query_stats.instrument
+@_writes
 async def add_content(table, content, r_filter=None):
-    r.set_loop_type("asyncio")
-    conn = await r.connect(**db_opts)
     # First we need to make sure that this entry doesn't exist
     # For all rethinkDB cares, multiple entries can exist with the same content
     # For our purposes however, we do not want this
     try:
         if r_filter is not None:
-            cursor = await r.table(table).filter(r_filter).run(conn)
-            cur_content = await _convert_to_list(cursor)
+            cur_content = await _run_selection(table, r_filter, lambda selection: selection.limit(1))
             if len(cur_content) > 0:
-                await conn.close()
                 return False
-        await r.table(table).insert(content).run(conn)
-        await conn.close()
+        await pool.run(r.table(table).insert(content))
         return True
     except r.ReqlOpFailedError:
         # This means the table does not exist
-        await r.table_create(table).run(conn)
-        await r.table(table).insert(content).run(conn)
-        await conn.close()
+        await pool.run(r.table_create(table))
+        await pool.run(r.table(table).insert(content))
         return True
 
 
+@query_stats.instrument
+@_writes
 async def remove_content(table, r_filter=None):
     if r_filter is None:
         r_filter = {}
-    r.set_loop_type("asyncio")
-    conn = await r.connect(**db_opts)
     try:
-        result = await r.table(table).filter(r_filter).delete().run(conn)
+        result = await _run_selection(table, r_filter, lambda selection: selection.delete())
     except r.ReqlOpFailedError:
         result = {}
         pass
-    await conn.close()
-    if table == 'prefixes' or table == 'custom_permissions':
-        loop.create_task(cache[table].update())
     return result.get('deleted', 0) > 0
 
 
+@query_stats.instrument
+@_writes
 async def update_content(table, content, r_filter=None):
     if r_filter is None:
         r_filter = {}
-    r.set_loop_type("asyncio")
-    conn = await r.connect(**db_opts)
     # This method is only for updating content, so if we find that it doesn't exist, just return false
     try:
         # Update based on the content and filter passed to us
         # rethinkdb allows you to do many many things inside of update
         # This is why we're accepting a variable and using it, whatever it may be, as the query
-        result = await r.table(table).filter(r_filter).update(content).run(conn)
+        result = await _run_selection(table, r_filter, lambda selection: selection.update(content))
     except r.ReqlOpFailedError:
-        await conn.close()
         result = {}
-    await conn.close()
-    if table == 'prefixes' or table == 'custom_permissions':
-        loop.create_task(cache[table].update())
     return result.get('replaced', 0) > 0 or result.get('unchanged', 0) > 0
 
 
+@query_stats.instrument
+@_writes
 async def replace_content(table, content, r_filter=None):
     # This method is here because .replace and .update can have some different functionalities
     if r_filter is None:
         r_filter = {}
-    r.set_loop_type("asyncio")
-    conn = await r.connect(**db_opts)
     try:
-        result = await r.table(table).filter(r_filter).replace(content).run(conn)
+        result = await _run_selection(table, r_filter, lambda selection: selection.replace(content))
     except r.ReqlOpFailedError:
-        await conn.close()
         result = {}
-    await conn.close()
-    if table == 'prefixes' or table == 'custom_permissions':
-        loop.create_task(cache[table].update())
     return result.get('replaced', 0) > 0 or result.get('unchanged', 0) > 0
 
 
+@query_stats.instrument
+@_writes
+async def increment_map_key(table, key, field, map_key, amount=1):
+    """Adds amount to field[map_key] on the row identified by key (like upsert_content), for fields that are a map
+    The row, or the key in the map, are created if they don't exist yet
+    This is done on the database's side in one query, so two increments at the same time are both counted
+    Returns the new value, or None if it couldn't be saved"""
+    entry = dict(key)
+    entry[field] = {map_key: amount}
+    entry['id'] = primary_key(table, key)
+
+    conflict = lambda _id, old, new: old.merge({field: {map_key: old[field][map_key].default(0).add(amount)}})
+    try:
+        result = await pool.run(r.table(table).insert(entry, conflict=conflict, return_changes=True))
+        return result['changes'][0]['new_val'][field][map_key]
+    except (r.ReqlOpFailedError, KeyError, IndexError, TypeError):
+        return None
+
+
+@query_stats.instrument
+@_writes
+async def set_add(table, field, value, r_filter=None):
+    """Adds value to the list in field, on the rows matching the filter, if it isn't in there already
+    Returns 'updated' if it was added, 'unchanged' if it was already there, or None if no rows matched"""
+    return await _update_field(table, r_filter, field, lambda items: items.default([]).set_insert(value))
+
+
+@query_stats.instrument
+@_writes
+async def set_remove(table, field, value, r_filter=None):
+    """Removes value from the list in field, on the rows matching the filter
+    Provide a function instead of a value to remove every item it returns true for, it's given each item
+    Returns 'updated' if anything was removed, 'unchanged' if there was nothing to remove, or None if no rows matched"""
+    if callable(value):
+        change = lambda items: items.default([]).filter(lambda item: r.not_(value(item)))
+    else:
+        change = lambda items: items.default([]).difference([value])
+    return await _update_field(table, r_filter, field, change)
+
+
+@query_stats.instrument
+@_writes
+async def delete_at(table, field, index, r_filter=None):
+    """Removes the item at index from the list in field, on the rows matching the filter
+    Returns 'updated' if it was removed, or None if no rows matched or there isn't anything at that index"""
+    return await _update_field(table, r_filter, field, lambda items: items.delete_at(index))
+
+
+async def _update_field(table, r_filter, field, change):
+    # Changes just the one field, on the database's side, so only the change itself has to be sent
+    # and nothing that's saved in between us reading the row and writing it back can be lost
+    if r_filter is None:
+        r_filter = {}
+    try:
+        result = await _run_selection(table, r_filter, lambda selection: selection.update(
+            lambda row: {field: change(row[field])}))
+    except r.ReqlOpFailedError:
+        return None
+    if result.get('replaced', 0) > 0:
+        return 'updated'
+    elif result.get('unchanged', 0) > 0:
+        return 'unchanged'
+    return None
+
+
+@query_stats.instrument
 async def get_content(table: str, r_filter=None):
     if r_filter is None:
         r_filter = {}
-    r.set_loop_type("asyncio")
-    conn = await r.connect(**db_opts)
+    # Check if we've looked this up recently, tables that aren't setup to be cached will never have a key
+    key = query_cache.key(table, r_filter)
+    if key is not None:
+        found, content = query_cache.get(key)
+        if found:
+            return content
+        generation = query_cache.generation(table)
     try:
-        cursor = await r.table(table).filter(r_filter).run(conn)
-        content = await _convert_to_list(cursor)
+        content = await _run_selection(table, r_filter)
         if len(content) == 0:
             content = None
     except (IndexError, r.ReqlOpFailedError):
         content = None
-    await conn.close()
-    if table == 'prefixes' or table == 'custom_permissions':
-        loop.create_task(cache[table].update())
+    # Nothing being found is saved as well, so that lookups for things that don't exist are cached too
+    if key is not None:
+        query_cache.set(key, content, generation)
     return content
 
 
-async def _convert_to_list(cursor):
-    # This method is here because atm, AsyncioCursor is not iterable
-    # For our purposes, we want a list, so we need to do this manually
-    cursor_list = []
-    while True:
+@query_stats.instrument
+async def get_content_by_index(table: str, index: str, *keys, between=None):
+    """Gets the content based on the secondary index provided, this is much faster than filtering on large tables
+    Provide the values to look up as keys; for a compound index each key is a list of each field's value
+    Or provide between as a tuple of (lower, upper) to get everything in that range (upper not included)"""
+    if between is not None:
+        query = r.table(table).between(between[0], between[1], index=index)
+    else:
+        query = r.table(table).get_all(*keys, index=index)
+    try:
+        content = await pool.run(query)
+        if len(content) == 0:
+            content = None
+    except r.ReqlOpFailedError:
+        content = None
+    return content
+
+
+class iter_content:
+    """Iterates over the rows matching the filter as they come in from the database, used as
+    `async for row in iter_content(table, r_filter):`
+    Only one batch of rows is held in memory at a time, instead of the whole result like get_content
+    The connection used is held until the rows run out, so don't do anything that takes forever between rows
+    (see read_content for that)
+
+    Paramaters:
+        table -> The table to read from
+        r_filter -> The same kind of filter get_content takes
+        pluck -> A list of the only fields to get from each row, so that the rest never has to be sent
+        batch_size -> The most rows the database will send at once"""
+
+    def __init__(self, table, r_filter=None, *, pluck=None, batch_size=500):
+        self.table = table
+        self.r_filter = {} if r_filter is None else r_filter
+        self.pluck = pluck
+        self.batch_size = batch_size
+        self._conn = None
+        self._cursor = None
+        self._done = False
+        # Only the time spent waiting on the database is recorded, not the time spent on each row in between
+        self._caller = query_stats.caller()
+        self._elapsed = 0
+        self._rows = 0
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._done:
+            raise StopAsyncIteration
+        start = time.perf_counter()
         try:
-            val = await cursor.next()
-            cursor_list.append(val)
-        except r.ReqlCursorEmpty:
-            break
-    return cursor_list
+            if self._cursor is None:
+                await self._start()
+                if self._cursor is None:
+                    raise StopAsyncIteration
+            row = await asyncio.wait_for(self._cursor.next(), pool.timeout)
+            self._rows += 1
+            self._elapsed += time.perf_counter() - start
+            return row
+        except (StopAsyncIteration, r.ReqlCursorEmpty):
+            self._elapsed += time.perf_counter() - start
+            self._release()
+            raise StopAsyncIteration
+        except:
+            self._elapsed += time.perf_counter() - start
+            self._release(discard=True, error=True)
+            raise
+
+    def close(self):
+        """Stops iterating, this only needs to be called when stopping before the rows have ran out"""
+        # The database could still be sending us rows on this connection, so it can't be used again
+        self._release(discard=self._cursor is not None)
+
+    def __del__(self):
+        if self._conn is not None:
+            self.close()
+
+    def _release(self, *, discard=False, error=False):
+        if not self._done:
+            query_stats.record(self.table, 'iter_content', self._elapsed, rows=self._rows, error=error,
+                               caller=self._caller, details=lambda: {'r_filter': self.r_filter})
+        self._done = True
+        if self._conn is not None:
+            pool.release(self._conn, discard=discard)
+            self._conn = None
+
+    async def _start(self):
+        self._conn = await pool.get()
+        for use_index in (True, False):
+            query = _select(self.table, self.r_filter, use_index=use_index)
+            if self.pluck:
+                query = query.pluck(*self.pluck)
+            try:
+                self._cursor = await asyncio.wait_for(query.run(self._conn, max_batch_rows=self.batch_size),
+                                                      pool.timeout)
+                return
+            except r.ReqlOpFailedError:
+                # Either the table doesn't exist, in which case there's nothing to iterate over
+                # Or the index isn't setup yet, in which case try again by filtering the whole table
+                if _find_index(self.table, self.r_filter)[0] is None:
+                    break
+        self._release()
+
+
+async def read_content(table, r_filter=None, *, pluck=None):
+    """Reads every row matching the filter into a list, using iter_content
+    Use this instead of iter_content when something slow (like a request to another site) is done for each row,
+    so that the connection is given back as soon as the rows are read, instead of being held the whole time
+    This is meant for small rows, so only get the fields needed with pluck"""
+    rows = []
+    async for row in iter_content(table, r_filter, pluck=pluck):
+        rows.append(row)
+    return rows
@@ -0,0 +1,274 @@
+import asyncio
+import collections
+
+import rethinkdb as r
+from rethinkdb import ql2_pb2
+
+loop = asyncio.get_event_loop()
+
+TermType = ql2_pb2.Term.TermType
+# The terms that change something, queries with any of these in them aren't safe to send twice
+_write_terms = {TermType.INSERT, TermType.UPDATE, TermType.REPLACE, TermType.DELETE, TermType.SYNC,
+                TermType.DB_CREATE, TermType.DB_DROP, TermType.TABLE_CREATE, TermType.TABLE_DROP,
+                TermType.INDEX_CREATE, TermType.INDEX_DROP, TermType.INDEX_RENAME, TermType.RECONFIGURE,
+                TermType.REBALANCE}
+
+
+class ConnectionPool:
+    """A pool of long-lived connections to the database
+    Connections are opened lazily up to max_size, and handed back out to whoever asks next
+    instead of being closed, so we only pay for the handshake once per connection
+
+    Paramaters:
+        connect -> A coroutine function that opens a brand new connection
+        min_size -> The amount of connections to keep open, even when idle
+        max_size -> The most connections that can be open at any one time
+        timeout -> How long (in seconds) to wait for a connection, and how long a query can run
+        health_interval -> How often (in seconds) idle connections are checked to make sure they're still alive"""
+
+    def __init__(self, connect, *, min_size=1, max_size=10, timeout=10, health_interval=60):
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max(max_size, min_size, 1)
+        self.timeout = timeout
+        self.health_interval = health_interval
+
+        self._idle = collections.deque()
+        self._waiters = collections.deque()
+        # The amount of connections that are open (or being opened) right now, idle or not
+        self._size = 0
+        self._health_task = None
+
+        # Counters that can be used to see how the pool is holding up
+        self.checkouts = 0
+        self.waits = 0
+        self.reconnects = 0
+        self.timeouts = 0
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def in_use(self):
+        return self._size - len(self._idle)
+
+    def stats(self):
+        """Returns a dictionary of the current state of the pool"""
+        return {'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self.in_use,
+                'waiting': len(self._waiters),
+                'checkouts': self.checkouts,
+                'waits': self.waits,
+                'reconnects': self.reconnects,
+                'timeouts': self.timeouts}
+
+    async def start(self):
+        """Opens the minimum amount of connections, and starts checking on them periodically
+        This is safe to call more than once, only the first call will do anything"""
+        if self._health_task is not None:
+            return
+        await self._fill()
+        self._health_task = loop.create_task(self._health_check())
+
+    async def close(self):
+        """Closes every idle connection, and stops the health checks"""
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+        while self._idle:
+            conn = self._idle.pop()
+            self._size -= 1
+            await self._close(conn)
+
+    async def connect(self):
+        """Opens a connection that isn't part of the pool, for things that hold onto a connection forever
+        Close it with close_connection when done with it"""
+        return await asyncio.wait_for(self._connect(), self.timeout)
+
+    async def close_connection(self, conn):
+        await self._close(conn)
+
+    def acquire(self):
+        """Used as `async with pool.acquire() as conn:`, the connection is returned to the pool afterwards"""
+        return _PoolContext(self)
+
+    async def run(self, query, **opts):
+        """Runs a query on a pooled connection, and returns the result
+        If the query returned a cursor, it's read in full before the connection is given back
+        A dropped connection is thrown away and the query is tried once more on a fresh one, as long as
+        the query only reads; a write might have made it to the database before the connection dropped"""
+        for attempt in range(2):
+            try:
+                conn = await self.get()
+            except r.ReqlDriverError:
+                # Nothing has been sent yet, so this is always safe to try again
+                self.reconnects += 1
+                if attempt:
+                    raise
+                continue
+            try:
+                result = await asyncio.wait_for(self._execute(query, conn, **opts), self.timeout)
+            except r.ReqlDriverError:
+                # The connection itself is broken, don't give it back to anyone else
+                self.release(conn, discard=True)
+                self.reconnects += 1
+                if attempt or _writes(query):
+                    raise
+                continue
+            except asyncio.TimeoutError:
+                # We don't know what state the connection was left in, so just get rid of it
+                self.release(conn, discard=True)
+                self.timeouts += 1
+                raise r.ReqlTimeoutError()
+            except:
+                self.release(conn)
+                raise
+            self.release(conn)
+            return result
+
+    async def get(self):
+        """Checks out a connection, waiting for one to be released if we're at our limit
+        Whoever calls this is responsible for calling release when they're done with it"""
+        self.checkouts += 1
+        while self._idle:
+            conn = self._idle.pop()
+            if conn.is_open():
+                return conn
+            # This connection died while it was sitting around, forget about it and try the next one
+            self._size -= 1
+            self.reconnects += 1
+
+        if self._size < self.max_size:
+            return await self._open()
+
+        # We're at our limit, so wait for someone else to release theirs
+        self.waits += 1
+        waiter = loop.create_future()
+        self._waiters.append(waiter)
+        try:
+            conn = await asyncio.wait_for(waiter, self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise r.ReqlTimeoutError()
+        finally:
+            try:
+                self._waiters.remove(waiter)
+            except ValueError:
+                pass
+        # None means a connection was thrown away, which freed up room (already reserved for us) to open our own
+        if conn is None:
+            return await self._open(reserved=True)
+        return conn
+
+    def release(self, conn, *, discard=False):
+        """Gives a connection back to the pool, or closes it if it shouldn't be used again"""
+        if discard or not conn.is_open():
+            self._size -= 1
+            loop.create_task(self._close(conn))
+            conn = None
+
+        # Hand this straight to whoever has been waiting the longest
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                if conn is None:
+                    # Reserve the spot we just freed up for them
+                    self._size += 1
+                waiter.set_result(conn)
+                return
+
+        if conn is not None:
+            self._idle.append(conn)
+
+    async def _execute(self, query, conn, **opts):
+        result = await query.run(conn, **opts)
+        # Cursors need the connection to fetch the rest of their results, so read it before we give it up
+        if isinstance(result, r.net.Cursor):
+            result = await _drain(result)
+        return result
+
+    async def _open(self, *, reserved=False):
+        # Reserve our spot before the connection is actually open, so that we don't go over max_size
+        if not reserved:
+            self._size += 1
+        try:
+            return await asyncio.wait_for(self._connect(), self.timeout)
+        except:
+            self._size -= 1
+            raise
+
+    async def _close(self, conn):
+        try:
+            await conn.close(noreply_wait=False)
+        except r.ReqlError:
+            pass
+
+    async def _fill(self):
+        while self._size < self.min_size:
+            self._idle.append(await self._open())
+
+    async def _health_check(self):
+        while True:
+            await asyncio.sleep(self.health_interval)
+            # Only the connections that are sitting idle are checked, the rest are obviously in use
+            for conn in list(self._idle):
+                try:
+                    await asyncio.wait_for(r.expr(1).run(conn), self.timeout)
+                except (r.ReqlError, asyncio.TimeoutError):
+                    try:
+                        self._idle.remove(conn)
+                    except ValueError:
+                        # It got checked out while we were pinging it; whoever has it will find out it's broken
+                        continue
+                    self._size -= 1
+                    self.reconnects += 1
+                    await self._close(conn)
+            # Make sure we're back up to our minimum amount of connections
+            try:
+                await self._fill()
+            except (r.ReqlError, asyncio.TimeoutError, OSError):
+                pass
+
+
+class _PoolContext:
+    def __init__(self, pool):
+        self.pool = pool
+        self.conn = None
+
+    async def __aenter__(self):
+        self.conn = await self.pool.get()
+        return self.conn
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.pool.release(self.conn, discard=isinstance(exc, (r.ReqlDriverError, asyncio.TimeoutError)))
+
+
+async def _drain(cursor):
+    # This method is here because atm, AsyncioCursor is not iterable
+    # For our purposes, we want a list, so we need to do this manually
+    cursor_list = []
+    while True:
+        try:
+            val = await cursor.next()
+            cursor_list.append(val)
+        except r.ReqlCursorEmpty:
+            break
+    return cursor_list
+
+
+def _writes(query):
+    """Returns True if the query changes anything in the database"""
+    terms = [query]
+    while terms:
+        term = terms.pop()
+        term_type = getattr(term, 'term_type', None)
+        if term_type is None:
+            term_type = getattr(term, 'tt', None)
+        if term_type in _write_terms:
+            return True
+        # Older drivers save a term's arguments as args, newer ones as _args
+        terms.extend(getattr(term, '_args', None) or getattr(term, 'args', None) or ())
+        terms.extend((getattr(term, 'optargs', None) or {}).values())
+    return False
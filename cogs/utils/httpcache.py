@@ -0,0 +1,269 @@
+import asyncio
+import collections
+import copy
+import hashlib
+import json
+import os
+import pickle
+import time
+from urllib.parse import urlparse
+
+from . import config
+
+loop = asyncio.get_event_loop()
+
+# How often (in seconds) the saved responses are gone through, to remove the ones that can't be used anymore
+prune_interval = 600
+
+
+class CachedResponse:
+    """One response held by the cache, along with what's needed to ask the site if it's changed"""
+
+    __slots__ = ('value', 'expires', 'stale_until', 'etag', 'last_modified', 'size')
+
+    def __init__(self, value, expires, stale_until, etag=None, last_modified=None, size=0):
+        self.value = value
+        self.expires = expires
+        self.stale_until = stale_until
+        self.etag = etag
+        self.last_modified = last_modified
+        self.size = size
+
+    @property
+    def fresh(self):
+        return time.time() < self.expires
+
+    @property
+    def usable(self):
+        """Whether this can still be used while a new copy is fetched in the background"""
+        return time.time() < self.stale_until
+
+    def validators(self):
+        """Returns the headers used to only get the response again if it's changed since we got it"""
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class ResponseCache:
+    """Holds the results of requests to other sites, so that the same lookup doesn't have to be requested every time
+    Only GET requests to the endpoints given a TTL are cached. An endpoint is the host and the start of the path,
+    (like en.wikipedia.org/w/api.php) and the longest one that matches a URL is the one used
+
+    Once a response expires, it can still be used for up to stale more seconds while it's fetched again in the
+    background. When it is fetched again, we send the ETag/Last-Modified we got, so the site can tell us
+    nothing has changed instead of sending everything again
+
+    Paramaters:
+        ttls -> A dictionary of {endpoint: seconds}, for how long a response from that endpoint can be used
+        stale -> How long (in seconds) past it's TTL a response can still be used while it's being fetched again
+        max_size -> The most (roughly, in bytes) held in memory at once, the least recently used are dropped past this
+        path -> The folder responses are also saved to, so they can be used after a restart. Nothing is saved if None
+                Responses that can't be used anymore are removed from here, and it's kept under max_size as well"""
+
+    def __init__(self, ttls, *, stale=0, max_size=16 * 1024 * 1024, path=None):
+        self.ttls = ttls
+        self.stale = stale
+        self.max_size = max_size
+        self.path = path
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+        # The format for this is {key: CachedResponse}, with the most recently used last
+        self._entries = collections.OrderedDict()
+        self._size = 0
+        # The keys that are being fetched again in the background right now
+        self._refreshing = set()
+        # When the saved responses were last pruned, 0 means they're pruned on the first save
+        self._pruned = 0
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.evictions = 0
+
+    def ttl(self, method, url):
+        """Returns how long responses for this request can be cached, or None if they can't be"""
+        if method != 'GET' or not self.ttls:
+            return None
+        parsed = urlparse(url)
+        endpoint = (parsed.hostname or '') + parsed.path
+        best = None
+        for prefix in self.ttls:
+            if endpoint.startswith(prefix) and (best is None or len(prefix) > len(best)):
+                best = prefix
+        return self.ttls[best] if best is not None else None
+
+    def key(self, method, url, params, attr):
+        """Returns the key for this request, or None if it can't be cached"""
+        if self.ttl(method, url) is None:
+            return None
+        try:
+            params = tuple(sorted((str(k), str(v)) for k, v in (params or {}).items()))
+        except AttributeError:
+            return None
+        return method, url, params, attr
+
+    async def get(self, key):
+        """Returns the CachedResponse for this key, whether it's fresh or not; or None if we have nothing for it"""
+        entry = self._entries.get(key)
+        if entry is None and self.path is not None:
+            entry = await loop.run_in_executor(None, self._read, key)
+            if entry is not None:
+                self._store(key, entry)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        if entry.fresh:
+            self.hits += 1
+        elif entry.usable:
+            self.stale_hits += 1
+        else:
+            self.misses += 1
+        return entry
+
+    def value(self, entry):
+        """Returns a copy of the response held, so that whoever uses it can't change what's held"""
+        return copy.deepcopy(entry.value)
+
+    def set(self, key, value, headers):
+        """Saves the value given for this key, headers are the headers of the response it came from"""
+        cache_control = headers.get('Cache-Control', '').lower()
+        if 'no-store' in cache_control:
+            return
+        ttl = self.ttl(key[0], key[1])
+        now = time.time()
+        entry = CachedResponse(copy.deepcopy(value), now + ttl, now + ttl + self.stale, headers.get('ETag'),
+                               headers.get('Last-Modified'), _size_of(value))
+        self._store(key, entry)
+        if self.path is not None:
+            loop.run_in_executor(None, self._write, key, entry)
+
+    def revalidate(self, key, entry):
+        """The site told us the response hasn't changed, so it can be used for another TTL"""
+        ttl = self.ttl(key[0], key[1])
+        now = time.time()
+        entry.expires = now + ttl
+        entry.stale_until = now + ttl + self.stale
+        # It may have been dropped while we were asking, so make sure it's held again
+        self._store(key, entry)
+        self.revalidated += 1
+        if self.path is not None:
+            loop.run_in_executor(None, self._write, key, entry)
+
+    def refresh(self, key, coro):
+        """Runs coro (which fetches this key again) in the background, if it isn't already being fetched"""
+        if key in self._refreshing:
+            coro.close()
+            return
+        self._refreshing.add(key)
+        task = loop.create_task(coro)
+        task.add_done_callback(lambda t: self._refreshing.discard(key))
+
+    def clear(self):
+        self._entries.clear()
+        self._size = 0
+
+    def stats(self):
+        """Returns a dictionary of how the cache is holding up"""
+        lookups = self.hits + self.stale_hits + self.misses
+        return {'entries': len(self._entries),
+                'size': self._size,
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.stale_hits) / lookups if lookups else 0,
+                'revalidated': self.revalidated,
+                'evictions': self.evictions}
+
+    def _store(self, key, entry):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._size -= old.size
+        self._entries[key] = entry
+        self._size += entry.size
+        while self._size > self.max_size and len(self._entries) > 1:
+            _, old = self._entries.popitem(last=False)
+            self._size -= old.size
+            self.evictions += 1
+
+    def _file(self, key):
+        name = hashlib.sha1(repr(key).encode()).hexdigest()
+        return os.path.join(self.path, name)
+
+    def _read(self, key):
+        try:
+            with open(self._file(key), 'rb') as f:
+                saved_key, entry = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+            return None
+        if saved_key != key:
+            return None
+        if not entry.usable:
+            try:
+                os.remove(self._file(key))
+            except OSError:
+                pass
+            return None
+        return entry
+
+    def _write(self, key, entry):
+        file = self._file(key)
+        try:
+            with open(file, 'wb') as f:
+                pickle.dump((key, entry), f)
+            # The file's modified time is set to when it can't be used anymore, so pruning doesn't have to read it
+            os.utime(file, (entry.stale_until, entry.stale_until))
+        except (OSError, pickle.PicklingError):
+            pass
+        if time.time() - self._pruned > prune_interval:
+            self._prune()
+
+    def _prune(self):
+        """Removes the saved responses that can't be used anymore, then the ones that expire soonest
+        until what's left is under max_size"""
+        self._pruned = now = time.time()
+        files = []
+        try:
+            entries = list(os.scandir(self.path))
+        except OSError:
+            return
+        for entry in entries:
+            try:
+                stat = entry.stat()
+                if stat.st_mtime < now:
+                    os.remove(entry.path)
+                else:
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+            except OSError:
+                continue
+
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        for _, size, file in files:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(file)
+            except OSError:
+                continue
+            total -= size
+
+
+def _size_of(value):
+    # This doesn't need to be exact, just close enough to keep the memory used in check
+    if isinstance(value, (bytes, str)):
+        return len(value)
+    try:
+        return len(json.dumps(value))
+    except (TypeError, ValueError):
+        return len(repr(value))
+
+
+response_cache = ResponseCache(config.http_cache_ttl or {}, stale=config.http_cache_stale,
+                               max_size=config.http_cache_size, path=config.http_cache_path or None)
@@ -0,0 +1,1290 @@
+"""An in-process stand in for RethinkDB, so the bot can be ran (and benchmarked) without a database server
+
+Queries are built exactly the same way as they are for RethinkDB, then instead of being sent to a server
+the query's terms are evaluated here against tables held in memory. Only the parts of ReQL this bot uses
+(and a few more that come along with them) are supported; anything else raises a ReqlQueryLogicError
+
+The tables can optionally be saved to an SQLite file, so that they are still around after a restart
+Set db_backend to memory in config.yml to use this"""
+
+import asyncio
+import bisect
+import collections
+import contextlib
+import copy
+import json
+import numbers
+import sqlite3
+import uuid
+
+import rethinkdb as r
+from rethinkdb import ast as r_ast
+from rethinkdb import ql2_pb2
+
+TermType = ql2_pb2.Term.TermType
+
+
+class MemoryDatabase:
+    """Holds every table, and hands out connections to them
+
+    Paramaters:
+        path -> The SQLite file the tables are saved to, if this is not provided nothing is saved
+        latency -> How long (in seconds) every query waits before it's ran, to act like a database over the network"""
+
+    def __init__(self, *, path=None, latency=0):
+        self.path = path
+        self.latency = latency
+        self.dbs = {'test'}
+        self.tables = {}
+        # How many queries have been ran, the benchmarks use this to count round trips
+        self.queries = 0
+        self._sqlite = None
+        if path:
+            self._sqlite = sqlite3.connect(path)
+            self._load()
+
+    async def connect(self):
+        """Opens a new connection, this is used in place of r.connect"""
+        return MemoryConnection(self)
+
+    def table(self, name):
+        try:
+            return self.tables[name]
+        except KeyError:
+            raise r.ReqlOpFailedError("Table `{}` does not exist.".format(name))
+
+    def create_db(self, name):
+        if name in self.dbs:
+            raise r.ReqlOpFailedError("Database `{}` already exists.".format(name))
+        self.dbs.add(name)
+        self._save("INSERT OR REPLACE INTO dbs VALUES (?)", (name,))
+
+    def create_table(self, name):
+        if name in self.tables:
+            raise r.ReqlOpFailedError("Table `{}` already exists.".format(name))
+        self.tables[name] = MemoryTable(self, name)
+        self._save("INSERT OR REPLACE INTO tables VALUES (?)", (name,))
+
+    def save_row(self, table, key, row):
+        if self._sqlite is None:
+            return
+        if row is None:
+            self._save("DELETE FROM rows WHERE tbl = ? AND id = ?", (table, json.dumps(key)))
+        else:
+            self._save("INSERT OR REPLACE INTO rows VALUES (?, ?, ?)", (table, json.dumps(key), json.dumps(row)))
+
+    def commit(self):
+        if self._sqlite is not None:
+            self._sqlite.commit()
+
+    def _save(self, statement, params):
+        if self._sqlite is not None:
+            self._sqlite.execute(statement, params)
+
+    def _load(self):
+        cursor = self._sqlite.cursor()
+        cursor.execute("CREATE TABLE IF NOT EXISTS dbs (name TEXT PRIMARY KEY)")
+        cursor.execute("CREATE TABLE IF NOT EXISTS tables (name TEXT PRIMARY KEY)")
+        cursor.execute("CREATE TABLE IF NOT EXISTS rows (tbl TEXT, id TEXT, doc TEXT, PRIMARY KEY (tbl, id))")
+        self._sqlite.commit()
+
+        self.dbs.update(name for name, in cursor.execute("SELECT name FROM dbs"))
+        for name, in cursor.execute("SELECT name FROM tables").fetchall():
+            self.tables[name] = MemoryTable(self, name)
+        for table, doc in cursor.execute("SELECT tbl, doc FROM rows"):
+            if table in self.tables:
+                self.tables[table].load_row(json.loads(doc))
+        # Secondary indexes aren't saved, db_check sets these up again every time the bot starts
+
+
+class MemoryTable:
+    def __init__(self, database, name):
+        self.database = database
+        self.name = name
+        # The format for this is {id: row}
+        self.rows = {}
+        # The format for this is {name: MemoryIndex}, every table has its primary key as an index as well
+        self.indexes = {'id': MemoryIndex(lambda row: row['id'])}
+        self.feeds = set()
+
+    def load_row(self, row):
+        self.rows[row['id']] = row
+        for index in self.indexes.values():
+            index.add(row)
+
+    def create_index(self, name, function):
+        if name in self.indexes:
+            raise r.ReqlOpFailedError("Index `{}` already exists on table `{}`.".format(name, self.name))
+        index = MemoryIndex(function)
+        for row in self.rows.values():
+            index.add(row)
+        self.indexes[name] = index
+
+    def index(self, name):
+        try:
+            return self.indexes[name]
+        except KeyError:
+            raise r.ReqlOpFailedError("Index `{}` was not found on table `{}`.".format(name, self.name))
+
+    @contextlib.contextmanager
+    def bulk_write(self):
+        """Used around writing a lot of rows at once, so each index is sorted once at the end instead of on every row"""
+        for index in self.indexes.values():
+            index.deferred = True
+        try:
+            yield
+        finally:
+            for index in self.indexes.values():
+                index.deferred = False
+                index.sort()
+
+    def write(self, key, row):
+        """Saves row as the row with this key, or deletes it if row is None; every index and feed is updated"""
+        old = self.rows.pop(key, None)
+        if old is not None:
+            for index in self.indexes.values():
+                index.remove(old)
+        if row is not None:
+            self.rows[key] = row
+            for index in self.indexes.values():
+                index.add(row)
+        self.database.save_row(self.name, key, row)
+        for feed in list(self.feeds):
+            feed.put({'old_val': copy.deepcopy(old), 'new_val': copy.deepcopy(row)})
+
+
+class SortedEntries:
+    """A sorted list kept as a list of smaller sorted chunks, so adding or removing an entry only moves the
+    entries in that one chunk instead of every entry after it. Finding the chunk is a binary search over
+    the last entry of each, so writes take O(log n) plus the size of a chunk, which doesn't grow with the table
+
+    This supports what MemoryIndex needs from a list: len, reading by position, and bisect_left/bisect_right"""
+
+    # Chunks are split once they're twice this size, and merged with a neighbour once they're under half
+    load = 500
+
+    def __init__(self):
+        self._chunks = []
+        # The last (largest) entry of each chunk
+        self._maxes = []
+        # The position of the first entry of each chunk, worked out again the first time it's needed after a write
+        self._offsets = None
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, position):
+        if position < 0:
+            position += self._len
+        if not 0 <= position < self._len:
+            raise IndexError("SortedEntries index out of range")
+        offsets = self._positions()
+        i = bisect.bisect_right(offsets, position) - 1
+        return self._chunks[i][position - offsets[i]]
+
+    def _positions(self):
+        if self._offsets is None:
+            self._offsets = []
+            total = 0
+            for chunk in self._chunks:
+                self._offsets.append(total)
+                total += len(chunk)
+        return self._offsets
+
+    def add(self, entry):
+        self._offsets = None
+        self._len += 1
+        if not self._chunks:
+            self._chunks.append([entry])
+            self._maxes.append(entry)
+            return
+        i = bisect.bisect_left(self._maxes, entry)
+        if i == len(self._maxes):
+            # Larger than everything, so it goes on the end of the last chunk
+            i -= 1
+            self._chunks[i].append(entry)
+            self._maxes[i] = entry
+        else:
+            bisect.insort(self._chunks[i], entry)
+        if len(self._chunks[i]) > self.load * 2:
+            self._split(i)
+
+    def remove(self, entry):
+        """Removes entry, returns False if it wasn't there"""
+        i = bisect.bisect_left(self._maxes, entry)
+        if i == len(self._maxes):
+            return False
+        chunk = self._chunks[i]
+        j = bisect.bisect_left(chunk, entry)
+        if chunk[j] != entry:
+            return False
+        del chunk[j]
+        self._offsets = None
+        self._len -= 1
+        if not chunk:
+            del self._chunks[i]
+            del self._maxes[i]
+        elif len(chunk) < self.load // 2 and len(self._chunks) > 1:
+            # Merge it into the chunk next to it, so removing rows doesn't leave lots of tiny chunks around
+            i = i - 1 if i else i
+            merged = self._chunks[i] + self._chunks[i + 1]
+            self._chunks[i:i + 2] = [merged]
+            self._maxes[i:i + 2] = [merged[-1]]
+            if len(merged) > self.load * 2:
+                self._split(i)
+        else:
+            self._maxes[i] = chunk[-1]
+        return True
+
+    def update(self, entries):
+        """Adds a lot of entries at once, this sorts everything once instead of placing each one"""
+        combined = [entry for chunk in self._chunks for entry in chunk]
+        combined.extend(entries)
+        combined.sort()
+        self._chunks = [combined[i:i + self.load] for i in range(0, len(combined), self.load)]
+        self._maxes = [chunk[-1] for chunk in self._chunks]
+        self._offsets = None
+        self._len = len(combined)
+
+    def bisect_left(self, entry):
+        i = bisect.bisect_left(self._maxes, entry)
+        if i == len(self._maxes):
+            return self._len
+        return self._positions()[i] + bisect.bisect_left(self._chunks[i], entry)
+
+    def bisect_right(self, entry):
+        i = bisect.bisect_right(self._maxes, entry)
+        if i == len(self._maxes):
+            return self._len
+        return self._positions()[i] + bisect.bisect_right(self._chunks[i], entry)
+
+    def _split(self, i):
+        chunk = self._chunks[i]
+        self._chunks[i:i + 1] = [chunk[:self.load], chunk[self.load:]]
+        self._maxes[i:i + 1] = [chunk[self.load - 1], chunk[-1]]
+        self._offsets = None
+
+
+class MemoryIndex:
+    """A secondary index, this can look rows up by their value and also go through them in order"""
+
+    def __init__(self, function):
+        self.function = function
+        # The format for this is {sort_key: {id: row}}
+        self.buckets = {}
+        # Every (sort_key, sort_key of the id) in order, used for between and order_by
+        self.ordered = SortedEntries()
+        # The format for this is {sort_key of the id: id}, to get back to the row from an entry in ordered
+        self.ids = {}
+        # While this is set, new entries are held in _pending and added to ordered later in one go
+        self.deferred = False
+        self._pending = []
+
+    def key(self, row):
+        try:
+            return sort_key(self.function(row))
+        except r.ReqlError:
+            # Rows that can't be indexed (missing the field for example) are just left out, like RethinkDB does
+            return None
+
+    def add(self, row):
+        key = self.key(row)
+        if key is None:
+            return
+        self.buckets.setdefault(key, {})[row['id']] = row
+        id_key = sort_key(row['id'])
+        self.ids[id_key] = row['id']
+        if self.deferred:
+            self._pending.append((key, id_key))
+        else:
+            self.ordered.add((key, id_key))
+
+    def sort(self):
+        if self._pending:
+            self.ordered.update(self._pending)
+            self._pending = []
+
+    def remove(self, row):
+        key = self.key(row)
+        if key is None:
+            return
+        bucket = self.buckets.get(key, {})
+        bucket.pop(row['id'], None)
+        if not bucket:
+            self.buckets.pop(key, None)
+        id_key = sort_key(row['id'])
+        self.ids.pop(id_key, None)
+        entry = (key, id_key)
+        if not self.ordered.remove(entry) and entry in self._pending:
+            # This row was only just added, as part of the same bulk write
+            self._pending.remove(entry)
+
+    def get(self, value):
+        return list(self.buckets.get(sort_key(value), {}).values())
+
+    def range(self, lower=None, upper=None, *, left_bound='closed', right_bound='open'):
+        """Returns the (start, stop) positions in ordered that are between lower and upper"""
+        if lower is None:
+            start = 0
+        elif left_bound == 'closed':
+            start = self.ordered.bisect_left((sort_key(lower),))
+        else:
+            start = self.ordered.bisect_right((sort_key(lower), _MAX))
+        if upper is None:
+            stop = len(self.ordered)
+        elif right_bound == 'closed':
+            stop = self.ordered.bisect_right((sort_key(upper), _MAX))
+        else:
+            stop = self.ordered.bisect_left((sort_key(upper),))
+        return start, max(start, stop)
+
+
+class MemoryConnection:
+    """Used in place of a RethinkDB connection, queries ran on this are evaluated against a MemoryDatabase"""
+
+    def __init__(self, database):
+        self.database = database
+        self._open = True
+        self._feeds = set()
+
+    def is_open(self):
+        return self._open
+
+    async def close(self, noreply_wait=False):
+        self._open = False
+        for feed in list(self._feeds):
+            feed.close()
+
+    async def _start(self, term, **opts):
+        # This is what query.run(conn) calls
+        if not self._open:
+            raise r.ReqlDriverError("Connection is closed.")
+        self.database.queries += 1
+        if self.database.latency:
+            await asyncio.sleep(self.database.latency)
+        try:
+            result = Evaluator(self).run(term)
+        finally:
+            self.database.commit()
+        if isinstance(result, MemoryFeed):
+            return result
+        if isinstance(result, SingleSelection):
+            return copy.deepcopy(result.row)
+        if isinstance(result, Stream):
+            return MemoryCursor(copy.deepcopy(list(result)), self.database, opts.get('max_batch_rows'))
+        return copy.deepcopy(result)
+
+
+class MemoryCursor(r.net.Cursor):
+    """The result of a query that returns a sequence, this acts like the asyncio cursor RethinkDB returns
+    If max_batch_rows was given, each batch after the first counts as another query and waits for the latency again"""
+
+    def __init__(self, items, database=None, batch_size=None):
+        self.items = collections.deque(items)
+        self.database = database
+        self.batch_size = batch_size
+        # How many rows are left in the batch we've "received"
+        self._left = batch_size or len(self.items)
+
+    async def next(self, wait=True):
+        if not self.items:
+            raise r.ReqlCursorEmpty()
+        if self._left == 0:
+            self.database.queries += 1
+            if self.database.latency:
+                await asyncio.sleep(self.database.latency)
+            self._left = self.batch_size
+        self._left -= 1
+        return self.items.popleft()
+
+    async def close(self):
+        self.items.clear()
+
+
+class MemoryFeed:
+    """The result of a changes query, next waits until there's a change to return"""
+
+    def __init__(self, table, connection):
+        self.table = table
+        self.connection = connection
+        self.queue = asyncio.Queue()
+        self.closed = False
+        table.feeds.add(self)
+        connection._feeds.add(self)
+
+    def put(self, change):
+        self.queue.put_nowait(change)
+
+    async def next(self, wait=True):
+        if self.closed and self.queue.empty():
+            raise r.ReqlDriverError("Connection is closed.")
+        change = await self.queue.get()
+        if change is None:
+            raise r.ReqlDriverError("Connection is closed.")
+        return change
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.table.feeds.discard(self)
+            self.connection._feeds.discard(self)
+            self.queue.put_nowait(None)
+
+
+class Stream:
+    """A sequence of rows while a query is being evaluated, rows are only produced as they're needed
+    table is set when the rows are straight from a table, so that they can be written to
+    ordered is set to (index, start, stop) when the rows are a range of an index, for between and order_by"""
+
+    def __init__(self, rows, table=None, ordered=None, whole=False):
+        self.rows = rows
+        self.table = table
+        self.ordered = ordered
+        # Whether this is every row in the table, as is
+        self.whole = whole
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def derive(self, rows):
+        # A stream that still refers to rows of the same table, but not in any index's order anymore
+        return Stream(rows, self.table)
+
+
+class SingleSelection:
+    """A single row from a table (from get), so that it can be written to"""
+
+    def __init__(self, table, key):
+        self.table = table
+        self.key = key
+
+    @property
+    def row(self):
+        return self.table.rows.get(self.key)
+
+
+class Function:
+    """A function from the query, either a lambda or something using r.row"""
+
+    def __init__(self, evaluator, term, scope):
+        self.evaluator = evaluator
+        params, self.body = _args(term)
+        self.params = [self.evaluator.eval(param, scope) for param in _args(params)]
+        self.scope = scope
+
+    def __call__(self, *args):
+        scope = dict(self.scope)
+        scope.update(zip(self.params, args))
+        # r.row refers to the first argument of the function it's used in
+        if args:
+            scope[None] = args[0]
+        return self.evaluator.eval(self.body, scope)
+
+
+class Bound:
+    """minval and maxval, these sort before and after everything else"""
+
+    def __init__(self, name, rank):
+        self.name = name
+        self.rank = rank
+
+
+class Order:
+    """r.asc and r.desc, used in order_by"""
+
+    def __init__(self, value, descending):
+        self.value = value
+        self.descending = descending
+
+
+MINVAL = Bound('minval', 0)
+MAXVAL = Bound('maxval', 10)
+# This sorts after every sort key, used to find the end of a range of keys that are equal
+_MAX = (11,)
+
+
+def sort_key(value):
+    """Turns a value into something that sorts the same way RethinkDB sorts values
+    Arrays come first, then booleans, null, numbers, objects and strings last"""
+    if isinstance(value, Bound):
+        return (value.rank,)
+    if isinstance(value, (list, tuple)):
+        return (1, tuple(sort_key(v) for v in value))
+    if isinstance(value, bool):
+        return (2, value)
+    if value is None:
+        return (3,)
+    if isinstance(value, numbers.Number):
+        return (4, value)
+    if isinstance(value, dict):
+        return (5, tuple(sorted((k, sort_key(v)) for k, v in value.items())))
+    if isinstance(value, str):
+        return (8, value)
+    raise r.ReqlQueryLogicError("Cannot compare a value of type {}".format(type(value).__name__))
+
+
+def _args(term):
+    # Older drivers save a term's arguments as args, newer ones as _args
+    try:
+        return term._args
+    except AttributeError:
+        return term.args
+
+
+def _term_type(term):
+    if isinstance(term, r_ast.Datum):
+        return TermType.DATUM
+    term_type = getattr(term, 'term_type', None)
+    if term_type is None:
+        term_type = getattr(term, 'tt', None)
+    return term_type
+
+
+def _type_name(value):
+    if isinstance(value, (Stream, SingleSelection)):
+        return 'SELECTION'
+    if isinstance(value, bool):
+        return 'BOOL'
+    if value is None:
+        return 'NULL'
+    if isinstance(value, numbers.Number):
+        return 'NUMBER'
+    if isinstance(value, str):
+        return 'STRING'
+    if isinstance(value, list):
+        return 'ARRAY'
+    if isinstance(value, dict):
+        return 'OBJECT'
+    return type(value).__name__.upper()
+
+
+def _merge(old, new):
+    # Objects are merged into each other recursively, anything else replaces what was there
+    if not isinstance(old, dict) or not isinstance(new, dict):
+        return new
+    merged = dict(old)
+    for key, value in new.items():
+        merged[key] = _merge(old.get(key), value)
+    return merged
+
+
+def _matches(row, pattern):
+    # This is how an object used as a filter works, every field in the pattern needs to match the row's
+    if isinstance(pattern, dict):
+        if not isinstance(row, dict):
+            return False
+        return all(key in row and _matches(row[key], value) for key, value in pattern.items())
+    return row == pattern
+
+
+def _write_result(**counts):
+    result = {'inserted': 0, 'replaced': 0, 'unchanged': 0, 'deleted': 0, 'skipped': 0, 'errors': 0}
+    result.update(counts)
+    return result
+
+
+def _add_change(result, changes, old, new):
+    # For return_changes, every row that was written is included
+    if changes:
+        result.setdefault('changes', []).append({'old_val': old, 'new_val': new})
+
+
+def _add_results(total, result):
+    for key, value in result.items():
+        if isinstance(value, numbers.Number) and not isinstance(value, bool):
+            total[key] = total.get(key, 0) + value
+        elif key == 'generated_keys':
+            total.setdefault(key, []).extend(value)
+        elif key == 'first_error':
+            total.setdefault(key, value)
+    return total
+
+
+class Evaluator:
+    """Evaluates the terms of a single query"""
+
+    # The format for this is {term_type: method}, this is filled in the first time a query is evaluated
+    handlers = None
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.database = connection.database
+        if Evaluator.handlers is None:
+            # Every method named _term_<name> handles the term type with that name
+            Evaluator.handlers = {getattr(TermType, name[len('_term_'):].upper()): getattr(Evaluator, name)
+                                  for name in dir(Evaluator)
+                                  if name.startswith('_term_') and hasattr(TermType, name[len('_term_'):].upper())}
+
+    def run(self, term):
+        return self.eval(term, {})
+
+    def eval(self, term, scope):
+        if not isinstance(term, r_ast.RqlQuery):
+            return term
+        handler = self.handlers.get(_term_type(term))
+        if handler is None:
+            raise r.ReqlQueryLogicError("{} is not supported by the memory backend".format(type(term).__name__))
+        return handler(self, term, scope)
+
+    def value(self, term, scope):
+        """Evaluates a term, and turns any selection into the value(s) it holds"""
+        return self.datum(self.eval(term, scope))
+
+    def datum(self, value):
+        if isinstance(value, Stream):
+            return list(value)
+        if isinstance(value, SingleSelection):
+            return value.row
+        return value
+
+    def function(self, term, scope):
+        """Returns a callable for a term that's used as a function, a plain value is turned into a function returning it"""
+        if _term_type(term) == TermType.FUNC:
+            return Function(self, term, scope)
+        value = self.value(term, scope)
+        if isinstance(value, Function):
+            return value
+        return lambda *args: value
+
+    def stream(self, value):
+        value = self.datum(value) if not isinstance(value, Stream) else value
+        if isinstance(value, Stream):
+            return value
+        if isinstance(value, list):
+            return Stream(value)
+        raise r.ReqlQueryLogicError("Cannot convert {} to SEQUENCE".format(_type_name(value)))
+
+    # Values
+
+    def _term_datum(self, term, scope):
+        return term.data
+
+    def _term_make_array(self, term, scope):
+        return [self.value(arg, scope) for arg in _args(term)]
+
+    def _term_make_obj(self, term, scope):
+        return {key: self.value(value, scope) for key, value in term.optargs.items()}
+
+    def _term_var(self, term, scope):
+        return scope[self.eval(_args(term)[0], scope)]
+
+    def _term_implicit_var(self, term, scope):
+        try:
+            return scope[None]
+        except KeyError:
+            raise r.ReqlQueryLogicError("r.row can only be used inside of a function")
+
+    def _term_func(self, term, scope):
+        return Function(self, term, scope)
+
+    def _term_funcall(self, term, scope):
+        function, *args = _args(term)
+        return self.function(function, scope)(*[self.value(arg, scope) for arg in args])
+
+    def _term_minval(self, term, scope):
+        return MINVAL
+
+    def _term_maxval(self, term, scope):
+        return MAXVAL
+
+    def _term_asc(self, term, scope):
+        return Order(self.eval(_args(term)[0], scope), False)
+
+    def _term_desc(self, term, scope):
+        return Order(self.eval(_args(term)[0], scope), True)
+
+    def _term_branch(self, term, scope):
+        args = _args(term)
+        for i in range(0, len(args) - 1, 2):
+            if self.value(args[i], scope) not in (False, None):
+                return self.eval(args[i + 1], scope)
+        return self.eval(args[-1], scope)
+
+    def _term_default(self, term, scope):
+        value, default = _args(term)
+        try:
+            result = self.value(value, scope)
+        except r.ReqlNonExistenceError:
+            result = None
+        if result is None:
+            return self.function(default, scope)(None) if _term_type(default) == TermType.FUNC \
+                else self.value(default, scope)
+        return result
+
+    def _term_uuid(self, term, scope):
+        return str(uuid.uuid4())
+
+    # Databases and tables
+
+    def _term_db(self, term, scope):
+        return self.value(_args(term)[0], scope)
+
+    def _term_db_list(self, term, scope):
+        return sorted(self.database.dbs)
+
+    def _term_db_create(self, term, scope):
+        self.database.create_db(self.value(_args(term)[0], scope))
+        return {'dbs_created': 1}
+
+    def _term_table_list(self, term, scope):
+        return sorted(self.database.tables)
+
+    def _term_table_create(self, term, scope):
+        # There's only one database here, so which database it was created in doesn't matter
+        self.database.create_table(self.value(_args(term)[-1], scope))
+        return {'tables_created': 1}
+
+    def _term_table(self, term, scope):
+        table = self.database.table(self.value(_args(term)[-1], scope))
+        return Stream(table.rows.values(), table, whole=True)
+
+    def _term_index_list(self, term, scope):
+        table = self._table(term, scope)
+        return sorted(name for name in table.indexes if name != 'id')
+
+    def _term_index_create(self, term, scope):
+        args = _args(term)
+        table = self._table(term, scope)
+        name = self.value(args[1], scope)
+        if len(args) > 2:
+            function = self.function(args[2], scope)
+        else:
+            function = lambda row: self._get_field(row, name)
+        table.create_index(name, function)
+        return {'created': 1}
+
+    def _term_index_wait(self, term, scope):
+        table = self._table(term, scope)
+        return [{'index': name, 'ready': True} for name in table.indexes if name != 'id']
+
+    def _term_index_status(self, term, scope):
+        return self._term_index_wait(term, scope)
+
+    def _table(self, term, scope):
+        selection = self.eval(_args(term)[0], scope)
+        if not isinstance(selection, Stream) or selection.table is None:
+            raise r.ReqlQueryLogicError("Expected a table")
+        return selection.table
+
+    # Selecting rows
+
+    def _term_get(self, term, scope):
+        table = self._table(term, scope)
+        return SingleSelection(table, self.value(_args(term)[1], scope))
+
+    def _term_get_all(self, term, scope):
+        table = self._table(term, scope)
+        index = table.index(self.value(term.optargs.get('index', 'id'), scope))
+        keys = [self.value(key, scope) for key in _args(term)[1:]]
+        rows = []
+        seen = set()
+        for key in keys:
+            for row in index.get(key):
+                if row['id'] not in seen:
+                    seen.add(row['id'])
+                    rows.append(row)
+        return Stream(rows, table)
+
+    def _term_between(self, term, scope):
+        selection = self.eval(_args(term)[0], scope)
+        if not isinstance(selection, Stream) or selection.table is None:
+            raise r.ReqlQueryLogicError("between can only be used on a table")
+        lower, upper = [self.value(arg, scope) for arg in _args(term)[1:3]]
+        name = self.value(term.optargs.get('index', 'id'), scope)
+        index = selection.table.index(name)
+        start, stop = index.range(lower, upper, left_bound=self.value(term.optargs.get('left_bound', 'closed'), scope),
+                                  right_bound=self.value(term.optargs.get('right_bound', 'open'), scope))
+        return self._index_stream(selection.table, name, start, stop)
+
+    def _index_stream(self, table, name, start, stop, descending=False):
+        index = table.indexes[name]
+        positions = range(stop - 1, start - 1, -1) if descending else range(start, stop)
+
+        def rows():
+            for i in positions:
+                key, id_key = index.ordered[i]
+                yield index.buckets[key][index.ids[id_key]]
+
+        return Stream(rows(), table, ordered=(name, start, stop))
+
+    def _term_filter(self, term, scope):
+        selection = self.stream(self.eval(_args(term)[0], scope))
+        predicate = _args(term)[1]
+        default = self.value(term.optargs.get('default', False), scope)
+
+        if _term_type(predicate) == TermType.FUNC:
+            function = self.function(predicate, scope)
+
+            def check(row):
+                try:
+                    return self.datum(function(row)) not in (False, None)
+                except r.ReqlNonExistenceError:
+                    return default
+        else:
+            pattern = self.value(predicate, scope)
+
+            def check(row):
+                if isinstance(pattern, dict):
+                    return _matches(row, pattern)
+                return pattern not in (False, None)
+
+        return selection.derive(row for row in selection if check(row))
+
+    def _term_order_by(self, term, scope):
+        selection = self.stream(self.eval(_args(term)[0], scope))
+        index = term.optargs.get('index')
+        if index is not None:
+            order = self.eval(index, scope)
+            descending = isinstance(order, Order) and order.descending
+            name = order.value if isinstance(order, Order) else order
+            if selection.table is None:
+                raise r.ReqlQueryLogicError("order_by with an index can only be used on a table")
+            if selection.ordered is not None and selection.ordered[0] == name:
+                _, start, stop = selection.ordered
+            elif selection.whole:
+                start, stop = 0, len(selection.table.index(name).ordered)
+            else:
+                raise r.ReqlQueryLogicError("order_by with an index can only be used on a table or between")
+            return self._index_stream(selection.table, name, start, stop, descending)
+
+        rows = list(selection)
+        # Sort by each field in reverse, since sorting is stable this leaves them sorted by the first field first
+        for field in reversed([self.eval(arg, scope) for arg in _args(term)[1:]]):
+            descending = isinstance(field, Order) and field.descending
+            field = field.value if isinstance(field, Order) else field
+            function = field if isinstance(field, Function) else (lambda row, field=field: self._get_field(row, field))
+            rows.sort(key=lambda row: sort_key(self.datum(function(row))), reverse=descending)
+        return selection.derive(rows)
+
+    def _term_limit(self, term, scope):
+        selection = self.stream(self.eval(_args(term)[0], scope))
+        amount = self.value(_args(term)[1], scope)
+        return selection.derive(_take(iter(selection), amount))
+
+    def _term_skip(self, term, scope):
+        selection = self.stream(self.eval(_args(term)[0], scope))
+        amount = self.value(_args(term)[1], scope)
+        return selection.derive(row for i, row in enumerate(selection) if i >= amount)
+
+    def _term_nth(self, term, scope):
+        sequence = self.value(_args(term)[0], scope)
+        i = self.value(_args(term)[1], scope)
+        try:
+            return sequence[i]
+        except IndexError:
+            raise r.ReqlNonExistenceError("Index out of bounds: {}".format(i))
+
+    def _term_count(self, term, scope):
+        args = _args(term)
+        value = self.eval(args[0], scope)
+        if len(args) > 1:
+            function = self.function(args[1], scope)
+            return sum(1 for row in self.stream(value) if self.datum(function(row)) not in (False, None))
+        value = self.datum(value) if not isinstance(value, Stream) else value
+        if isinstance(value, (str, dict)):
+            return len(value)
+        return sum(1 for _ in self.stream(value))
+
+    def _term_is_empty(self, term, scope):
+        for _ in self.stream(self.eval(_args(term)[0], scope)):
+            return False
+        return True
+
+    def _term_map(self, term, scope):
+        selection = self.stream(self.eval(_args(term)[0], scope))
+        function = self.function(_args(term)[1], scope)
+        return Stream(self.datum(function(row)) for row in selection)
+
+    def _term_pluck(self, term, scope):
+        value = self.eval(_args(term)[0], scope)
+        fields = [self.value(arg, scope) for arg in _args(term)[1:]]
+
+        def pluck(row):
+            return {field: row[field] for field in fields if field in row}
+
+        if isinstance(value, Stream):
+            return Stream(pluck(row) for row in value)
+        return pluck(self.datum(value))
+
+    def _term_without(self, term, scope):
+        value = self.eval(_args(term)[0], scope)
+        fields = set(self.value(arg, scope) for arg in _args(term)[1:])
+
+        def without(row):
+            return {key: val for key, val in row.items() if key not in fields}
+
+        if isinstance(value, Stream):
+            return Stream(without(row) for row in value)
+        return without(self.datum(value))
+
+    def _term_has_fields(self, term, scope):
+        value = self.eval(_args(term)[0], scope)
+        fields = [self.value(arg, scope) for arg in _args(term)[1:]]
+
+        def has_fields(row):
+            return all(row.get(field) is not None for field in fields)
+
+        if isinstance(value, Stream):
+            return value.derive(row for row in value if has_fields(row))
+        return has_fields(self.datum(value))
+
+    def _term_bracket(self, term, scope):
+        value = self.eval(_args(term)[0], scope)
+        key = self.value(_args(term)[1], scope)
+        if isinstance(value, Stream) and isinstance(key, str):
+            return Stream(row[key] for row in value if key in row)
+        value = self.datum(value)
+        if isinstance(key, int) and not isinstance(key, bool):
+            try:
+                return value[key]
+            except (IndexError, TypeError):
+                raise r.ReqlNonExistenceError("Index out of bounds: {}".format(key))
+        return self._get_field(value, key)
+
+    def _term_get_field(self, term, scope):
+        return self._get_field(self.value(_args(term)[0], scope), self.value(_args(term)[1], scope))
+
+    def _get_field(self, value, field):
+        if value is None:
+            raise r.ReqlNonExistenceError("Cannot perform bracket on a non-object non-sequence `null`.")
+        if not isinstance(value, dict):
+            raise r.ReqlQueryLogicError("Cannot perform bracket on a non-object non-sequence.")
+        try:
+            return value[field]
+        except KeyError:
+            raise r.ReqlNonExistenceError("No attribute `{}` in object".format(field))
+
+    def _term_keys(self, term, scope):
+        return sorted(self.value(_args(term)[0], scope))
+
+    def _term_contains(self, term, scope):
+        sequence = self.value(_args(term)[0], scope)
+        values = [self.value(arg, scope) for arg in _args(term)[1:]]
+        return all(value in sequence for value in values)
+
+    def _term_coerce_to(self, term, scope):
+        value = self.value(_args(term)[0], scope)
+        to = self.value(_args(term)[1], scope).lower()
+        if to == 'string':
+            if isinstance(value, str):
+                return value
+            if isinstance(value, bool):
+                return 'true' if value else 'false'
+            if isinstance(value, float) and value.is_integer():
+                return str(int(value))
+            if value is None:
+                return 'null'
+            if isinstance(value, (list, dict)):
+                return json.dumps(value)
+            return str(value)
+        if to == 'number':
+            try:
+                return float(value) if '.' in str(value) else int(value)
+            except (TypeError, ValueError):
+                raise r.ReqlQueryLogicError("Could not coerce `{}` to NUMBER.".format(value))
+        if to == 'array':
+            return list(value.items()) if isinstance(value, dict) else list(value)
+        if to == 'object':
+            return dict(value)
+        raise r.ReqlQueryLogicError("Cannot coerce to {}".format(to))
+
+    # Operators
+
+    def _compare(self, term, scope, compare):
+        values = [sort_key(self.value(arg, scope)) for arg in _args(term)]
+        return all(compare(a, b) for a, b in zip(values, values[1:]))
+
+    def _term_eq(self, term, scope):
+        values = [self.value(arg, scope) for arg in _args(term)]
+        return all(a == b for a, b in zip(values, values[1:]))
+
+    def _term_ne(self, term, scope):
+        return not self._term_eq(term, scope)
+
+    def _term_lt(self, term, scope):
+        return self._compare(term, scope, lambda a, b: a < b)
+
+    def _term_le(self, term, scope):
+        return self._compare(term, scope, lambda a, b: a <= b)
+
+    def _term_gt(self, term, scope):
+        return self._compare(term, scope, lambda a, b: a > b)
+
+    def _term_ge(self, term, scope):
+        return self._compare(term, scope, lambda a, b: a >= b)
+
+    def _term_not(self, term, scope):
+        return self.value(_args(term)[0], scope) in (False, None)
+
+    def _term_and(self, term, scope):
+        result = True
+        for arg in _args(term):
+            result = self.value(arg, scope)
+            if result in (False, None):
+                return result
+        return result
+
+    def _term_or(self, term, scope):
+        result = False
+        for arg in _args(term):
+            result = self.value(arg, scope)
+            if result not in (False, None):
+                return result
+        return result
+
+    def _term_add(self, term, scope):
+        values = [self.value(arg, scope) for arg in _args(term)]
+        result = values[0]
+        for value in values[1:]:
+            if type(result) is not type(value) and not (isinstance(result, numbers.Number) and
+                                                        isinstance(value, numbers.Number)):
+                raise r.ReqlQueryLogicError("Cannot add {} and {}".format(_type_name(result), _type_name(value)))
+            result = result + value
+        return result
+
+    def _term_sub(self, term, scope):
+        values = [self.value(arg, scope) for arg in _args(term)]
+        result = values[0]
+        for value in values[1:]:
+            result -= value
+        return result
+
+    def _term_mul(self, term, scope):
+        values = [self.value(arg, scope) for arg in _args(term)]
+        result = values[0]
+        for value in values[1:]:
+            result *= value
+        return result
+
+    def _term_div(self, term, scope):
+        values = [self.value(arg, scope) for arg in _args(term)]
+        result = values[0]
+        for value in values[1:]:
+            result /= value
+        return result
+
+    def _term_merge(self, term, scope):
+        args = _args(term)
+        value = self.eval(args[0], scope)
+        others = [self.function(arg, scope) for arg in args[1:]]
+
+        def merge(row):
+            for other in others:
+                row = _merge(row, self.datum(other(row)))
+            return row
+
+        if isinstance(value, Stream):
+            return Stream(merge(row) for row in value)
+        return merge(self.datum(value))
+
+    def _term_append(self, term, scope):
+        return self.value(_args(term)[0], scope) + [self.value(_args(term)[1], scope)]
+
+    def _term_prepend(self, term, scope):
+        return [self.value(_args(term)[1], scope)] + self.value(_args(term)[0], scope)
+
+    def _term_delete_at(self, term, scope):
+        array = list(self.value(_args(term)[0], scope))
+        start = self.value(_args(term)[1], scope)
+        stop = self.value(_args(term)[2], scope) if len(_args(term)) > 2 else None
+        if stop is None:
+            if not -len(array) <= start < len(array):
+                raise r.ReqlNonExistenceError("Index `{}` out of bounds for array of size: `{}`.".format(
+                    start, len(array)))
+            del array[start]
+        else:
+            del array[start:stop]
+        return array
+
+    def _term_insert_at(self, term, scope):
+        array = list(self.value(_args(term)[0], scope))
+        array.insert(self.value(_args(term)[1], scope), self.value(_args(term)[2], scope))
+        return array
+
+    def _term_change_at(self, term, scope):
+        array = list(self.value(_args(term)[0], scope))
+        array[self.value(_args(term)[1], scope)] = self.value(_args(term)[2], scope)
+        return array
+
+    def _term_set_insert(self, term, scope):
+        array = list(self.value(_args(term)[0], scope))
+        value = self.value(_args(term)[1], scope)
+        result = []
+        for item in array + [value]:
+            if item not in result:
+                result.append(item)
+        return result
+
+    def _term_set_union(self, term, scope):
+        result = []
+        for item in self.value(_args(term)[0], scope) + self.value(_args(term)[1], scope):
+            if item not in result:
+                result.append(item)
+        return result
+
+    def _term_set_difference(self, term, scope):
+        remove = self.value(_args(term)[1], scope)
+        result = []
+        for item in self.value(_args(term)[0], scope):
+            if item not in remove and item not in result:
+                result.append(item)
+        return result
+
+    def _term_difference(self, term, scope):
+        remove = self.value(_args(term)[1], scope)
+        return [item for item in self.value(_args(term)[0], scope) if item not in remove]
+
+    def _term_upcase(self, term, scope):
+        return self.value(_args(term)[0], scope).upper()
+
+    def _term_downcase(self, term, scope):
+        return self.value(_args(term)[0], scope).lower()
+
+    # Writes
+
+    def _term_insert(self, term, scope):
+        table = self._table(term, scope)
+        documents = self.value(_args(term)[1], scope)
+        if isinstance(documents, dict):
+            documents = [documents]
+        conflict = term.optargs.get('conflict', 'error')
+        if _term_type(conflict) == TermType.FUNC:
+            conflict = self.function(conflict, scope)
+        else:
+            conflict = self.value(conflict, scope)
+
+        changes = self.value(term.optargs.get('return_changes', False), scope)
+        result = _write_result()
+        # Inserting a lot of rows at once (when seeding a benchmark for example) would otherwise be very slow
+        with table.bulk_write():
+            for document in documents:
+                self._insert(table, document, conflict, result, changes)
+        return result
+
+    def _insert(self, table, document, conflict, result, changes):
+        document = copy.deepcopy(document)
+        if 'id' not in document:
+            document['id'] = str(uuid.uuid4())
+            result.setdefault('generated_keys', []).append(document['id'])
+        key = document['id']
+        old = table.rows.get(key)
+        if old is None:
+            table.write(key, document)
+            result['inserted'] += 1
+            _add_change(result, changes, None, document)
+            return
+
+        if conflict == 'error':
+            result['errors'] += 1
+            result.setdefault('first_error', "Duplicate primary key `id`:\n{}\n{}".format(
+                json.dumps(old), json.dumps(document)))
+            return
+        elif conflict == 'replace':
+            new = document
+        elif conflict == 'update':
+            new = _merge(old, document)
+        else:
+            new = self.datum(conflict(key, old, document))
+
+        if new is None:
+            table.write(key, None)
+            result['deleted'] += 1
+            _add_change(result, changes, old, None)
+        elif new == old:
+            result['unchanged'] += 1
+            if changes == 'always':
+                _add_change(result, changes, old, new)
+        else:
+            table.write(key, new)
+            result['replaced'] += 1
+            _add_change(result, changes, old, new)
+
+    def _modify(self, term, scope, change):
+        # Runs change on every row in the selection, saving what it returns
+        selection = self.eval(_args(term)[0], scope)
+        if isinstance(selection, SingleSelection):
+            table, rows = selection.table, [selection.row]
+        elif isinstance(selection, Stream) and selection.table is not None:
+            # Read every row first, so that writing to the table doesn't change what we're going through
+            table, rows = selection.table, list(selection)
+        else:
+            raise r.ReqlQueryLogicError("Expected a selection, not {}".format(_type_name(self.datum(selection))))
+
+        changes = self.value(term.optargs.get('return_changes', False), scope)
+        result = _write_result()
+        for old in rows:
+            if old is None:
+                result['skipped'] += 1
+                continue
+            try:
+                new = change(old)
+            except r.ReqlError as e:
+                result['errors'] += 1
+                result.setdefault('first_error', str(e))
+                continue
+            if new is not None and new.get('id') != old['id']:
+                result['errors'] += 1
+                result.setdefault('first_error', "Primary key `id` cannot be changed.")
+            elif new is None:
+                table.write(old['id'], None)
+                result['deleted'] += 1
+                _add_change(result, changes, old, None)
+            elif new == old:
+                result['unchanged'] += 1
+                if changes == 'always':
+                    _add_change(result, changes, old, new)
+            else:
+                table.write(old['id'], new)
+                result['replaced'] += 1
+                _add_change(result, changes, old, new)
+        return result
+
+    def _term_update(self, term, scope):
+        function = self.function(_args(term)[1], scope)
+        return self._modify(term, scope, lambda row: _merge(row, self.datum(function(row))))
+
+    def _term_replace(self, term, scope):
+        function = self.function(_args(term)[1], scope)
+        return self._modify(term, scope, lambda row: self.datum(function(row)))
+
+    def _term_delete(self, term, scope):
+        return self._modify(term, scope, lambda row: None)
+
+    def _term_for_each(self, term, scope):
+        selection = self.stream(self.eval(_args(term)[0], scope))
+        function = self.function(_args(term)[1], scope)
+        result = {}
+        # Read every row first, since the function will most likely write to the same table
+        for row in list(selection):
+            writes = self.datum(function(row))
+            for write in writes if isinstance(writes, list) else [writes]:
+                _add_results(result, write)
+        return result
+
+    # Changefeeds
+
+    def _term_changes(self, term, scope):
+        selection = self.eval(_args(term)[0], scope)
+        if not isinstance(selection, Stream) or selection.table is None:
+            raise r.ReqlQueryLogicError("changes can only be used on a table in the memory backend")
+        include_initial = self.value(term.optargs.get('include_initial', False), scope)
+        include_states = self.value(term.optargs.get('include_states', False), scope)
+
+        feed = MemoryFeed(selection.table, self.connection)
+        if include_states:
+            feed.put({'state': 'initializing'})
+        if include_initial:
+            for row in selection.table.rows.values():
+                feed.put({'new_val': copy.deepcopy(row)})
+        if include_states:
+            feed.put({'state': 'ready'})
+        return feed
+
+
+def _take(iterator, amount):
+    for _ in range(amount):
+        try:
+            yield next(iterator)
+        except StopIteration:
+            return
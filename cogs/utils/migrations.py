@@ -0,0 +1,73 @@
+"""One-shot migrations, for moving data saved in an older layout into the layout used now
+
+Run these from the root folder of the bot, with the bot stopped:
+    python -m cogs.utils.migrations command_usage"""
+
+import argparse
+import asyncio
+
+import rethinkdb as r
+
+from . import config
+from .checks import db_check
+
+loop = asyncio.get_event_loop()
+
+
+async def migrate_command_usage(*, batch_size=500):
+    """Moves the member_usage and server_usage maps out of each command_usage row and into their own rows
+    in command_member_usage and command_server_usage, leaving just the command's total usage behind
+
+    Rows are read from a cursor, so the whole table is never held in memory at once
+    Each command's row is only stripped down once its usage has been saved, so this can be ran again if stopped;
+    though a command that was stopped partway through will have that part of its usage counted twice
+    Returns the amount of commands that were migrated"""
+    query = r.table('command_usage').filter(lambda row: row.has_fields('member_usage').or_(
+        row.has_fields('server_usage')))
+    migrated = 0
+
+    async with config.pool.acquire() as conn:
+        cursor = await query.run(conn)
+        while True:
+            try:
+                row = await cursor.next()
+            except r.ReqlCursorEmpty:
+                break
+            command = row['command']
+
+            member_rows = [({'command': command, 'member_id': member_id}, amount)
+                           for member_id, amount in row.get('member_usage', {}).items()]
+            server_rows = [({'command': command, 'server_id': server_id}, amount)
+                           for server_id, amount in row.get('server_usage', {}).items()]
+            for table, rows in (('command_member_usage', member_rows), ('command_server_usage', server_rows)):
+                for i in range(0, len(rows), batch_size):
+                    if not await config.increment_content(table, rows[i:i + batch_size], 'usage'):
+                        raise RuntimeError("Could not save the usage of {} in {}".format(command, table))
+
+            await config.replace_content('command_usage', r.row.without('member_usage', 'server_usage'),
+                                         {'command': command})
+            migrated += 1
+            print("Migrated {}".format(command))
+    return migrated
+
+
+# The migrations that can be ran, by the name used to run them
+migrations = {'command_usage': migrate_command_usage}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('migration', choices=sorted(migrations))
+    args = parser.parse_args()
+
+    # Make sure the tables and indexes being migrated to exist first
+    loop.run_until_complete(db_check())
+    try:
+        result = loop.run_until_complete(migrations[args.migration]())
+    finally:
+        loop.run_until_complete(config.pool.close())
+    print("Done! Migrated {} rows".format(result))
+
+
+if __name__ == '__main__':
+    main()
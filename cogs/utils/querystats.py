@@ -0,0 +1,191 @@
+import asyncio
+import bisect
+import collections
+import functools
+import inspect
+import logging
+import reprlib
+import time
+import weakref
+
+import pendulum
+
+log = logging.getLogger()
+
+try:
+    _current_task = asyncio.current_task
+except AttributeError:
+    _current_task = asyncio.Task.current_task
+
+# The upper bound (in milliseconds) of each latency bucket, anything slower than the last goes in one more bucket
+buckets = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+# The arguments shown in the slow query log, these are the ones that say which rows were being looked for
+_filter_args = ('r_filter', 'key', 'keys', 'between')
+
+
+class TableStats:
+    """Everything recorded for one (table, operation)"""
+
+    __slots__ = ('count', 'errors', 'rows', 'total', 'histogram', 'callers')
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.rows = 0
+        # The total time (in seconds) spent on this
+        self.total = 0.0
+        self.histogram = [0] * (len(buckets) + 1)
+        # The format for this is {(cog, command): count}
+        self.callers = collections.Counter()
+
+    def record(self, elapsed, rows, error, caller):
+        self.count += 1
+        self.total += elapsed
+        self.rows += rows
+        if error:
+            self.errors += 1
+        self.histogram[bisect.bisect_left(buckets, elapsed * 1000)] += 1
+        self.callers[caller] += 1
+
+    @property
+    def average(self):
+        """The average time taken, in milliseconds"""
+        return self.total * 1000 / self.count if self.count else 0
+
+    def percentile(self, percent):
+        """Roughly the time (in milliseconds) that this percent of queries finished in, based on the histogram
+        This is the upper bound of the bucket the percentile falls in, so it's never lower than the real value"""
+        needed = self.count * percent / 100
+        seen = 0
+        for bound, amount in zip(buckets, self.histogram):
+            seen += amount
+            if seen >= needed:
+                return bound
+        return float('inf')
+
+
+class QueryStats:
+    """Records how long each database helper takes, per table and per operation, along with who called it
+    Recording a query is just a few counters being added to, so this can be left on all the time
+
+    Who called it is the cog and command being ran, as tagged by tag; anything that isn't a command
+    (like a cog's background loop) uses the name of the task it's ran in instead
+
+    Paramaters:
+        slow_threshold -> Queries that take longer than this (in milliseconds) are kept in the slow query log, 0 to not keep any
+        slow_log_size -> The most slow queries that are kept, the oldest are dropped after this"""
+
+    def __init__(self, *, slow_threshold=250, slow_log_size=100):
+        self.slow_threshold = slow_threshold
+        # The format for this is {(table, op): TableStats}
+        self.tables = {}
+        self.slow = collections.deque(maxlen=slow_log_size)
+        self.started = pendulum.utcnow()
+        # The format for this is {task: (cog, command)}, tasks are dropped from here once they're done
+        self._tags = weakref.WeakKeyDictionary()
+
+    def tag(self, cog, command):
+        """Marks every query made from the current task as coming from this cog and command"""
+        task = _task()
+        if task is not None:
+            self._tags[task] = (cog, command)
+
+    def caller(self):
+        """Returns the (cog, command) the current task is running"""
+        task = _task()
+        if task is None:
+            return None, None
+        try:
+            return self._tags[task]
+        except KeyError:
+            pass
+        # Background loops look like Cog.loop_name, so use that if we weren't told anything
+        name = getattr(getattr(task, '_coro', None), '__qualname__', None) or '?'
+        if '.' in name:
+            cog, _, name = name.rpartition('.')
+            return cog, name
+        return None, name
+
+    def record(self, table, op, elapsed, *, rows=0, error=False, caller=None, details=None):
+        """Records one call of op on table, that took elapsed seconds
+        details is a function returning the filter used, it's only called if the query was slow
+        so that building it doesn't slow down every other query"""
+        if caller is None:
+            caller = self.caller()
+        try:
+            stats = self.tables[(table, op)]
+        except KeyError:
+            stats = self.tables[(table, op)] = TableStats()
+        stats.record(elapsed, rows, error, caller)
+
+        ms = elapsed * 1000
+        if self.slow_threshold and ms >= self.slow_threshold:
+            # Some filters can be huge (like looking up every member of a server), so don't hold onto all of it
+            details = reprlib.repr(details() if details is not None else {})
+            self.slow.append({'time': pendulum.utcnow(), 'table': table, 'op': op, 'ms': ms, 'cog': caller[0],
+                              'command': caller[1], 'details': details, 'error': error})
+            log.warning("Slow query: {} on {} took {:.0f}ms, from {}.{} with {}".format(
+                op, table, ms, caller[0], caller[1], details))
+
+    def instrument(self, func):
+        """Used as a decorator on a database helper that takes the table as it's first argument
+        Every call is recorded with the helper's name as the operation"""
+        op = func.__name__
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        async def wrapper(table, *args, **kwargs):
+            caller = self.caller()
+            error = False
+            result = None
+            start = time.perf_counter()
+            try:
+                result = await func(table, *args, **kwargs)
+                return result
+            except:
+                error = True
+                raise
+            finally:
+                self.record(table, op, time.perf_counter() - start, rows=_rows(result), error=error, caller=caller,
+                            details=lambda: _filters(signature, table, args, kwargs))
+
+        return wrapper
+
+    def top(self, amount=10, *, key='total'):
+        """Returns the [((table, op), TableStats)] that have taken the most time overall (or by another attribute)"""
+        return sorted(self.tables.items(), key=lambda x: getattr(x[1], key), reverse=True)[:amount]
+
+    def reset(self):
+        self.tables = {}
+        self.slow.clear()
+        self.started = pendulum.utcnow()
+
+
+def format_percentile(ms):
+    """Formats a percentile from TableStats.percentile, which is the bucket it falls under"""
+    # Anything slower than the last bucket can't be narrowed down any further
+    if ms == float('inf'):
+        return ">{}ms".format(buckets[-1])
+    return "≤{}ms".format(ms)
+
+
+def _task():
+    try:
+        return _current_task()
+    except RuntimeError:
+        # Not being ran in the event loop at all
+        return None
+
+
+def _rows(result):
+    # Reads return a list of rows, writes just return whether they worked; so those don't count
+    return len(result) if isinstance(result, list) else 0
+
+
+def _filters(signature, table, args, kwargs):
+    try:
+        arguments = signature.bind(table, *args, **kwargs).arguments
+    except TypeError:
+        return {}
+    return {name: arguments[name] for name in _filter_args if name in arguments}
@@ -0,0 +1,96 @@
+import asyncio
+
+import rethinkdb as r
+
+from . import config
+
+loop = asyncio.get_event_loop()
+
+
+class Rankings:
+    """Answers leaderboard questions about a table of ratings, without ever needing to read the whole table
+    Global rankings use an index on the rating; server rankings only look up the members in that server who are rated
+
+    Paramaters:
+        table -> The table that holds the ratings, one row per member
+        index -> The name of the index on the rating field
+        refresh -> How often (in seconds) we reload the IDs of everyone that is rated"""
+
+    def __init__(self, table, *, index='rating', refresh=600):
+        self.table = table
+        self.index = index
+        self.refresh = refresh
+        # The IDs of every member that has a rating, so finding who is rated in a server doesn't need a query
+        # This is only used for server rankings, to narrow a server's members down before looking them up
+        self._rated = None
+        self._loaded = 0
+        self._lock = asyncio.Lock()
+
+    async def top(self, amount=10):
+        """Returns the highest rated rows, highest first"""
+        query = r.table(self.table).order_by(index=r.desc(self.index)).limit(amount)
+        try:
+            return await config.pool.run(query)
+        except r.ReqlOpFailedError:
+            return []
+
+    async def get(self, member_id):
+        """Returns the row for this member, or None if they don't have a rating yet"""
+        content = await config.get_content_by_index(self.table, 'member_id', member_id)
+        return content[0] if content else None
+
+    async def total(self):
+        """Returns how many members have a rating
+        Only rows with a rating are in the index, so this is counted on the database's side from the index alone"""
+        query = r.table(self.table).between(r.minval, r.maxval, index=self.index).count()
+        try:
+            return await config.pool.run(query)
+        except r.ReqlOpFailedError:
+            return 0
+
+    async def rank(self, rating):
+        """Returns the global rank of this rating, based on how many are rated higher than it"""
+        query = r.table(self.table).between(rating, r.maxval, index=self.index, left_bound='open').count()
+        try:
+            return await config.pool.run(query) + 1
+        except r.ReqlOpFailedError:
+            return 1
+
+    async def server_ratings(self, member_ids):
+        """Returns the rows for everyone in member_ids that has a rating, highest first"""
+        ids = list(await self.rated_members() & set(member_ids))
+        if not ids:
+            return []
+        content = await config.get_content_by_index(self.table, 'member_id', *ids) or []
+        return sorted(content, key=lambda x: x[self.index], reverse=True)
+
+    async def server_rank(self, rating, member_ids):
+        """Returns the rank of this rating amongst member_ids, as well as how many of them have a rating"""
+        server_ratings = await self.server_ratings(member_ids)
+        above = sum(1 for row in server_ratings if row[self.index] > rating)
+        return above + 1, len(server_ratings)
+
+    async def rated_members(self):
+        """Returns the set of IDs of everyone who has a rating"""
+        if self._rated is None or loop.time() - self._loaded > self.refresh:
+            async with self._lock:
+                # Someone else might have loaded this while we were waiting
+                if self._rated is None or loop.time() - self._loaded > self.refresh:
+                    await self._load()
+        return self._rated
+
+    def add(self, member_id):
+        """Marks this member as rated, this should be called whenever a new rating is saved"""
+        if self._rated is not None:
+            self._rated.add(member_id)
+
+    async def _load(self):
+        rated = set()
+        async for row in config.iter_content(self.table, pluck=['member_id']):
+            if 'member_id' in row:
+                rated.add(row['member_id'])
+        self._rated = rated
+        self._loaded = loop.time()
+
+
+battle_rankings = Rankings('battle_records')
@@ -0,0 +1,175 @@
+import asyncio
+import heapq
+import itertools
+
+from . import config
+
+loop = asyncio.get_event_loop()
+
+# The priorities requests can be made with, lower goes first
+# Commands someone is waiting on are interactive, anything ran periodically in the background (like the stream checks)
+INTERACTIVE = 0
+BACKGROUND = 1
+
+
+class TokenBucket:
+    """Allows up to burst requests at once, refilling at rate requests a second after that"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = self.burst
+        self.updated = loop.time()
+
+    def refill(self):
+        now = loop.time()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, reserve=0):
+        """Takes a token if there's one available (past the reserve), returns whether one was taken"""
+        self.refill()
+        if self.tokens - reserve >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait_time(self, reserve=0):
+        """Returns how long (in seconds) until a token will be available past the reserve"""
+        self.refill()
+        return max((1 + reserve - self.tokens) / self.rate, 0)
+
+
+class HostStats:
+    """What's been recorded for the requests to one host"""
+
+    __slots__ = ('requests', 'waited', 'wait_total', 'max_wait', 'max_depth', 'by_priority')
+
+    def __init__(self):
+        self.requests = 0
+        # How many requests had to wait at all, and how long (in seconds) they waited in total
+        self.waited = 0
+        self.wait_total = 0.0
+        self.max_wait = 0.0
+        self.max_depth = 0
+        # The format for this is {priority: [requests, seconds waited]}
+        self.by_priority = {}
+
+    def record(self, priority, waited):
+        self.requests += 1
+        if waited > 0:
+            self.waited += 1
+            self.wait_total += waited
+            self.max_wait = max(self.max_wait, waited)
+        counts = self.by_priority.setdefault(priority, [0, 0.0])
+        counts[0] += 1
+        counts[1] += waited
+
+
+class RateLimiter:
+    """Makes sure we don't send requests to a host faster than it allows, using a token bucket per host
+    Requests past the limit are queued up and sent as soon as they can be, with interactive requests ahead of
+    background ones. A share of each host's tokens is also kept for interactive requests only, so that
+    background loops can use what's left over without making commands wait behind them
+
+    Paramaters:
+        limits -> A dictionary of {host: (requests, seconds)}, hosts not included aren't limited
+        reserve -> The share (from 0 to 1) of each bucket that background requests can't use"""
+
+    def __init__(self, limits, *, reserve=0.2):
+        self.reserve = reserve
+        # The format for this is {host: TokenBucket}
+        self._buckets = {host: TokenBucket(requests / seconds, requests) for host, (requests, seconds) in
+                         limits.items()}
+        # The format for this is {host: [(priority, order, future)]}, as a heap
+        self._queues = {}
+        # The tasks handing out tokens to the queue for each host, and what's used to wake them up early
+        self._drainers = {}
+        self._wakeups = {}
+        self._order = itertools.count()
+        # The format for this is {host: HostStats}
+        self.hosts = {}
+
+    def limited(self, host):
+        return host in self._buckets
+
+    async def acquire(self, host, priority=INTERACTIVE):
+        """Waits until a request can be sent to this host"""
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            return
+        stats = self.hosts.setdefault(host, HostStats())
+        queue = self._queues.setdefault(host, [])
+        # Only skip the queue if no one is already waiting in it
+        if not queue and bucket.take(self._reserve(bucket, priority)):
+            stats.record(priority, 0)
+            return
+
+        future = loop.create_future()
+        entry = (priority, next(self._order), future)
+        heapq.heappush(queue, entry)
+        stats.max_depth = max(stats.max_depth, len(queue))
+        start = loop.time()
+        if host not in self._drainers:
+            self._wakeups[host] = asyncio.Event()
+            self._drainers[host] = loop.create_task(self._drain(host))
+        elif queue[0] is entry:
+            # We've been put ahead of whoever the queue was waiting on, so it might be able to go sooner
+            self._wakeups[host].set()
+        try:
+            await future
+        except asyncio.CancelledError:
+            # The queue skips over anything that's been cancelled
+            future.cancel()
+            raise
+        stats.record(priority, loop.time() - start)
+
+    def _reserve(self, bucket, priority):
+        if priority == INTERACTIVE:
+            return 0
+        # Always leave background requests at least one token, or they'd never be sent to hosts with a small burst
+        return min(bucket.burst * self.reserve, bucket.burst - 1)
+
+    async def _drain(self, host):
+        bucket = self._buckets[host]
+        queue = self._queues[host]
+        wakeup = self._wakeups[host]
+        try:
+            while queue:
+                priority, _, future = queue[0]
+                if future.done():
+                    heapq.heappop(queue)
+                    continue
+                reserve = self._reserve(bucket, priority)
+                if bucket.take(reserve):
+                    heapq.heappop(queue)
+                    future.set_result(None)
+                    continue
+                wakeup.clear()
+                try:
+                    await asyncio.wait_for(wakeup.wait(), bucket.wait_time(reserve))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._drainers.pop(host, None)
+
+    def stats(self):
+        """Returns a dictionary of {host: stats} for every host that has been limited"""
+        result = {}
+        for host, stats in self.hosts.items():
+            bucket = self._buckets[host]
+            bucket.refill()
+            result[host] = {'queued': sum(1 for _, _, f in self._queues.get(host, []) if not f.done()),
+                            'max_queued': stats.max_depth,
+                            'tokens': bucket.tokens,
+                            'burst': bucket.burst,
+                            'requests': stats.requests,
+                            'waited': stats.waited,
+                            'average_wait': stats.wait_total / stats.waited if stats.waited else 0,
+                            'max_wait': stats.max_wait,
+                            'by_priority': {priority: counts[1] / counts[0] if counts[0] else 0
+                                            for priority, counts in stats.by_priority.items()}}
+        return result
+
+
+rate_limiter = RateLimiter(config.http_rate_limits or {}, reserve=config.http_rate_reserve)
@@ -0,0 +1,99 @@
+import collections
+import json
+import logging
+import re
+from urllib.parse import urlparse
+
+import pendulum
+
+from . import config
+from .querystats import TableStats
+
+log = logging.getLogger()
+
+# Parts of a path with a number in them are almost always an ID, so they're grouped together
+_id_segment = re.compile(r'[^/]*\d[^/]*')
+
+
+class EndpointStats(TableStats):
+    """Everything recorded for one (host, endpoint)
+    rows is used for the bytes received, and callers for the (cog, command) that made the request"""
+
+    __slots__ = ('statuses', 'retries', 'cache')
+
+    def __init__(self):
+        super().__init__()
+        # The format for this is {status: count}, None is used for requests that never got a response
+        self.statuses = collections.Counter()
+        self.retries = 0
+        # The format for this is {'hit'/'stale'/'miss'/'revalidated': count}
+        self.cache = collections.Counter()
+
+    @property
+    def bytes(self):
+        return self.rows
+
+
+class RequestStats:
+    """Records every request made to another site, per host and endpoint, along with who made it
+    Like the query stats, this is only a few counters being added to, so this can be left on all the time
+
+    Paramaters:
+        slow_threshold -> Requests that take longer than this (in milliseconds) are logged, and kept to be looked at, 0 to not log any
+        slow_log_size -> The most slow requests that are kept, the oldest are dropped after this"""
+
+    def __init__(self, *, slow_threshold=2000, slow_log_size=100):
+        self.slow_threshold = slow_threshold
+        # The format for this is {(host, endpoint): EndpointStats}
+        self.endpoints = {}
+        self.slow = collections.deque(maxlen=slow_log_size)
+        self.started = pendulum.utcnow()
+
+    def record(self, url, elapsed, *, endpoint=None, status=None, size=0, retries=0, cache=None, error=None,
+               caller=(None, None)):
+        """Records one request to url that took elapsed seconds
+        endpoint is what requests to this url are grouped under, if it's not given it's worked out from the url
+        If error isn't given, anything that didn't get a response (or got an error status) is counted as an error"""
+        host, endpoint = endpoint_for(url, endpoint)
+        try:
+            stats = self.endpoints[(host, endpoint)]
+        except KeyError:
+            stats = self.endpoints[(host, endpoint)] = EndpointStats()
+        if error is None:
+            error = status is None or status >= 400
+        stats.record(elapsed, size, error, caller)
+        stats.statuses[status] += 1
+        stats.retries += retries
+        if cache is not None:
+            stats.cache[cache] += 1
+
+        ms = elapsed * 1000
+        if self.slow_threshold and ms >= self.slow_threshold:
+            entry = {'time': pendulum.utcnow(), 'host': host, 'endpoint': endpoint, 'ms': ms, 'status': status,
+                     'bytes': size, 'retries': retries, 'cache': cache, 'cog': caller[0], 'command': caller[1]}
+            self.slow.append(entry)
+            # This is written as JSON so that it's easy to pick out of the log
+            log.warning("Slow request: {}".format(json.dumps(dict(entry, time=str(entry['time']), ms=round(ms)))))
+
+    def top(self, amount=10, *, key='total'):
+        """Returns the [((host, endpoint), EndpointStats)] that have taken the most time overall
+        (or by another attribute)"""
+        return sorted(self.endpoints.items(), key=lambda x: getattr(x[1], key), reverse=True)[:amount]
+
+    def reset(self):
+        self.endpoints = {}
+        self.slow.clear()
+        self.started = pendulum.utcnow()
+
+
+def endpoint_for(url, endpoint=None):
+    """Returns the (host, endpoint) that a request to url is grouped under"""
+    parsed = urlparse(url)
+    host = parsed.hostname or ''
+    if endpoint is None:
+        endpoint = _id_segment.sub('{id}', parsed.path) or '/'
+    return host, endpoint
+
+
+request_stats = RequestStats(slow_threshold=config.http_slow_request_ms,
+                             slow_log_size=config.http_slow_request_log_size)
@@ -0,0 +1,119 @@
+import asyncio
+import email.utils
+import random
+import time
+
+import aiohttp
+
+from . import config
+
+
+class RetryPolicy:
+    """Decides which failed requests are worth trying again, and how long to wait before doing so
+    The wait doubles with every attempt, and a random amount of it is used (full jitter)
+    so that everyone who failed at the same time doesn't try again at the same time as well
+
+    Paramaters:
+        attempts -> The most times a request is made, including the first
+        backoff -> The most (in seconds) that's waited before the first retry
+        max_backoff -> The most (in seconds) that's ever waited between two attempts
+        deadline -> How long (in seconds) we can keep trying for in total, a retry that would go past this isn't made
+        retry_statuses -> The response statuses that are worth trying again, anything else is given up on right away"""
+
+    # Errors that mean the request didn't make it, or the response couldn't be read
+    # A response that doesn't decode (a ValueError) isn't here, it'd be the same the next time we asked
+    exceptions = (aiohttp.ClientError, asyncio.TimeoutError)
+
+    def __init__(self, *, attempts=3, backoff=0.5, max_backoff=10, deadline=20,
+                 retry_statuses=(408, 429, 500, 502, 503, 504)):
+        self.attempts = max(attempts, 1)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.deadline = deadline
+        self.retry_statuses = frozenset(retry_statuses)
+
+    def should_retry(self, status):
+        return status in self.retry_statuses
+
+    def delay(self, attempt, retry_after=None):
+        """Returns how long to wait after this (0 based) attempt failed
+        If the response told us how long to wait with Retry-After, that's used instead
+        None is returned if that's longer than max_backoff, since trying again any sooner would just be turned away"""
+        wait = _parse_retry_after(retry_after)
+        if wait is not None:
+            return wait if wait <= self.max_backoff else None
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+
+def _parse_retry_after(value):
+    # Retry-After can be either the amount of seconds to wait, or the date to wait until
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    return max(date.timestamp() - time.time(), 0)
+
+
+class CircuitBreaker:
+    """Keeps track of which hosts keep failing, so that we stop sending them requests for a while
+    Once a host fails enough times in a row it's circuit opens, and requests to it fail right away
+    After reset_timeout one request is let through to test it, if that works everything is let through again
+
+    Paramaters:
+        threshold -> How many failures in a row open the circuit for a host
+        reset_timeout -> How long (in seconds) the circuit stays open before a request is let through to test it"""
+
+    def __init__(self, *, threshold=5, reset_timeout=30):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        # The format for this is {host: failures in a row}
+        self._failures = {}
+        # The format for this is {host: time it was opened}
+        self._opened = {}
+        # The format for this is {host: time the test request was started}
+        # If a test request never finishes (like if it was cancelled) another is let through after reset_timeout
+        self._testing = {}
+
+        self.rejected = 0
+
+    def allow(self, host):
+        """Returns whether a request to this host can be made right now"""
+        opened = self._opened.get(host)
+        if opened is None:
+            return True
+        now = time.monotonic()
+        testing = self._testing.get(host)
+        if now - opened >= self.reset_timeout and (testing is None or now - testing >= self.reset_timeout):
+            self._testing[host] = now
+            return True
+        self.rejected += 1
+        return False
+
+    def success(self, host):
+        self._failures.pop(host, None)
+        self._opened.pop(host, None)
+        self._testing.pop(host, None)
+
+    def failure(self, host):
+        failures = self._failures.get(host, 0) + 1
+        self._failures[host] = failures
+        # A failed test request opens the circuit again for another reset_timeout
+        if failures >= self.threshold or host in self._testing:
+            self._opened[host] = time.monotonic()
+        self._testing.pop(host, None)
+
+    def open_hosts(self):
+        """Returns a list of the hosts whose circuit is open right now"""
+        return sorted(self._opened)
+
+
+# Used for every request that doesn't provide it's own policy
+default_retry = RetryPolicy(attempts=config.http_retry_attempts, backoff=config.http_retry_backoff,
+                            max_backoff=config.http_retry_max_backoff, deadline=config.http_retry_deadline)
+circuit_breaker = CircuitBreaker(threshold=config.http_circuit_threshold, reset_timeout=config.http_circuit_reset)
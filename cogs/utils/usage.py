@@ -0,0 +1,146 @@
+import asyncio
+import collections
+import logging
+
+import rethinkdb as r
+
+from . import config
+
+loop = asyncio.get_event_loop()
+log = logging.getLogger()
+
+
+class UsageBuffer:
+    """Holds command usage in memory, and writes it to the database in batches
+    Every command used only adds one to a counter here; each flush then sends one
+    query per table, no matter how many commands were used since the last flush
+
+    Usage that we know wasn't saved is tried again on the next flush. If a write times out, or the connection drops,
+    we can't know what was saved, so that usage is dropped (and logged) instead of risking counting it twice
+
+    Paramaters:
+        interval -> How often (in seconds) the pending usage is written
+        max_pending -> How many different (command, server, member) counters we hold before flushing early"""
+
+    def __init__(self, *, interval=30, max_pending=1000):
+        self.interval = interval
+        self.max_pending = max_pending
+        # The format for this is {(command, server_id, member_id): amount}
+        self.pending = collections.Counter()
+        # Usage that definitely wasn't saved, in the format {table: {key: amount}}, this is tried again next flush
+        self._failed = {table: collections.Counter() for table in usage_fields}
+        self._task = None
+        self._lock = asyncio.Lock()
+
+    def start(self):
+        """Starts flushing on our interval, this is safe to call more than once"""
+        if self._task is None:
+            self._task = loop.create_task(self._flush_task())
+
+    def add(self, command, server_id, member_id):
+        """Adds one usage of the command, server_id should be None for private messages"""
+        self.pending[(command, server_id, member_id)] += 1
+        if len(self.pending) >= self.max_pending and not self._lock.locked():
+            loop.create_task(self.flush())
+
+    def pending_usage(self, command, server_id=None, member_id=None):
+        """Returns the usage of a command that hasn't been saved yet, in the format (total, server, member)"""
+        total = server_usage = member_usage = 0
+        for (cmd, s_id, m_id), amount in self.pending.items():
+            if cmd != command:
+                continue
+            total += amount
+            if server_id is not None and s_id == server_id:
+                server_usage += amount
+            if member_id is not None and m_id == member_id:
+                member_usage += amount
+        total += self._failed['command_usage'][(command,)]
+        server_usage += self._failed['command_server_usage'][(command, server_id)]
+        member_usage += self._failed['command_member_usage'][(command, member_id)]
+        return total, server_usage, member_usage
+
+    async def flush(self):
+        """Writes all pending usage to the database"""
+        async with self._lock:
+            # Split the usage up into each table's rows; anything that failed last time is included again
+            tables, self._failed = self._failed, {table: collections.Counter() for table in usage_fields}
+            pending, self.pending = self.pending, collections.Counter()
+            for (command, server_id, member_id), amount in pending.items():
+                tables['command_usage'][(command,)] += amount
+                tables['command_member_usage'][(command, member_id)] += amount
+                if server_id is not None:
+                    tables['command_server_usage'][(command, server_id)] += amount
+
+            tables = {table: counter for table, counter in tables.items() if counter}
+            if not tables:
+                return
+            results = await asyncio.gather(*[self._increment(table, counter) for table, counter in tables.items()],
+                                           return_exceptions=True)
+
+            for (table, counter), result in zip(tables.items(), results):
+                if isinstance(result, Exception):
+                    # Some, all, or none of this might have been saved; sending it again could count it twice
+                    log.warning("Couldn't tell if {} usage counts were saved to {}, they won't be tried again: {}"
+                                .format(len(counter), table, result))
+                    continue
+                # Hold onto the usage that wasn't saved, so it's tried again next time instead of being lost
+                for key in result:
+                    self._failed[table][key] += counter[key]
+
+    async def _increment(self, table, counter):
+        """Returns the keys (in the same format as counter) of the usage that wasn't saved"""
+        fields = usage_fields[table]
+        rows = [(dict(zip(fields, key)), amount) for key, amount in counter.items()]
+        unsaved = await config.increment_content(table, rows, usage_field[table], return_unsaved=True)
+        return [tuple(key[field] for field in fields) for key in unsaved]
+
+    async def _flush_task(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except (r.ReqlError, asyncio.TimeoutError):
+                pass
+
+
+# The fields that make up the key of each usage table, and the field that holds the usage in each
+usage_fields = {'command_usage': ('command',),
+                'command_server_usage': ('command', 'server_id'),
+                'command_member_usage': ('command', 'member_id')}
+usage_field = {'command_usage': 'total_usage',
+               'command_server_usage': 'usage',
+               'command_member_usage': 'usage'}
+
+
+async def get_command_usage(command, server_id=None, member_id=None):
+    """Returns the saved usage of a command, in the format (total, server, member)
+    Each of these is a single lookup by the row's ID, so this never reads more than three rows"""
+    keys = {'command_usage': {'command': command},
+            'command_server_usage': {'command': command, 'server_id': server_id},
+            'command_member_usage': {'command': command, 'member_id': member_id}}
+    queries = [r.table(table).get(config.primary_key(table, key))[usage_field[table]].default(0)
+               for table, key in keys.items()]
+    try:
+        total, server_usage, member_usage = await config.pool.run(r.expr(queries))
+    except r.ReqlOpFailedError:
+        return 0, 0, 0
+    return total, server_usage, member_usage
+
+
+async def get_top_commands(*, server_id=None, member_id=None, limit=5):
+    """Returns the most used commands on a server, or by a member, in the format [(command, usage)]
+    The compound index on (server/member, usage) means only the rows returned are ever read"""
+    if server_id is not None:
+        table, index, key = 'command_server_usage', 'server_usage', server_id
+    else:
+        table, index, key = 'command_member_usage', 'member_usage', member_id
+    query = r.table(table).between([key, r.minval], [key, r.maxval], index=index)
+    query = query.order_by(index=r.desc(index)).limit(limit).pluck('command', 'usage')
+    try:
+        content = await config.pool.run(query)
+    except r.ReqlOpFailedError:
+        return []
+    return [(row['command'], row['usage']) for row in content if row['usage'] > 0]
+
+
+usage_buffer = UsageBuffer(interval=config.usage_interval, max_pending=config.usage_max_pending)
@@ -1,8 +1,16 @@
-import aiohttp
 from io import BytesIO
+from urllib.parse import urlparse
+import asyncio
 import inspect
+import time
 
 from . import config
+from .httpcache import response_cache
+from .ranking import battle_rankings
+from .ratelimit import rate_limiter, INTERACTIVE, BACKGROUND
+from .requeststats import request_stats
+from .retry import default_retry, circuit_breaker
+from .web import http_session, single_flight, download
 from PIL import Image
 
 def convert_to_jpeg(pfile):
@@ -64,59 +72,170 @@ def find_command(bot, command):
 
     return cmd
 
+def stats_message(lines, limit=1900):
+    """Puts as many of the lines as will fit under discord's limit for a single message into a code block"""
+    output = ""
+    for line in lines:
+        if len(output) + len(line) > limit:
+            break
+        output += line + "\n"
+    return "```\n{}```".format(output)
+
 async def download_image(url):
-    """Returns a file-like object based on the URL provided"""
-    headers = {'User-Agent': config.user_agent}
-    # Simply read the image, to get the bytes
-    bts = await request(url, attr='read')
-    if bts is None:
-        return None
-
-    # Then wrap it in a BytesIO object, to be used like an actual file
-    image = BytesIO(bts)
-    return image
-
-async def request(url, *, headers=None, payload=None, method='GET', attr='json'):
+    """Returns a file-like object based on the URL provided
+    None is returned if it isn't an image, or is bigger than download_max_size"""
+    # This is read a chunk at a time, so a link to something huge doesn't get read into memory
+    # It's read into a BytesIO (images are capped by download_max_size anyway), as this is what gets uploaded
+    # and the temporary file download would use otherwise isn't something discord can upload on older versions
+    return await download(url, content_types=['image/'], into=BytesIO())
+
+async def request(url, *, headers=None, payload=None, method='GET', attr='json', retry=None, priority=INTERACTIVE,
+                  endpoint=None):
+    """Makes a request, and returns the attribute (or the result of calling the method) attr of the response
+    Failed requests are retried based on the retry policy given, or the default policy if one isn't given
+    Sites in http_rate_limits are only sent as many requests as they allow, priority decides who goes first
+    None is returned if the request couldn't be made, or the response wasn't successful
+
+    Requests to the endpoints setup in http_cache_ttl are answered from the response cache when they can be
+    and if the same GET request is already being made, that one's response is used instead of making another
+
+    Every request is recorded in the request stats, grouped by endpoint. Provide endpoint if the url has something
+    in it's path that changes between requests (like a username), otherwise parts with a number in them are grouped"""
     # Make sure our User Agent is what's set, and ensure it's sent even if no headers are passed
     if headers == None:
         headers = {}
     headers['User-Agent'] = config.user_agent
+    # Work out who's making this now, since the request itself might be made in another task
+    stats = {'endpoint': endpoint, 'caller': config.query_stats.caller()}
+    start = time.perf_counter()
 
-    # Try 5 times
-    for i in range(5):
-        try:
-            # Create the session with our headeres
-            with aiohttp.ClientSession(headers=headers) as session:
+    key = response_cache.key(method, url, payload, attr)
+    if key is None:
+        return await _single_flight(url, headers, payload, method, attr, retry, priority, stats=stats)
+
+    entry = await response_cache.get(key)
+    if entry is not None:
+        if entry.fresh:
+            request_stats.record(url, time.perf_counter() - start, status=200, size=entry.size, cache='hit', **stats)
+            return response_cache.value(entry)
+        # It's expired, but still recent enough to use while we get it again in the background
+        if entry.usable:
+            refresh = _fetch(url, dict(headers), payload, method, attr, retry, BACKGROUND, key, entry, stats=stats)
+            response_cache.refresh(key, refresh)
+            request_stats.record(url, time.perf_counter() - start, status=200, size=entry.size, cache='stale', **stats)
+            return response_cache.value(entry)
+    return await _single_flight(url, headers, payload, method, attr, retry, priority, key, entry, stats=stats)
+
+
+async def _single_flight(url, headers, payload, method, attr, retry, priority, cache_key=None, cached=None, *, stats):
+    # Only requests that don't change anything are safe to share
+    coro = _fetch(url, headers, payload, method, attr, retry, priority, cache_key, cached, stats=stats)
+    if method != 'GET':
+        return await coro
+    try:
+        params = tuple(sorted((str(k), str(v)) for k, v in (payload or {}).items()))
+    except AttributeError:
+        return await coro
+    key = (url, params, attr, tuple(sorted(headers.items())))
+    return await single_flight.run(key, coro)
+
+
+async def _fetch(url, headers, payload, method, attr, retry, priority, cache_key=None, cached=None, *, stats):
+    """Does the actual requesting for request, saving the result in the response cache if cache_key is given
+    If what we have cached is given, the site is asked to only send the response if it's changed since then
+    stats is the endpoint and caller this is recorded under in the request stats"""
+    policy = retry or default_retry
+    host = urlparse(url).hostname
+    deadline = time.monotonic() + policy.deadline
+    if cached is not None:
+        headers = dict(headers, **cached.validators())
+    cache = None if cache_key is None else 'miss'
+    status = None
+    size = 0
+    attempt = 0
+    # This is only set once we have something to give back
+    succeeded = False
+    start = time.perf_counter()
+
+    try:
+        for attempt in range(policy.attempts):
+            # If this site has been failing, don't bother sending it anything until it's had time to recover
+            if not circuit_breaker.allow(host):
+                return None
+            # Every attempt counts towards the site's limit, so wait our turn for each one
+            await rate_limiter.acquire(host, priority)
+            retry_after = None
+            status = None
+            try:
                 # Make the request, based on the method, url, and paramaters given
-                async with session.request(method, url, params=payload) as response:
-                    # If the request wasn't successful, re-attempt
-                    if response.status != 200:
-                        continue
-
-                    try:
-                        # Get the attribute requested
-                        return_value = getattr(response, attr)
-                        # Next check if this can be called
-                        if callable(return_value):
-                            return_value = return_value()
-                        # If this is awaitable, await it
-                        if inspect.isawaitable(return_value):
-                            return_value = await return_value
+                # This goes through the shared session, so that connections are reused between requests
+                async with http_session.request(method, url, params=payload, headers=headers) as response:
+                    status = response.status
+                    length = response.headers.get('Content-Length', '')
+                    size = int(length) if length.isdigit() else 0
+                    # Nothing has changed since we cached it, so what we have can be used for a while longer
+                    if response.status == 304 and cached is not None:
+                        circuit_breaker.success(host)
+                        response_cache.revalidate(cache_key, cached)
+                        cache = 'revalidated'
+                        succeeded = True
+                        return response_cache.value(cached)
+                    elif response.status != 200:
+                        # Only server errors mean the site itself is having issues, anything else means it's up
+                        if response.status >= 500:
+                            circuit_breaker.failure(host)
+                        else:
+                            circuit_breaker.success(host)
+                        # Things like a 404 aren't going to change by asking again
+                        if not policy.should_retry(response.status):
+                            return None
+                        retry_after = response.headers.get('Retry-After')
+                    else:
+                        circuit_breaker.success(host)
+                        try:
+                            # Get the attribute requested
+                            return_value = getattr(response, attr)
+                            # Next check if this can be called
+                            if callable(return_value):
+                                return_value = return_value()
+                            # If this is awaitable, await it
+                            if inspect.isawaitable(return_value):
+                                return_value = await return_value
+                        except AttributeError:
+                            # If an invalid attribute was requested, return None
+                            return None
+                        except ValueError:
+                            # The response didn't decode (like JSON that isn't valid), asking again won't change that
+                            return None
 
+                        if isinstance(return_value, (bytes, str)):
+                            size = len(return_value)
+                        if cache_key is not None:
+                            response_cache.set(cache_key, return_value, response.headers)
+                        succeeded = True
                         # Then return it
                         return return_value
-                    except AttributeError:
-                        # If an invalid attribute was requested, return None
-                        return None
-        # If an error was hit other than the one we want to catch, try again
-        except:
-            continue
+            except policy.exceptions:
+                circuit_breaker.failure(host)
+                status = None
+
+            # Wait before trying again, unless we'd go past how long we're allowed to keep trying for
+            if attempt == policy.attempts - 1:
+                break
+            # This also gives up if the site wants us to wait longer than we're willing to
+            delay = policy.delay(attempt, retry_after)
+            if delay is None or time.monotonic() + delay > deadline:
+                break
+            await asyncio.sleep(delay)
+    finally:
+        request_stats.record(url, time.perf_counter() - start, status=status, size=size, retries=attempt, cache=cache,
+                             error=not succeeded, **stats)
+
 
 async def update_records(key, winner, loser):
     # We're using the Harkness scale to rate
     # http://opnetchessclub.wikidot.com/harkness-rating-system
-    r_filter = lambda row: (row['member_id'] == winner.id) | (row['member_id'] == loser.id)
-    matches = await config.get_content(key, r_filter)
+    matches = await config.get_content_by_index(key, 'member_id', winner.id, loser.id)
 
     winner_stats = {}
     loser_stats = {}
@@ -164,9 +283,10 @@ async def update_records(key, winner, loser):
     winner_stats = {'wins': winner_wins, 'losses': winner_losses, 'rating': winner_rating}
     loser_stats = {'wins': loser_wins, 'losses': loser_losses, 'rating': loser_rating}
 
-    if not await config.update_content(key, winner_stats, {'member_id': winner.id}):
-        winner_stats['member_id'] = winner.id
-        await config.add_content(key, winner_stats, {'member_id': winner.id})
-    if not await config.update_content(key, loser_stats, {'member_id': loser.id}):
-        loser_stats['member_id'] = loser.id
-        await config.add_content(key, loser_stats, {'member_id': loser.id})
+    await config.upsert_content(key, {'member_id': winner.id}, winner_stats)
+    await config.upsert_content(key, {'member_id': loser.id}, loser_stats)
+
+    # Either of these could be battling for the first time, so make sure they're included in the rankings
+    if key == battle_rankings.table:
+        battle_rankings.add(winner.id)
+        battle_rankings.add(loser.id)
@@ -0,0 +1,286 @@
+import asyncio
+import copy
+import sys
+import tempfile
+import time
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from . import config
+from .requeststats import request_stats
+from .retry import default_retry
+
+loop = asyncio.get_event_loop()
+
+
+class HTTPSession:
+    """The one aiohttp session every outbound request goes through
+    Keeping a single session means connections (and their DNS lookups and TLS handshakes) are reused
+    between requests, instead of every request opening and closing it's own
+
+    The session is created the first time it's needed, since it has to be made inside the event loop
+    This is written for aiohttp 1.0 (what discord.py needs), where the connector can only limit connections per host,
+    DNS lookups are cached forever, and the timeout given to a request only covers connecting.
+    So the total limit, clearing the DNS cache, and timing out the whole request (reading the response included)
+    are all handled here instead
+
+    Paramaters:
+        limit -> The most requests that can be running at once, over every host
+        limit_per_host -> The most connections that can be open to any one host
+        dns_ttl -> How long (in seconds) a DNS lookup is reused for
+        keepalive -> How long (in seconds) an idle connection is kept open for, to be used by the next request
+        timeout -> How long (in seconds) a request can take before it's given up on
+        base_url -> If given, every request is sent here instead, with the host it was meant for as the start of the
+                    path (https://api.twitch.tv/kraken becomes base_url/api.twitch.tv/kraken). This is used to point
+                    the bot at a stand-in server for testing, like benchmarks/mock_upstream.py"""
+
+    def __init__(self, *, limit=100, limit_per_host=10, dns_ttl=300, keepalive=30, timeout=30, base_url=None):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_ttl = dns_ttl
+        self.keepalive = keepalive
+        self.timeout = timeout
+        self.base_url = base_url
+        self._session = None
+        self._slots = None
+        self._dns_cleared = time.monotonic()
+
+        # Counters that can be used to see how the session is holding up
+        self.requests = 0
+        self.in_use = 0
+        self.waiting = 0
+        self.sessions_created = 0
+
+    @property
+    def session(self):
+        """The aiohttp session, this is created (or recreated, if it was closed) as needed"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.limit_per_host, keepalive_timeout=self.keepalive,
+                                             use_dns_cache=True, loop=loop)
+            self._session = aiohttp.ClientSession(connector=connector, headers={'User-Agent': config.user_agent},
+                                                  loop=loop)
+            self._dns_cleared = time.monotonic()
+            self.sessions_created += 1
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.limit)
+        return self._session
+
+    def request(self, method, url, **kwargs):
+        """Makes a request, this is used the same way as aiohttp's ClientSession.request
+        async with http_session.request('GET', url) as response: ..."""
+        self.requests += 1
+        return _Request(self, method, self.rewrite(url), kwargs)
+
+    def rewrite(self, url):
+        """Returns where a request to url is actually sent, which is only different if base_url is set"""
+        if not self.base_url:
+            return url
+        parts = urlsplit(url)
+        rewritten = "{}/{}{}".format(self.base_url.rstrip('/'), parts.netloc, parts.path)
+        if parts.query:
+            rewritten += "?" + parts.query
+        return rewritten
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def _clear_dns(self):
+        # The connector never forgets an address on it's own, so start over every dns_ttl seconds
+        if self.dns_ttl and time.monotonic() - self._dns_cleared >= self.dns_ttl:
+            self.session.connector.clear_dns_cache()
+            self._dns_cleared = time.monotonic()
+
+    def stats(self):
+        """Returns a dictionary of the current state of the session"""
+        return {'in_use': self.in_use,
+                'waiting': self.waiting,
+                'limit': self.limit,
+                'limit_per_host': self.limit_per_host,
+                'requests': self.requests,
+                'sessions_created': self.sessions_created}
+
+    async def close(self):
+        """Closes the session, along with every connection it has open"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+class _Request:
+    """What HTTPSession.request returns, this is only meant to be used with async with
+    The timeout is started before waiting for a free slot and only stopped once the response has been released,
+    so reading the response counts towards it as well"""
+
+    def __init__(self, http_session, method, url, kwargs):
+        self.http_session = http_session
+        self.method = method
+        self.url = url
+        self.kwargs = kwargs
+        self._timeout = None
+        self._context = None
+        self._acquired = False
+
+    async def __aenter__(self):
+        session = self.http_session.session
+        self._timeout = aiohttp.Timeout(self.http_session.timeout, loop=loop)
+        self._timeout.__enter__()
+        try:
+            self.http_session.waiting += 1
+            try:
+                await self.http_session._slots.acquire()
+            finally:
+                self.http_session.waiting -= 1
+            self._acquired = True
+            self.http_session.in_use += 1
+            self.http_session._clear_dns()
+
+            self._context = session.request(self.method, self.url, **self.kwargs)
+            return await self._context.__aenter__()
+        except BaseException:
+            # If this was the timeout, this raises a TimeoutError in place of the cancellation
+            self._finish(*sys.exc_info())
+            raise
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            await self._context.__aexit__(exc_type, exc, tb)
+        finally:
+            self._finish(exc_type, exc, tb)
+
+    def _finish(self, exc_type, exc, tb):
+        if self._acquired:
+            self._acquired = False
+            self.http_session.in_use -= 1
+            self.http_session._slots.release()
+        self._timeout.__exit__(exc_type, exc, tb)
+
+
+class SingleFlight:
+    """Makes sure only one of the same request is ever running at a time
+    If a request is made while an identical one is still waiting on a response, it waits on that one
+    instead of sending another; everyone gets their own copy of the result, so no one can change it for the others"""
+
+    def __init__(self):
+        # The format for this is {key: task}, tasks are removed once they're done
+        self._running = {}
+
+        self.calls = 0
+        self.deduplicated = 0
+
+    async def run(self, key, coro):
+        """Runs coro, unless something with the same key is already running, in which case that's waited on"""
+        task = self._running.get(key)
+        if task is not None:
+            coro.close()
+            self.deduplicated += 1
+            # Shield it, so that one of the callers being cancelled doesn't cancel it for everyone else
+            return copy.deepcopy(await asyncio.shield(task))
+
+        self.calls += 1
+        task = loop.create_task(coro)
+        self._running[key] = task
+        task.add_done_callback(lambda t: self._running.pop(key, None))
+        return copy.deepcopy(await asyncio.shield(task))
+
+    def stats(self):
+        return {'calls': self.calls,
+                'deduplicated': self.deduplicated,
+                'in_flight': len(self._running)}
+
+
+async def download(url, *, max_size=None, content_types=None, into=None, chunk_size=64 * 1024, retry=None):
+    """Downloads url a chunk at a time, and returns the file it was written to (seeked back to the start)
+    None is returned if it couldn't be downloaded, wasn't one of the content types given, or was bigger than max_size
+    This stops as soon as we know it's too big, instead of reading the whole thing first
+
+    Paramaters:
+        max_size -> The most (in bytes) that can be downloaded, download_max_size is used if this isn't given
+        content_types -> A list of what the Content-Type has to start with (like image/), anything is allowed if None
+        into -> The file to write to (like a BytesIO that's being reused), it's emptied first.
+                If this isn't given, a temporary file is used that's only held in memory until it gets too big
+        retry -> The retry policy used when the download fails, the default policy if this isn't given"""
+    policy = retry or default_retry
+    deadline = time.monotonic() + policy.deadline
+    max_size = max_size or config.download_max_size
+    if into is None:
+        file = tempfile.SpooledTemporaryFile(max_size=config.download_spool_size)
+    else:
+        file = into
+
+    status = None
+    size = 0
+    attempt = 0
+    # Only failing to get a response is an error; turning down what we got (like it being too big) is on purpose
+    error = False
+    start = time.perf_counter()
+    try:
+        for attempt in range(policy.attempts):
+            # Start over, in case the last attempt got part of the way through
+            file.seek(0)
+            file.truncate()
+            size = 0
+            retry_after = None
+            try:
+                async with http_session.get(url) as response:
+                    status = response.status
+                    error = False
+                    if response.status != 200:
+                        if not policy.should_retry(response.status):
+                            return _discard(file, into)
+                        retry_after = response.headers.get('Retry-After')
+                    else:
+                        content_type = response.headers.get('Content-Type', '')
+                        if content_types is not None and not content_type.startswith(tuple(content_types)):
+                            return _discard(file, into)
+                        # If we're told how big it is, we can give up before reading any of it
+                        length = response.headers.get('Content-Length')
+                        if length is not None and length.isdigit() and int(length) > max_size:
+                            return _discard(file, into)
+
+                        while True:
+                            chunk = await response.content.read(chunk_size)
+                            if not chunk:
+                                break
+                            size += len(chunk)
+                            if size > max_size:
+                                return _discard(file, into)
+                            file.write(chunk)
+                        file.seek(0)
+                        return file
+            except policy.exceptions:
+                status = None
+                error = True
+
+            # Wait before trying again, unless we'd go past how long we're allowed to keep trying for
+            if attempt == policy.attempts - 1:
+                break
+            # This also gives up if the site wants us to wait longer than we're willing to
+            delay = policy.delay(attempt, retry_after)
+            if delay is None or time.monotonic() + delay > deadline:
+                break
+            await asyncio.sleep(delay)
+        return _discard(file, into)
+    finally:
+        request_stats.record(url, time.perf_counter() - start, status=status, size=size, retries=attempt, error=error,
+                             endpoint='(download)', caller=config.query_stats.caller())
+
+
+def _discard(file, into):
+    # Don't leave anything half written in a file we were given, and close the one we made
+    if into is None:
+        file.close()
+    else:
+        file.seek(0)
+        file.truncate()
+    return None
+
+
+http_session = HTTPSession(limit=config.http_limit, limit_per_host=config.http_limit_per_host,
+                           dns_ttl=config.http_dns_ttl, keepalive=config.http_keepalive, timeout=config.http_timeout,
+                           base_url=config.http_base_url or None)
+# Identical requests that are made at the same time share one response
+single_flight = SingleFlight()